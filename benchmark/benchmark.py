@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf8
+
+# benchmark.py
+# Runs all stages of topo2osm offline on synthetic Topo10 files and reports run time and memory for each stage.
+# Results are compared with the stored baseline for the same size, or saved as new baseline with -save.
+# Usage: python benchmark.py [small|medium|large] [-save] [-planar]
+
+
+import sys
+import os
+import json
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import topo2osm
+import synthetic_topo
+
+
+sizes = {  # Tiles x, tiles y, cells per tile
+	'small':  (2, 2, 8),
+	'medium': (4, 4, 12),
+	'large':  (6, 6, 16)
+}
+
+baseline_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+
+
+# Run complete topo2osm process on synthetic data of given size in folder.
+# Returns profile report.
+
+def run_benchmark (folder, size, name=""):
+
+	boundary = synthetic_topo.generate(folder, *size)
+
+	# Set up same globals as the main program of topo2osm
+
+	topo2osm.features = topo2osm.TopoList()
+	topo2osm.segments = topo2osm.TopoList()
+	topo2osm.nodes = set()
+	topo2osm.node_table = topo2osm.NodeTable()
+	topo2osm.place_names = topo2osm.TopoList()
+	topo2osm.operation_counts = {}
+	topo2osm.building_tags = {}
+
+	topo2osm.topo_folder = folder + "/"
+	topo2osm.place_name_folder = folder + "/"
+	topo2osm.municipality_id = "9999"
+	topo2osm.municipality_name = "Synthetic"
+	topo2osm.municipality_boundary = boundary
+	topo2osm.data_category = "topo"
+	topo2osm.token = ""
+
+	topo2osm.profile = True
+	topo2osm.count_operations = True
+	topo2osm.stage_profile = topo2osm.StageProfile()
+
+	topo2osm.process_data(os.path.join(folder, "benchmark"))
+
+	report_filename = os.path.join(folder, "benchmark_profile.json")
+	topo2osm.stage_profile.save(report_filename, benchmark=name, size=list(size), planar=topo2osm.planar)
+
+	file = open(report_filename)
+	report = json.load(file)
+	file.close()
+	return report
+
+
+
+# Compare report with baseline and output table of stages
+
+def compare_report (report, baseline):
+
+	baseline_stages = { stage['stage']: stage for stage in baseline['stages'] }
+
+	# Memory is the peak memory of the process so far, and how much each stage increased it
+
+	sys.stdout.write("\n%-16s %10s %10s %8s %12s %12s\n" % ("Stage", "Baseline", "Now", "Ratio", "Peak so far", "Increase MB"))
+	for stage in report['stages'] + [ dict(report, stage="total", process_peak_mb=report['peak_memory_mb']) ]:
+		if stage['stage'] == "total":
+			old = baseline
+		else:
+			old = baseline_stages.get(stage['stage'])
+		if old and old['wall_time'] > 0:
+			sys.stdout.write("%-16s %9.3fs %9.3fs %7.2fx %12s %12s\n" % (stage['stage'], old['wall_time'], stage['wall_time'],
+								stage['wall_time'] / old['wall_time'], stage.get('process_peak_mb'), stage.get('peak_increase_mb', "")))
+		else:
+			sys.stdout.write("%-16s %10s %9.3fs %8s %12s %12s\n" % (stage['stage'], "-", stage['wall_time'], "-",
+								stage.get('process_peak_mb'), stage.get('peak_increase_mb', "")))
+
+	# Item counts should not change unless the output changes
+
+	last_stage = report['stages'][-1]
+	old_stage = baseline_stages.get(last_stage['stage'])
+	if old_stage:
+		for key in [ 'features', 'segments', 'nodes', 'common_nodes', 'place_names' ]:
+			if last_stage.get(key) != old_stage.get(key):
+				sys.stdout.write("*** Different number of %s: %s in baseline, %s now\n" % (key, old_stage.get(key), last_stage.get(key)))
+
+
+
+# Main program
+
+if __name__ == '__main__':
+
+	arguments = [ argument for argument in sys.argv[1:] if not argument.startswith("-") ]
+	benchmark_name = arguments[0] if arguments else "small"
+	if benchmark_name not in sizes:
+		sys.exit("Unknown benchmark size '%s', choose one of: %s\n" % (benchmark_name, ", ".join(sizes)))
+
+	if "-planar" in sys.argv:
+		topo2osm.planar = True
+		benchmark_name += "_planar"
+
+	folder = tempfile.mkdtemp(prefix="topo2osm_benchmark_")
+	try:
+		report = run_benchmark(folder, sizes[ benchmark_name.split("_")[0] ], benchmark_name)
+	finally:
+		shutil.rmtree(folder)
+
+	baseline_filename = os.path.join(baseline_folder, benchmark_name + ".json")
+
+	if "-save" in sys.argv:
+		os.makedirs(baseline_folder, exist_ok=True)
+		file = open(baseline_filename, "w")
+		json.dump(report, file, indent=2, ensure_ascii=False)
+		file.close()
+		sys.stdout.write("\nSaved baseline to '%s'\n" % baseline_filename)
+
+	elif os.path.isfile(baseline_filename):
+		file = open(baseline_filename)
+		baseline = json.load(file)
+		file.close()
+		compare_report(report, baseline)
+
+	else:
+		sys.stdout.write("\nNo baseline '%s' found, use -save to store one\n" % baseline_filename)
+
+	sys.stdout.write("\n")
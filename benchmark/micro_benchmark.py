@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf8
+
+# micro_benchmark.py
+# Micro benchmark of geometry functions in topo2osm which are called millions of times.
+# Measures time per call and peak memory allocated per call on fixtures of coastline rings, forest polygons and streams.
+# Optimised variants of a function may be added to the variants table below. They are timed next to the
+# current implementation and their results are checked against the current implementation on the same fixtures.
+# Usage: python micro_benchmark.py [-planar] [function ...]
+
+
+import sys
+import os
+import math
+import random
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import topo2osm
+
+
+min_time = 0.2		# Minimum seconds for each timing
+repeat = 3			# Timings per case, best one is reported
+
+
+
+# Build fixtures, i.e. typical geometry in WGS84 or in EPSG:3006 if planar.
+# Returns dict of fixture name and geometry.
+
+def build_fixtures (planar):
+
+	rnd = random.Random(1)
+	precision = topo2osm.planar_precision if planar else topo2osm.precision
+
+	# Convert from meters around a centre to coordinates
+
+	def node(x, y):
+		if planar:
+			return (round(600000 + x, precision), round(6600000 + y, precision))
+		else:
+			return (round(15.0 + x / (111320.0 * math.cos(math.radians(59.5))), precision), round(59.5 + y / 111320.0, precision))
+
+	# Irregular closed ring, clockwise, with given number of nodes and radius in meters
+
+	def ring(nodes, radius, roughness):
+		coordinates = []
+		for i in range(nodes):
+			angle = - 2 * math.pi * i / nodes
+			r = radius * (1 + roughness * (rnd.random() - 0.5))
+			coordinates.append(node(r * math.cos(angle), r * math.sin(angle)))
+		coordinates.append(coordinates[0])
+		return coordinates
+
+	# Meandering line with given number of nodes and node distance in meters
+
+	def line(nodes, step):
+		coordinates = []
+		x = y = 0.0
+		direction = 0.0
+		for i in range(nodes):
+			coordinates.append(node(x, y))
+			direction += (rnd.random() - 0.5) * 0.8
+			x += step * math.cos(direction)
+			y += step * math.sin(direction)
+		return coordinates
+
+	fixtures = {}
+	fixtures['coastline'] = ring(2000, 3000, 0.3)
+	fixtures['forest'] = [ ring(200, 400, 0.2), list(reversed(ring(40, 100, 0.2))) ]  # Outer and inner ring
+	fixtures['stream'] = line(100, 20)
+	fixtures['stream_parallel'] = [ (x, y + (2 if planar else 0.00002)) for x, y in fixtures['stream'] ]
+	fixtures['point_inside'] = node(0, 250)
+	fixtures['point_outside'] = node(5000, 5000)
+
+	# Ring touching itself at one node, for split_patch
+
+	touching = ring(300, 500, 0.1)
+	touching = touching[:150] + [ touching[20] ] + touching[150:]
+	fixtures['touching_ring'] = touching
+
+	return fixtures
+
+
+
+# Cases of function calls with fixtures.
+# Returns list of (function name, case name, tuple of arguments).
+
+def build_cases (fixtures):
+
+	coastline = fixtures['coastline']
+	forest = fixtures['forest']
+	stream = fixtures['stream']
+	tolerance = topo2osm.simplify_factor
+
+	return [
+		('polygon_area', "coastline 2000", (coastline,)),
+		('polygon_area', "forest 200", (forest[0],)),
+		('inside_polygon', "coastline 2000", (fixtures['point_inside'], coastline)),
+		('inside_polygon', "forest 200", (fixtures['point_inside'], forest[0])),
+		('inside_multipolygon', "forest with hole", (fixtures['point_inside'], forest)),
+		('line_distance', "one segment", (stream[0], stream[1], stream[5])),
+		('shortest_distance', "stream 100", (fixtures['point_inside'], stream)),
+		('shortest_distance', "coastline 2000", (fixtures['point_outside'], coastline)),
+		('simplify_line', "stream 100", (stream, tolerance)),
+		('simplify_line', "coastline 2000", (coastline, tolerance)),
+		('split_patch', "coastline 2000", (coastline,)),
+		('split_patch', "touching ring 300", (fixtures['touching_ring'],)),
+		('get_bbox', "coastline 2000", (coastline,)),
+		('get_bbox', "stream 100", (stream,)),
+		('hausdorff_distance', "parallel streams 100", (stream, fixtures['stream_parallel'])),
+		('hausdorff_distance', "streams with limit", (stream, fixtures['stream_parallel'], 1.0))
+	]
+
+
+
+# Optimised variants to be compared with the current implementations.
+# Each variant must return the same result as the function in topo2osm.
+
+def polygon_area_zip (polygon):
+
+	if polygon[0] != polygon[-1]:
+		return 0
+
+	if topo2osm.planar:
+		area = sum((y2 - y1) * (x2 + x1) for (x1, y1), (x2, y2) in zip(polygon, polygon[1:]))
+	else:
+		lat_dist = math.pi * 6371009.0 / 180.0
+		cos = math.cos
+		radians = math.radians
+		coord = [ (x * lat_dist * cos(radians(y)), y * lat_dist) for x, y in polygon ]
+		area = sum((y2 - y1) * (x2 + x1) for (x1, y1), (x2, y2) in zip(coord, coord[1:]))
+
+	return int(area / 2.0)
+
+
+def get_bbox_zip (coordinates):
+
+	x, y = zip(*coordinates)
+	return [ [ min(x), min(y) ], [ max(x), max(y) ] ]
+
+
+variants = {
+	'polygon_area': [ polygon_area_zip ],
+	'get_bbox': [ get_bbox_zip ]
+}
+
+
+
+# Time function on arguments.
+# Returns nanoseconds per call and peak bytes allocated per call.
+
+def measure (function, arguments):
+
+	timer = timeit.Timer(lambda: function(*arguments))
+	number, elapsed = timer.autorange()
+	number = max(number, int(number * min_time / max(elapsed, 1e-9)))
+	best = min(timer.repeat(repeat=repeat, number=number))
+
+	tracemalloc.start()
+	function(*arguments)
+	current, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	return (best / number * 1e9, peak)
+
+
+
+# Compare results, with tolerance for floats
+
+def same_result (result1, result2):
+
+	if isinstance(result1, float) or isinstance(result2, float):
+		return math.isclose(result1, result2, rel_tol=1e-9, abs_tol=1e-9)
+	elif isinstance(result1, (list, tuple)) and isinstance(result2, (list, tuple)):
+		return len(result1) == len(result2) and all(same_result(a, b) for a, b in zip(result1, result2))
+	else:
+		return result1 == result2
+
+
+
+# Main program
+
+if __name__ == '__main__':
+
+	if "-planar" in sys.argv:
+		topo2osm.planar = True
+
+	selected = [ argument for argument in sys.argv[1:] if not argument.startswith("-") ]
+
+	cases = build_cases(build_fixtures(topo2osm.planar))
+	errors = 0
+
+	sys.stdout.write("\n%-22s %-22s %-20s %12s %12s\n" % ("Function", "Case", "Implementation", "ns/op", "Peak bytes"))
+
+	for function_name, case_name, arguments in cases:
+		if selected and function_name not in selected:
+			continue
+
+		current = getattr(topo2osm, function_name)
+		current_result = current(*arguments)
+
+		ns, peak = measure(current, arguments)
+		sys.stdout.write("%-22s %-22s %-20s %12.0f %12i\n" % (function_name, case_name, "current", ns, peak))
+
+		for variant in variants.get(function_name, []):
+			if same_result(variant(*arguments), current_result):
+				variant_ns, variant_peak = measure(variant, arguments)
+				sys.stdout.write("%-22s %-22s %-20s %12.0f %12i  %.2fx\n" % ("", "", variant.__name__, variant_ns, variant_peak, ns / variant_ns))
+			else:
+				sys.stdout.write("%-22s %-22s %-20s  *** Result differs from current implementation\n" % ("", "", variant.__name__))
+				errors += 1
+
+	sys.stdout.write("\n")
+	if errors:
+		sys.exit("%i variants with different results\n" % errors)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf8
+
+# planar_check.py
+# Runs all stages of topo2osm on synthetic Topo10 files in WGS84 and in planar (EPSG:3006) mode and checks that
+# the output is the same. Ways and relations are compared by tags and member roles, since coordinates may differ
+# in the last decimal after projection to WGS84 at output. The number of nodes may differ slightly after simplification.
+# Usage: python planar_check.py [small|medium|large]
+
+
+import sys
+import os
+import shutil
+import tempfile
+from collections import Counter
+from xml.etree import ElementTree as ET
+
+import benchmark
+import topo2osm
+
+
+node_tolerance = 0.001		# Allowed share of nodes which differ after simplification
+
+
+
+# Run complete topo2osm process in given mode on synthetic data of given size in folder.
+# Returns filename of output.
+
+def run_mode (folder, size, planar):
+
+	topo2osm.planar = planar
+	name = "planar" if planar else "wgs84"
+	benchmark.run_benchmark(folder, size, name)
+
+	filename = os.path.join(folder, name + ".osm")
+	os.replace(os.path.join(folder, "benchmark.osm"), filename)
+	return filename
+
+
+
+# Summary of output file, independent of ids and coordinates.
+# Returns number of nodes and Counter of ways and relations with tags and member roles.
+
+def get_summary (filename):
+
+	node_count = 0
+	elements = Counter()
+
+	for element in ET.parse(filename).getroot():
+		tags = tuple(sorted((tag.get('k'), tag.get('v')) for tag in element.iter("tag")))
+		if element.tag == "node":
+			node_count += 1
+			if tags:
+				elements[ ("node", tags) ] += 1
+		elif element.tag == "way":
+			elements[ ("way", tags) ] += 1
+		elif element.tag == "relation":
+			roles = tuple(sorted(Counter(member.get('role') for member in element.iter("member")).items()))
+			elements[ ("relation", tags, roles) ] += 1
+
+	return node_count, elements
+
+
+
+# Compare output of the two modes and report differences.
+# Returns True if output is the same.
+
+def compare_output (wgs84_filename, planar_filename):
+
+	wgs84_nodes, wgs84_elements = get_summary(wgs84_filename)
+	planar_nodes, planar_elements = get_summary(planar_filename)
+	same = True
+
+	sys.stdout.write("\n%-10s %10s %10s\n" % ("Element", "WGS84", "Planar"))
+	for element_type in ["relation", "way"]:
+		sys.stdout.write("%-10s %10i %10i\n" % (element_type,
+							sum(count for key, count in wgs84_elements.items() if key[0] == element_type),
+							sum(count for key, count in planar_elements.items() if key[0] == element_type)))
+	sys.stdout.write("%-10s %10i %10i\n" % ("node", wgs84_nodes, planar_nodes))
+
+	for label, difference in [ ("WGS84", wgs84_elements - planar_elements), ("planar", planar_elements - wgs84_elements) ]:
+		for key, count in sorted(difference.items()):
+			sys.stdout.write("*** Only in %s output: %i %s %s\n" % (label, count, key[0], dict(key[1])))
+			same = False
+
+	if abs(wgs84_nodes - planar_nodes) > node_tolerance * max(wgs84_nodes, planar_nodes):
+		sys.stdout.write("*** Different number of nodes\n")
+		same = False
+
+	return same
+
+
+
+# Main program
+
+if __name__ == '__main__':
+
+	arguments = [ argument for argument in sys.argv[1:] if not argument.startswith("-") ]
+	size_name = arguments[0] if arguments else "small"
+	if size_name not in benchmark.sizes:
+		sys.exit("Unknown size '%s', choose one of: %s\n" % (size_name, ", ".join(benchmark.sizes)))
+
+	folder = tempfile.mkdtemp(prefix="topo2osm_planar_check_")
+	try:
+		wgs84_filename = run_mode(folder, benchmark.sizes[ size_name ], False)
+		planar_filename = run_mode(folder, benchmark.sizes[ size_name ], True)
+		same = compare_output(wgs84_filename, planar_filename)
+	finally:
+		shutil.rmtree(folder)
+
+	if same:
+		sys.stdout.write("\nSame output in WGS84 and planar mode\n\n")
+	else:
+		sys.exit("\n*** Different output in WGS84 and planar mode\n\n")
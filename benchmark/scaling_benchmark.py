@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf8
+
+# scaling_benchmark.py
+# Runs all stages of topo2osm on synthetic Topo10 files of increasing size and estimates how the run time
+# of each stage grows with the number of polygons and segments, as the exponent k in time = c * n^k.
+# Stages growing faster than n log n are flagged.
+# Usage: python scaling_benchmark.py [-sizes 1000,10000,100000] [-save] [-planar]
+# The default sizes run in about a minute. Large sizes may take hours for stages which are quadratic.
+
+
+import sys
+import os
+import json
+import math
+import shutil
+import tempfile
+
+import benchmark
+
+
+default_sizes = [ 500, 1000, 2000, 4000 ]	# Approximate number of cells (polygons) in synthetic data
+cells_per_tile = 12						# Cells along each side of a 10x10 km tile
+min_time = 0.01							# Shorter stage times are too inaccurate for fitting
+margin = 0.2							# Allowed exponent above n log n before a stage is flagged
+
+
+
+# Tiles and cells per tile for given approximate number of cells.
+# The cells are 1 tile wide for small sizes.
+
+def synthetic_size (cell_count):
+
+	side = max(2, int(round(math.sqrt(cell_count))))
+	tiles = max(1, int(round(side / cells_per_tile)))
+	cells = max(2, int(round(side / tiles)))
+	return (tiles, tiles, cells)
+
+
+
+# Least squares slope of y against x
+
+def slope (x, y):
+
+	n = len(x)
+	mean_x = sum(x) / n
+	mean_y = sum(y) / n
+	variance = sum((xi - mean_x) ** 2 for xi in x)
+	if variance == 0:
+		return None
+	return sum((xi - mean_x) * (yi - mean_y) for xi, yi in zip(x, y)) / variance
+
+
+
+# Estimate growth exponent of each stage from list of profile reports.
+# Returns list of (stage, times, exponent, exponent of n log n, flag).
+
+def fit_stages (reports):
+
+	counts = []
+	for report in reports:
+		load = [ stage for stage in report['stages'] if stage['stage'] == "load" ][0]
+		counts.append(load['features'] + load['segments'])  # Polygons, lines and segments after loading
+
+	stage_names = []
+	for report in reports:
+		for stage in report['stages']:
+			if stage['stage'] not in stage_names:
+				stage_names.append(stage['stage'])
+
+	results = []
+	for name in stage_names + [ "total" ]:
+		times = []
+		for report in reports:
+			if name == "total":
+				times.append(report['wall_time'])
+			else:
+				times.append(sum(stage['wall_time'] for stage in report['stages'] if stage['stage'] == name))
+
+		points = [ (n, t) for n, t in zip(counts, times) if t >= min_time ]
+		exponent = None
+		reference = None
+		flag = False
+		if len(points) >= 2:
+			log_n = [ math.log(n) for n, t in points ]
+			exponent = slope(log_n, [ math.log(t) for n, t in points ])
+			reference = slope(log_n, [ math.log(n * math.log(n)) for n, t in points ])
+			flag = exponent is not None and reference is not None and exponent > reference + margin
+
+		results.append((name, times, exponent, reference, flag))
+
+	return counts, results
+
+
+
+# Main program
+
+if __name__ == '__main__':
+
+	sizes = default_sizes
+	if "-sizes" in sys.argv:
+		sizes = [ int(size) for size in sys.argv[ sys.argv.index("-sizes") + 1 ].split(",") ]
+
+	name = "scaling"
+	if "-planar" in sys.argv:
+		benchmark.topo2osm.planar = True
+		name += "_planar"
+
+	reports = []
+	for cell_count in sizes:
+		size = synthetic_size(cell_count)
+		folder = tempfile.mkdtemp(prefix="topo2osm_scaling_")
+		try:
+			reports.append(benchmark.run_benchmark(folder, size, "%s_%i" % (name, cell_count)))
+		finally:
+			shutil.rmtree(folder)
+
+	counts, results = fit_stages(reports)
+
+	sys.stdout.write("\n%-16s" % "Stage" + "".join("%10s" % ("n=%i" % n) for n in counts) + "%10s%10s\n" % ("Exponent", "n log n"))
+	for stage, times, exponent, reference, flag in results:
+		sys.stdout.write("%-16s" % stage + "".join("%9.3fs" % t for t in times))
+		if exponent is None:
+			sys.stdout.write("%10s%10s\n" % ("-", "-"))
+		else:
+			sys.stdout.write("%10.2f%10.2f%s\n" % (exponent, reference, "  *** Faster growth than n log n" if flag else ""))
+
+	if "-save" in sys.argv:
+		filename = os.path.join(benchmark.baseline_folder, name + ".json")
+		output = {
+			'sizes': sizes,
+			'counts': counts,
+			'stages': [ { 'stage': stage, 'wall_time': times, 'exponent': exponent, 'n_log_n_exponent': reference, 'flagged': flag }
+						for stage, times, exponent, reference, flag in results ]
+		}
+		os.makedirs(benchmark.baseline_folder, exist_ok=True)
+		file = open(filename, "w")
+		json.dump(output, file, indent=2)
+		file.close()
+		sys.stdout.write("\nSaved scaling results to '%s'\n" % filename)
+
+	sys.stdout.write("\n")
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf8
+
+# synthetic_topo.py
+# Generates synthetic Topo10 files for benchmarking topo2osm without the licensed Lantmäteriet files.
+# The area is a number of 10x10 km grid tiles divided into square cells of land cover, lakes and sea.
+# Usage: python synthetic_topo.py <folder> [tiles_x] [tiles_y] [cells per tile]
+
+
+import sys
+import os
+import datetime
+from geopandas import gpd
+from shapely.geometry import Polygon, LineString, box
+
+
+grid_size = 10000			# Size of tiles in meters, same as in topo2osm
+base_x = 500000				# Lower left corner of area in EPSG:3006
+base_y = 6500000
+
+land_cover = [ 'Barr- och blandskog', 'Åker', 'Sjö', 'Låg bebyggelse' ]  # Repeated in diagonal pattern
+
+
+
+# Deterministic pseudo random offset in interval [-amplitude, amplitude] for given integers
+
+def jitter (a, b, amplitude):
+
+	h = (a * 73856093) ^ (b * 19349663)
+	h = (h * 2654435761) & 0xffffffff
+	return (h / 0xffffffff - 0.5) * 2 * amplitude
+
+
+
+# Generate synthetic Topo10 files in folder:
+# - Topo10/mark_sverige.gpkg with layers "mark", "markkantlinje" and "sankmark"
+# - Topo10/hydro_sverige.gpkg with layer "hydrolinje"
+# - ortnamn_Sverige_multipoint.geojson with place names
+# Cells are cut by tile edges (grid lines), and neighbour cells share boundary lines ("gräns", "Strandlinje").
+# Lakes and sea ("Hav") cells contain one island, forest cells contain two wetland polygons ("Sankmark")
+# with a common side and a stream network ("Vattendrag").
+# Returns the municipality boundary as a GeoDataFrame in EPSG:3006.
+
+def generate (folder, tiles_x=2, tiles_y=2, cells=8):
+
+	c = grid_size / cells	# Cell size
+	s = c / 4				# Node distance along cell sides
+	amp = s / 6				# Jitter of nodes along cell sides
+	x_max = base_x + tiles_x * grid_size
+	y_max = base_y + tiles_y * grid_size
+
+	origin_x = base_x - c / 2  # Cells are shifted half a cell to be cut by tile edges
+	origin_y = base_y - c / 2
+	nx = int(tiles_x * cells) + 1
+	ny = int(tiles_y * cells) + 1
+
+	tile_x = [ base_x + t * grid_size for t in range(tiles_x + 1) ]
+	tile_y = [ base_y + t * grid_size for t in range(tiles_y + 1) ]
+
+
+	# Inner functions for building nodes along cell sides
+
+	def on_tile(v):
+		return abs(v / grid_size - round(v / grid_size)) < 1e-9
+
+	def is_corner(v, origin):
+		return abs(((v - origin) / c) - round((v - origin) / c)) < 1e-9
+
+	def cell_type(i, j):
+		object_type = land_cover[ (i + 2 * j) % 4 ]
+		if object_type == 'Sjö' and (i * 7 + j * 3) % 5 == 0:
+			object_type = 'Hav'
+		return object_type
+
+	def vertical_node(x, y, corner):
+		if corner or on_tile(y):
+			return (x, y)
+		return (x + jitter(int(x), int(y), amp), y)
+
+	def horizontal_node(x, y, corner):
+		if corner or on_tile(x):
+			return (x, y)
+		return (x, y + jitter(int(y), int(x) + 7, amp))
+
+	def lattice(v0, v1, origin):  # Node positions strictly between v0 and v1
+		values = []
+		m = int((v0 - origin) // s) + 1
+		while origin + m * s < v1 - 1e-6:
+			v = origin + m * s
+			if v > v0 + 1e-6:
+				values.append(v)
+			m += 1
+		return values
+
+	def side_nodes(fixed, v0, v1, vertical, on_cell_side):  # Nodes from v0 to v1, inclusive
+		low, high = min(v0, v1), max(v0, v1)
+		origin = origin_y if vertical else origin_x
+		values = [ low ] + (lattice(low, high, origin) if on_cell_side else []) + [ high ]
+		if v1 < v0:
+			values.reverse()
+		side = []
+		for v in values:
+			corner = is_corner(v, origin) or v in (low, high) and not on_cell_side
+			if vertical:
+				side.append(vertical_node(fixed, v, corner) if on_cell_side else (fixed, v))
+			else:
+				side.append(horizontal_node(v, fixed, corner) if on_cell_side else (v, fixed))
+		return side
+
+	def new_id():
+		object_count[0] += 1
+		return "synt-%08i" % object_count[0]
+
+
+	# Start of main function
+
+	mark = []
+	lines = []
+	wetland = []
+	streams = []
+	names = []
+	object_count = [0]
+
+	for i in range(nx):
+		for j in range(ny):
+			cx0 = origin_x + i * c
+			cy0 = origin_y + j * c
+			cx1 = cx0 + c
+			cy1 = cy0 + c
+			object_type = cell_type(i, j)
+
+			# Cut cell by tile edges
+
+			pieces = []
+			for tx in range(tiles_x):
+				for ty in range(tiles_y):
+					x0 = max(cx0, tile_x[ tx ])
+					x1 = min(cx1, tile_x[ tx + 1 ])
+					y0 = max(cy0, tile_y[ ty ])
+					y1 = min(cy1, tile_y[ ty + 1 ])
+					if x1 - x0 > 1e-6 and y1 - y0 > 1e-6:
+						pieces.append((x0, y0, x1, y1))
+			whole_cell = (len(pieces) == 1 and pieces[0] == (cx0, cy0, cx1, cy1))
+
+			# Land cover polygons, clockwise
+
+			for (x0, y0, x1, y1) in pieces:
+				ring = []
+				ring += side_nodes(x0, y0, y1, True, abs(x0 - cx0) < 1e-9)[:-1]
+				ring += side_nodes(y1, x0, x1, False, abs(y1 - cy1) < 1e-9)[:-1]
+				ring += side_nodes(x1, y1, y0, True, abs(x1 - cx1) < 1e-9)[:-1]
+				ring += side_nodes(y0, x1, x0, False, abs(y0 - cy0) < 1e-9)[:-1]
+				ring.append(ring[0])
+
+				holes = []
+				if object_type in ['Sjö', 'Hav'] and whole_cell:
+					mx = cx0 + c / 2
+					my = cy0 + c / 2
+					h = c / 8
+					island = [ (mx - h, my - h), (mx, my - h), (mx + h, my - h), (mx + h, my), (mx + h, my + h),
+								(mx, my + h), (mx - h, my + h), (mx - h, my), (mx - h, my - h) ]  # Counter-clockwise
+					holes.append(island)
+					mark.append({ 'objekttyp': 'Barr- och blandskog', 'geometry': Polygon(list(reversed(island))) })
+					lines.append({ 'objekttyp': 'Strandlinje, hav' if object_type == 'Hav' else 'Strandlinje, sjö',
+									'geometry': LineString(island) })
+					names.append(( 'Sjö', "Sjö %i-%i" % (i, j), (cx0 + c / 3, cy0 + c / 3) ))
+					names.append(( 'Terräng', "Ön %i-%i" % (i, j), (mx, my) ))
+
+				mark.append({ 'objekttyp': object_type, 'geometry': Polygon(ring, holes) })
+
+			# Two wetland polygons with common side
+
+			if object_type == 'Barr- och blandskog' and whole_cell and (i + j) % 3 == 0:
+				w = c / 6
+				ax = cx0 + c / 5
+				ay = cy0 + c / 5
+				square1 = [ (ax, ay), (ax, ay + w), (ax + w, ay + w), (ax + w, ay), (ax, ay) ]
+				square2 = [ (ax + w, ay), (ax + w, ay + w), (ax + 2 * w, ay + w), (ax + 2 * w, ay), (ax + w, ay) ]
+				wetland.append({ 'objekttyp': 'Sankmark, fast', 'geometry': Polygon(square1) })
+				wetland.append({ 'objekttyp': 'Sankmark, våt', 'geometry': Polygon(square2) })
+				names.append(( 'Sankmark', "Myren %i-%i" % (i, j), (ax + w / 2, ay + w / 2) ))
+
+			# Boundary lines at right side and top side of cell, cut by tile edges and municipality bbox
+
+			for (side, other) in [ ('right', (i + 1, j)), ('top', (i, j + 1)) ]:
+				if other[0] >= nx or other[1] >= ny:
+					continue
+
+				pair = { object_type, cell_type(*other) }
+				if 'Hav' in pair:
+					line_type = 'Strandlinje, hav'
+				elif 'Sjö' in pair:
+					line_type = 'Strandlinje, sjö'
+				elif 'Låg bebyggelse' in pair:
+					line_type = 'Bebyggelseområdesgräns'
+				elif 'Åker' in pair:
+					line_type = 'Odlingsmarksgräns'
+				else:
+					line_type = 'Skogsmarksgräns'
+
+				if side == 'right':
+					if base_x <= cx1 <= x_max:
+						cuts = [ cy0 ] + [ y for y in tile_y if cy0 < y < cy1 ] + [ cy1 ]
+						for a, b in zip(cuts[:-1], cuts[1:]):
+							a, b = max(a, base_y), min(b, y_max)
+							if b - a > 1e-6:
+								lines.append({ 'objekttyp': line_type, 'geometry': LineString(side_nodes(cx1, a, b, True, True)) })
+				else:
+					if base_y <= cy1 <= y_max:
+						cuts = [ cx0 ] + [ x for x in tile_x if cx0 < x < cx1 ] + [ cx1 ]
+						for a, b in zip(cuts[:-1], cuts[1:]):
+							a, b = max(a, base_x), min(b, x_max)
+							if b - a > 1e-6:
+								lines.append({ 'objekttyp': line_type, 'geometry': LineString(side_nodes(cy1, a, b, False, True)) })
+
+			# Stream network from centre of forest cell to node at right side of cell.
+			# Main stream is split in two parts with the same id, and a tributary joins at the split node.
+
+			if object_type == 'Barr- och blandskog' and whole_cell and i + 1 < nx:
+				mx = cx0 + c / 2
+				my = cy0 + c / 2
+				end = vertical_node(cx1, my, False)
+				stream = [ (mx + k * (end[0] - mx) / 5, my + jitter(i, j + k, amp) if 0 < k < 5 else my) for k in range(6) ]
+				stream[-1] = end
+				tributary = [ (stream[3][0] - c / 10, stream[3][1] + c / 6), (stream[3][0] - c / 20, stream[3][1] + c / 12), stream[3] ]
+				stream_id = "synt-vd-%i-%i" % (i, j)
+
+				for part, size in [ (stream[:4], 1), (stream[3:], 1), (tributary, 2) ]:
+					streams.append({ 'objekttyp': 'Vattendrag', 'kanal': 'Nej',
+									'storleksklass': "Klass %i" % size,
+									'vattendragsid': stream_id if size == 1 else stream_id + "-t",
+									'geometry': LineString(part) })
+				names.append(( 'Vattendrag', "Bäcken %i-%i" % (i, j), (stream[2][0], stream[2][1] + 20) ))
+
+	date = datetime.datetime(2020, 5, 1)
+	for layer in [ mark, lines, wetland, streams ]:
+		for row in layer:
+			row['objektidentitet'] = new_id()
+			row['versiongiltigfran'] = date
+
+	# Save files
+
+	os.makedirs(os.path.join(folder, "Topo10"), exist_ok=True)
+	mark_filename = os.path.join(folder, "Topo10", "mark_sverige.gpkg")
+	hydro_filename = os.path.join(folder, "Topo10", "hydro_sverige.gpkg")
+	for filename in [ mark_filename, hydro_filename ]:
+		if os.path.exists(filename):
+			os.remove(filename)
+
+	gpd.GeoDataFrame(mark, crs="EPSG:3006").to_file(mark_filename, layer="mark")
+	gpd.GeoDataFrame(lines, crs="EPSG:3006").to_file(mark_filename, layer="markkantlinje")
+	if wetland:
+		gpd.GeoDataFrame(wetland, crs="EPSG:3006").to_file(mark_filename, layer="sankmark")
+	if streams:
+		gpd.GeoDataFrame(streams, crs="EPSG:3006").to_file(hydro_filename, layer="hydrolinje")
+
+	place_names = gpd.GeoDataFrame({
+		'DETALJTYP': [ name[0] for name in names ],
+		'name': [ name[1] for name in names ],
+		'ref:lantmateriet:ortnamn': [ str(100000 + k) for k in range(len(names)) ],
+		'T10': [ "1" ] * len(names),
+		'KOMMUN': [ "K9999" ] * len(names)},
+		geometry=gpd.points_from_xy([ name[2][0] for name in names ], [ name[2][1] for name in names ]), crs="EPSG:3006")
+
+	place_filename = os.path.join(folder, "ortnamn_Sverige_multipoint.geojson")
+	if os.path.exists(place_filename):
+		os.remove(place_filename)
+	place_names.to_crs("EPSG:4326").to_file(place_filename, driver="GeoJSON")
+
+	# Municipality boundary inside the area, cutting through cells at the right side
+
+	boundary = box(base_x + 1, base_y + 1, x_max - 0.37 * c, y_max - 1)
+	return gpd.GeoDataFrame({ 'geometry': [ boundary ] }, crs="EPSG:3006")
+
+
+
+# Main program
+
+if __name__ == '__main__':
+
+	if len(sys.argv) < 2:
+		sys.exit("Usage: python synthetic_topo.py <folder> [tiles_x] [tiles_y] [cells per tile]\n")
+
+	size = [ int(argument) for argument in sys.argv[2:5] ]
+	generate(sys.argv[1], *size)
+	sys.stdout.write("Synthetic Topo10 files saved in '%s'\n" % sys.argv[1])
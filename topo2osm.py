@@ -13,10 +13,25 @@ import time
 import math
 import io
 import base64
+import array
+import contextlib
+import cProfile
+import glob
+import itertools
+import gc
+import pickle
+import hashlib
 from xml.etree import ElementTree as ET
 from geopandas import gpd
+import numpy as np
+import shapely
 import warnings
 
+try:
+	import resource  # Peak memory for profile. Not available on Windows.
+except ImportError:
+	resource = None
+
 warnings.filterwarnings(
     action="ignore",
     message=".*has GPKG application_id, but non conformant file extension.*"
@@ -33,6 +48,7 @@ topo_folder =       "~/Jottacloud/LM/"					# Folders containing national topo da
 place_name_folder = "~/Jottacloud/osm/ortnamn sverige/"	# Folder containing import SSR files (default folder tried first)
 
 precision = 7	 			# Decimals in coordinate output
+planar_precision = 3		# Decimals in EPSG:3006 coordinates when building topology in planar coordinates
 island_size = 100000  	 	# Minimum square meters for place=island vs place=islet
 simplify_factor = 0.2    	# Threshold for simplification
 max_combine_members = 10 	# Maximum members for a wood feature to be combined
@@ -47,6 +63,21 @@ get_topo_rivers =  True 	# Use T100 and T50 topo data to determine rivers vs str
 load_landcover =   False 	# Load clipped municipality file from LM for "mark" layers (Marktäcke Nedladdning)
 merge_node =       True 	# Merge common nodes at intersections
 merge_grid =       True 	# Merge polygons across grids
+planar =           False	# Build topology in EPSG:3006 coordinates (meters) and project to WGS84 at output
+profile =          False	# Save run time, memory and item counts of each stage to json file
+profile_stats =    False	# Also save cProfile statistics of each main stage to pstats files
+profile_folder =   ""		# Folder with earlier profile reports for calibrating estimates (default current folder)
+count_operations = False	# Count operations in inner loops and show counts for each stage
+estimate_only =    False	# Only estimate run time and memory after loading, based on earlier profile reports
+estimate_max_time = 4 * 3600	# Estimated seconds of run time above which the tile-parallel path is recommended
+estimate_max_memory = 16000	# Estimated MB of peak memory above which the tile-parallel path is recommended
+checkpoint =       False	# Save state to checkpoint file after each main stage
+resume =           False	# Resume from last completed stage in checkpoint file
+incremental =      False	# Skip municipality if source data is unchanged since previous run
+change_output =    False	# Also save osmChange file with differences from output of previous run
+progress_interval = 1		# Seconds between progress updates of long loops in terminal
+progress_log_interval = 60	# Seconds between progress lines when output is not a terminal, e.g. log file
+progress_callback = None	# Function called with (label, done, total, items per second) at each progress update, e.g. by batch runner
 merge_wetland =    False	# Merge wetland segments with "gräns" type segments
 simplify =         True 	# Simplify geometry lines
 add_sea_names =    False 	# Add sea, bay and strait names in ocean, not only in lakes
@@ -292,135 +323,194 @@ osm_tags_purpose = {
 	'Skjutbana, mindre':		{ 'landuse': 'shooting_ground' }
 }
 
+tag_rules = {}  # Compiled tagging rules per object type, see compile_tag_rule()
 
 
-# OSM tagging; first special cases
 
-def tag_object(feature_type, geometry_type, properties, feature):
+# OSM tagging handlers for special object cases with additional properties.
+# Each handler updates tags already populated from the static template of the object type.
+
+def tag_waterway(feature_type, properties, tags):
+
+	if properties['kanal'] == "Ja":
+		tags['waterway'] = "canal"
+	elif properties['storleksklass'] > "Klass 1" or "Klass" not in properties['storleksklass'] and properties['storleksklass'] > "1":
+		tags['waterway'] = "river"
+	else:
+		tags['waterway'] = "stream"
+	if "vattendragsid" in properties:
+		tags['VATTENDRAG'] = properties['vattendragsid']
+
+
+def tag_lake(feature_type, properties, tags):
+
+	tags['natural'] = "water"
+	if feature_type == "Anlagt vatten":
+		tags['water'] = "pond"
+	if "hojd_over_havet" in properties:
+		if "-" in properties['hojd_over_havet']:
+			ele_split = properties['hojd_over_havet'].split("-")
+			tags['ele'] = ele_split[1]
+			tags['ele:min'] = ele_split[0]
+			tags['water'] = "reservoir"
+		else:
+			tags['ele'] = properties['hojd_over_havet']  # No decimals
+	if "reglerat_vatten" in properties and properties['reglerat_vatten'] == "Ja":
+		tags['water'] = "reservoir"
+	if "vattenytaid" in properties:
+		tags['ref:lantmateriet:vatten'] = properties['vattenytaid']
+
+
+def tag_purpose(feature_type, properties, tags):
+
+	if "andamal" in properties and properties['andamal'] != "Ospecificerad":
+		tags['OBJEKTTYP'] = feature_type + " " + properties['andamal']
+		tags.update(osm_tags_purpose[ properties['andamal'] ])
+	else:
+		tags['OBJEKTTYP'] = feature_type
+		tags.update(osm_tags[ feature_type ])
 
-	tags = {}
-	missing_tags = set()
+
+def tag_runway(feature_type, properties, tags):
+
+	tags['aeroway'] = "runway"
+	if "flygplatsstatus" in properties and properties['flygplatsstatus'] == "Nedlagd":
+		tags['note'] = "disused"
+
+
+def tag_airport(feature_type, properties, tags):
+
+	if "iata" in properties:
+		tags['aeroway'] = "aerodrome" if feature_type == "Flygplatsområde" else "heliport"
+		tags['iata'] = properties['iata']
+	else:
+		tags['aeroway'] = "airstrip" if feature_type == "Flygplatsområde" else "helipad"
+	if "icao" in properties:
+		tags['icao'] = properties['icao']
+
+
+def tag_protected_area(feature_type, properties, tags):
+
+	if "nvr_beskrivning" in properties:
+		tags['name'] = properties['nvr_beskrivning'].strip()
+		tags['short_name'] = properties['nvr_beskrivning'].strip()
+		if tags['name'][-1] == "s":
+			end = " "
+		else:
+			end = "s "
+		if "djurskyddstyp" in properties and properties['djurskyddstyp']:
+			tags['name'] += end + properties['djurskyddstyp'].lower()
+		elif feature_type != "Övrigt naturobjekt":
+			tags['name'] += end + feature_type.lower()
+	if "nvid" in properties:
+		tags['ref:naturvård'] = properties['nvid']
+	if "ovrigt_naturobjektstyp" in properties:
+		if properties['ovrigt_naturobjektstyp'] == "Grotta":
+			tags['natural'] = "cave"
+		elif properties['ovrigt_naturobjektstyp'] == "Källa":
+			tags['natural'] = "spring"
+		elif properties['ovrigt_naturobjektstyp'] == "Raukområde":
+			tags['natural'] = "rock"
+
+
+def tag_prohibition(feature_type, properties, tags):
+
+	if "informativ_text" in properties:
+		tags['description'] = properties['informativ_text'].strip()
+		if "tidsbegransning" in properties:
+			tags['description'] += " " + properties['tidsbegransning'].strip()
+
+
+def tag_trail(feature_type, properties, tags):
+
+	if "skoterkorning_tillaten" in properties:
+		if properties['skoterkorning_tillaten'] == "Ja":
+			tags['scooter'] = "yes"
+		elif properties['skoterkorning_tillaten'] == "Påbjuden":
+			tags['scooter'] = "designated"
+		elif properties['skoterkorning_tillaten'] == "Nej":
+			tags['scooter'] = "no"
+	if "vagutforande" in properties:
+		if properties['vagutforande'] in ["Bro", "Sommarbro"]:
+			tags['bridge'] = "yes"
+			tags['layer'] = "1"
+			if properties['vagutforande'] == "Sommarbro":
+				tags['seasonal'] = "summer"
+		elif properties['vagutforande'] in ["Tunnel", "Underfart"]:
+			tags['tunnel'] = "yes"
+			tags['layer'] = "-1"
+
+
+
+# Compile tagging rule for an object type.
+# Returns tuple of static tag template, handler for property dependent tags (or None)
+# and whether the object type should be reported if not tagged.
+
+def compile_tag_rule(feature_type):
+
+	handler = None
+	template = {}
 
 	# First, special object cases with additional properties
 	# Note: osm_tags dict not used in this section unless specifically applied per feature type
 
 	if feature_type == "Vattendrag":
-		if properties['kanal'] == "Ja":
-			tags['waterway'] = "canal"
-		elif properties['storleksklass'] > "Klass 1" or "Klass" not in properties['storleksklass'] and properties['storleksklass'] > "1":
-			tags['waterway'] = "river"
-		else:
-			tags['waterway'] = "stream"
-		if "vattendragsid" in properties:
-			tags['VATTENDRAG'] = properties['vattendragsid']
+		handler = tag_waterway
 
 	elif feature_type in ['Sjö', 'Anlagt vatten']:
-		tags['natural'] = "water"
-		if feature_type == "Anlagt vatten":
-			tags['water'] = "pond"
-		if "hojd_over_havet" in properties:
-			if "-" in properties['hojd_over_havet']:
-				ele_split = properties['hojd_over_havet'].split("-")
-				tags['ele'] = ele_split[1]
-				tags['ele:min'] = ele_split[0]
-				tags['water'] = "reservoir"
-			else:
-				tags['ele'] = properties['hojd_over_havet']  # No decimals
-		if "reglerat_vatten" in properties and properties['reglerat_vatten'] == "Ja":
-			tags['water'] = "reservoir"
-		if "vattenytaid" in properties:
-			tags['ref:lantmateriet:vatten'] = properties['vattenytaid']
+		handler = tag_lake
 
 	elif feature_type in ['Industriområde', 'Idrettsområde', 'Samhällsfunktion', 'Rekreation', 'Idrottsplan',
 				'Industriområde, punkt', 'Idrettsområde, punkt', 'Samhällsfunktion, punkt', 'Rekreation, punkt', 'Idrottsplan, punkt']:
-
-		if "andamal" in properties and properties['andamal'] != "Ospecificerad":
-			tags['OBJEKTTYP'] = feature_type + " " + properties['andamal']
-			tags.update(osm_tags_purpose[ properties['andamal'] ])
-		else:
-			tags['OBJEKTTYP'] = feature_type
-			tags.update(osm_tags[ feature_type ])
+		handler = tag_purpose
 
 	elif feature_type == "Start- och landningsbana":
-		tags['aeroway'] = "runway"
-		if "flygplatsstatus" in properties and properties['flygplatsstatus'] == "Nedlagd":
-			tags['note'] = "disused"
-
-	elif feature_type == "Flygplatsområde":
-		if "iata" in properties:
-			tags['aeroway'] = "aerodrome"
-			tags['iata'] = properties['iata']
-		else:
-			tags['aeroway'] = "airstrip"
-		if "icao" in properties:
-			tags['icao'] = properties['icao']
-
-	elif feature_type == "Helikopterplats":
-		if "iata" in properties:
-			tags['aeroway'] = "heliport"
-			tags['iata'] = properties['iata']
-		else:
-			tags['aeroway'] = "helipad"
-		if "icao" in properties:
-			tags['icao'] = properties['icao']
+		handler = tag_runway
+
+	elif feature_type in ["Flygplatsområde", "Helikopterplats"]:
+		handler = tag_airport
 
 	elif feature_type in ['Nationalpark', 'Naturreservat', 'Naturvårdsområde', 'Djurskyddsområde', 'Kulturreservat',
 							'Naturminne', 'Övrigt naturobjekt']:
-		tags.update(osm_tags[ feature_type ])
-		if "nvr_beskrivning" in properties:
-			tags['name'] = properties['nvr_beskrivning'].strip()
-			tags['short_name'] = properties['nvr_beskrivning'].strip()
-			if tags['name'][-1] == "s":
-				end = " "
-			else:
-				end = "s "
-			if "djurskyddstyp" in properties and properties['djurskyddstyp']:
-				tags['name'] += end + properties['djurskyddstyp'].lower()
-			elif feature_type != "Övrigt naturobjekt":
-				tags['name'] += end + feature_type.lower()
-		if "nvid" in properties:
-			tags['ref:naturvård'] = properties['nvid']
-		if "ovrigt_naturobjektstyp" in properties:
-			if properties['ovrigt_naturobjektstyp'] == "Grotta":
-				tags['natural'] = "cave"
-			elif properties['ovrigt_naturobjektstyp'] == "Källa":
-				tags['natural'] = "spring"
-			elif properties['ovrigt_naturobjektstyp'] == "Raukområde":
-				tags['natural'] = "rock"
+		template = osm_tags[ feature_type ]
+		handler = tag_protected_area
 
 	elif "förbud" in feature_type or "Förbjudet" in feature_type:
-		tags.update(osm_tags[ feature_type ])
-		if "informativ_text" in properties:
-			tags['description'] = properties['informativ_text'].strip()
-			if "tidsbegransning" in properties:
-				tags['description'] += " " + properties['tidsbegransning'].strip()
+		template = osm_tags[ feature_type ]
+		handler = tag_prohibition
 
 	elif feature_type in ["Gångstig", "Elljusspår", "Traktorväg", "Vandringsled", "Vandrings- och vinterled"]:
-		tags.update(osm_tags[ feature_type ])
-		if "skoterkorning_tillaten" in properties:
-			if properties['skoterkorning_tillaten'] == "Ja":
-				tags['scooter'] = "yes"
-			elif properties['skoterkorning_tillaten'] == "Påbjuden":
-				tags['scooter'] = "designated"
-			elif properties['skoterkorning_tillaten'] == "Nej":
-				tags['scooter'] = "no"
-		if "vagutforande" in properties:
-			if properties['vagutforande'] in ["Bro", "Sommarbro"]:
-				tags['bridge'] = "yes"
-				tags['layer'] = "1"
-				if properties['vagutforande'] == "Sommarbro":
-					tags['seasonal'] = "summer"
-			elif properties['vagutforande'] in ["Tunnel", "Underfart"]:
-				tags['tunnel'] = "yes"
-				tags['layer'] = "-1"
+		template = osm_tags[ feature_type ]
+		handler = tag_trail
 
 	# Then, standard conversion dict
 
 	elif feature_type in osm_tags:
 		if osm_tags[ feature_type ]:  # Not empty
-			tags.update( osm_tags[feature_type] )
+			template = osm_tags[ feature_type ]
 		else:
-			tags['FIXME'] = "Tag " + feature_type
+			template = { 'FIXME': "Tag " + feature_type }
+
+	report_missing = feature_type not in avoid_objects and feature_type not in auxiliary_objects and feature_type != "Hav"
+
+	return (tuple(template.items()), handler, report_missing)
+
+
+
+# OSM tagging of one feature.
+# Tagging rule is compiled once per object type, then only property dependent parts are done per feature.
+
+def tag_object(feature_type, geometry_type, properties, feature):
+
+	if feature_type not in tag_rules:
+		tag_rules[ feature_type ] = compile_tag_rule(feature_type)
+	template, handler, report_missing = tag_rules[ feature_type ]
+
+	tags = dict(template)
+	missing_tags = set()
+
+	if handler:
+		handler(feature_type, properties, tags)
 
 	# General attributes
 
@@ -433,7 +523,7 @@ def tag_object(feature_type, geometry_type, properties, feature):
 
 	# Collect set of remaining object types not handled
 
-	elif feature_type not in avoid_objects and feature_type not in auxiliary_objects and feature_type != "Hav":
+	elif report_missing:
 		missing_tags.add(feature_type)
 
 	return (tags, missing_tags)
@@ -462,6 +552,364 @@ def timeformat (sec):
 
 
 
+# Peak memory usage of process in MB, or None if not available
+
+def peak_memory():
+
+	if resource is None:
+		return None
+
+	usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform == "darwin":
+		usage = usage / 1024  # Bytes on macOS, KB on Linux
+	return round(usage / 1024, 1)
+
+
+
+# Progress of long loops, with number of items done, items per second and estimated remaining time.
+# Updates are throttled by time. In a terminal the progress is updated on one line,
+# otherwise a progress line is output at longer intervals.
+
+class Progress:
+
+	def __init__ (self, total, label="items"):
+
+		self.total = total
+		self.label = label
+		self.done = 0
+		self.start = time.time()
+		self.terminal = sys.stdout.isatty()
+		self.interval = progress_interval if self.terminal else progress_log_interval
+		self.next_update = self.start + self.interval
+		self.width = 0  # Length of current progress line in terminal
+
+	# Count items done and output progress if interval has passed
+
+	def update (self, count=1):
+
+		self.done += count
+		if time.time() >= self.next_update:
+			self.report()
+
+	def report (self):
+
+		now = time.time()
+		rate = self.done / (now - self.start) if now > self.start else 0
+		text = "%i/%i %s, %i/s" % (self.done, self.total, self.label, rate)
+		if rate > 0 and self.done < self.total:
+			text += ", %s left" % timeformat((self.total - self.done) / rate)
+
+		if self.terminal:
+			message ("\r\t%s" % text.ljust(self.width))
+			self.width = len(text)
+		else:
+			message ("\t%s\n" % text)
+
+		if progress_callback is not None:
+			progress_callback(self.label, self.done, self.total, rate)
+
+		self.next_update = now + self.interval
+
+	# Clear progress line before final message
+
+	def finish (self):
+
+		if self.terminal and self.width:
+			message ("\r\t%s\r" % (" " * self.width))
+		if progress_callback is not None:
+			now = time.time()
+			progress_callback(self.label, self.done, self.total, self.done / (now - self.start) if now > self.start else 0)
+
+
+
+# Add to counter of operations, for the -counters option.
+# Only called if count_operations is True.
+
+def add_count (name, count=1):
+
+	operation_counts[ name ] = operation_counts.get(name, 0) + count
+
+
+
+# Run time, memory and item counts of processing stages for the -profile and -counters options.
+# Stages may be nested, e.g. "grid lines" within "load", and the run time of a stage includes its nested stages,
+# while operation counts of a stage exclude its nested stages.
+# Memory is the peak memory of the process so far at the end of each stage, and how much the stage increased it,
+# since the peak memory of the process (ru_maxrss) cannot be reset at the start of a stage.
+# Repeated stages with the same name are added together.
+
+class StageProfile:
+
+	def __init__ (self, stats_filename=None):
+
+		self.stages = {}     # Record for each stage name, in order of start
+		self.running = []    # Names of stages in progress
+		self.stats_filename = stats_filename  # Filename pattern for cProfile output of main stages, or None
+		self.inputs = None   # Counts of loaded data, for calibrating estimates
+		self.start_wall = time.time()
+		self.start_cpu = time.process_time()
+
+	@contextlib.contextmanager
+	def stage (self, name):
+
+		if name not in self.stages:
+			self.stages[ name ] = {
+				'stage': name,
+				'parent': self.running[-1] if self.running else None,
+				'calls': 0,
+				'wall_time': 0.0,
+				'cpu_time': 0.0
+			}
+		record = self.stages[ name ]
+
+		stats = None
+		if self.stats_filename and not self.running:
+			stats = cProfile.Profile()
+
+		self.running.append(name)
+		parent_counts = operation_counts.copy()
+		operation_counts.clear()
+		wall = time.time()
+		cpu = time.process_time()
+		memory = peak_memory()
+		if stats:
+			stats.enable()
+
+		try:
+			yield
+		finally:
+			if stats:
+				stats.disable()
+				stats.dump_stats(self.stats_filename % name.replace(" ", "_"))
+			self.running.pop()
+
+			if count_operations:
+				counts = record.setdefault('counters', {})
+				for key, count in operation_counts.items():
+					counts[ key ] = counts.get(key, 0) + count
+				if operation_counts:
+					message ("\tCounters %s: %s\n" % (name, ", ".join("%s %i" % (key, count) for key, count in operation_counts.items())))
+			operation_counts.clear()
+			operation_counts.update(parent_counts)
+
+			record['calls'] += 1
+			record['wall_time'] = round(record['wall_time'] + time.time() - wall, 3)
+			record['cpu_time'] = round(record['cpu_time'] + time.process_time() - cpu, 3)
+			record['process_peak_mb'] = peak_memory()
+			if memory is not None:
+				record['peak_increase_mb'] = round(record.get('peak_increase_mb', 0) + record['process_peak_mb'] - memory, 1)
+			record['features'] = features.count_remaining()
+			record['segments'] = segments.count_remaining()
+			record['nodes'] = len(node_table)
+			record['common_nodes'] = len(nodes)
+			record['place_names'] = place_names.count_remaining()
+
+	# Save report to json file
+
+	def save (self, filename, **properties):
+
+		report = dict(properties)
+		report['wall_time'] = round(time.time() - self.start_wall, 3)
+		report['cpu_time'] = round(time.process_time() - self.start_cpu, 3)
+		report['peak_memory_mb'] = peak_memory()
+		report['inputs'] = self.inputs
+		report['stages'] = list(self.stages.values())
+
+		file = open(filename, "w")
+		json.dump(report, file, indent=2, ensure_ascii=False)
+		file.close()
+
+		message ("Saved profile to '%s'\n" % filename)
+
+
+
+# Return context for timing a stage if -profile or -counters is used, else an empty context
+
+def profile_stage (name):
+
+	if profile or count_operations:
+		return stage_profile.stage(name)
+	else:
+		return contextlib.nullcontext()
+
+
+
+# Counts of loaded data, used as size of run for estimates
+
+def get_input_counts ():
+
+	object_counts = {}
+	for feature in features:
+		object_counts[ feature.object ] = object_counts.get(feature.object, 0) + 1
+
+	return {
+		'size': features.count_remaining() + segments.count_remaining(),
+		'features': features.count_remaining(),
+		'segments': segments.count_remaining(),
+		'nodes': len(node_table),
+		'wetland': sum(count for object_type, count in object_counts.items() if "Sankmark" in object_type),
+		'sea': object_counts.get("Hav", 0),
+		'objects': object_counts
+	}
+
+
+
+# Estimate remaining run time of each stage and peak memory from loaded data, for the -estimate option.
+# The estimates are calibrated from earlier -profile reports for the same topo product, data category and projection.
+# Run time is fitted as log(time) = c + k * log(size) + b * share for each stage, where size is the number of loaded
+# features and segments, and share is the share of wetland or sea features for stages which repair wetland or coastline.
+# Peak memory is fitted as a linear function of the number of nodes. Place names are not loaded yet, so they are not used.
+# Municipalities with long run time, high memory or size far outside the calibrated sizes are flagged as outliers
+# for the tile-parallel path of the batch scheduler.
+
+def estimate_resources (filename):
+
+	share_terms = {  # Shares of feature types used as extra regressors for each stage
+		'relations': ['wetland', 'sea'],  # Repair of wetland and coastline
+		'islands': ['sea']
+	}
+
+	# Inner function for least squares fit of y = a + b * x.
+	# Returns (a, b), or None if x has only one value.
+
+	def linear_fit(x, y):
+		mean_x = sum(x) / len(x)
+		mean_y = sum(y) / len(y)
+		variance = sum((xi - mean_x) ** 2 for xi in x)
+		if variance == 0:
+			return None
+		b = sum((xi - mean_x) * (yi - mean_y) for xi, yi in zip(x, y)) / variance
+		return (mean_y - b * mean_x, b)
+
+
+	# Inner function for share of feature type in loaded data
+
+	def share(inputs, term):
+		return inputs.get(term, 0) / max(inputs['features'], 1)
+
+
+	# Inner function for fitting log(time) of a stage.
+	# Returns (c, k, coefficient of each share term). Share terms are 0 if there are too few reports.
+
+	def fit_stage(points, terms):
+
+		padding = [ 0.0 ] * len(terms)
+		if len(points) < len(terms) + 3:  # Too few reports for share terms
+			terms = []
+		sizes = [ math.log(max(inputs['size'], 1)) for inputs, t in points ]
+		times = [ math.log(t) for inputs, t in points ]
+
+		if linear_fit(sizes, times) is None:
+			return (sum(times) / len(times) - sizes[0], 1.0, padding)  # Linear scaling from one size
+
+		rows = [ [ 1.0, size ] + [ share(inputs, term) for term in terms ] for size, (inputs, t) in zip(sizes, points) ]
+		coefficients = np.linalg.lstsq(np.array(rows), np.array(times), rcond=None)[0].tolist()
+
+		exponent = min(max(coefficients[1], 0.5), 3.0)  # Avoid extreme extrapolation from few reports
+		if exponent != coefficients[1]:
+			rows = [ [ row[0] ] + row[2:] for row in rows ]
+			times = [ t - exponent * size for t, size in zip(times, sizes) ]
+			coefficients = np.linalg.lstsq(np.array(rows), np.array(times), rcond=None)[0].tolist()
+			coefficients.insert(1, exponent)
+
+		return (coefficients[0], coefficients[1], (coefficients[2:] + padding)[ : len(padding) ])
+
+
+	message ("Estimate run time and memory ...\n")
+
+	inputs = get_input_counts()
+	size = max(inputs['size'], 1)
+
+	# Load earlier profile reports
+
+	reports = []
+	for report_filename in sorted(glob.glob(os.path.join(os.path.expanduser(profile_folder), "*_profile.json"))):
+		file = open(report_filename)
+		report = json.load(file)
+		file.close()
+		if (report.get('inputs') and report['inputs']['size'] > 0
+				and report.get('topo_product') == topo_product and report.get('data_category') == data_category
+				and report.get('planar', False) == planar):
+			reports.append(report)
+
+	message ("\tCalibrated from %i profile reports\n" % len(reports))
+	if not reports:
+		message ("\t*** No profile reports found in folder '%s'. Please run with -profile first.\n" % profile_folder)
+		return
+
+	# Fit run time of each main stage after loading, which is already done
+
+	samples = {}  # List of (inputs, wall time) for each stage
+	for report in reports:
+		for stage in report['stages']:
+			if stage['parent'] is None and stage['stage'] not in ["load", "checkpoint"]:  # Remaining processing stages only
+				samples.setdefault(stage['stage'], []).append(( report['inputs'], stage['wall_time'] ))
+
+	estimates = {}
+	for stage, points in samples.items():
+		points = [ (report_inputs, t) for report_inputs, t in points if t > 0 ]
+		if not points:
+			estimates[ stage ] = 0.0
+			continue
+		terms = share_terms.get(stage, [])
+		constant, exponent, coefficients = fit_stage(points, terms)
+		log_time = constant + exponent * math.log(size) + sum(b * share(inputs, term) for b, term in zip(coefficients, terms))
+		estimates[ stage ] = round(math.exp(log_time), 1)
+
+	# Fit peak memory
+
+	points = [ (report['inputs']['nodes'], report['peak_memory_mb']) for report in reports if report.get('peak_memory_mb') ]
+	memory = None
+	if points:
+		fit = linear_fit([ n for n, m in points ], [ m for n, m in points ])
+		if fit and fit[1] > 0:
+			memory = fit[0] + fit[1] * inputs['nodes']
+		else:
+			memory = max(m * inputs['nodes'] / max(n, 1) for n, m in points)
+		memory = round(memory, 1)
+
+	total = round(sum(estimates.values()), 1)
+
+	# Outliers for tile-parallel path
+
+	outlier_reasons = []
+	if total > estimate_max_time:
+		outlier_reasons.append("run time")
+	if memory and memory > estimate_max_memory:
+		outlier_reasons.append("memory")
+	if size > 2 * max(report['inputs']['size'] for report in reports):
+		outlier_reasons.append("size outside calibrated sizes")
+
+	for stage, seconds in estimates.items():
+		message ("\t%-16s %s\n" % (stage, timeformat(seconds)))
+	message ("\tRemaining time   %s\n" % timeformat(total))
+	if memory:
+		message ("\tPeak memory      %i MB\n" % memory)
+	if outlier_reasons:
+		message ("\tOutlier (%s), tile-parallel path recommended\n" % ", ".join(outlier_reasons))
+
+	file = open(filename, "w")
+	json.dump({
+		'municipality_id': municipality_id,
+		'municipality_name': municipality_name,
+		'topo_product': topo_product,
+		'data_category': data_category,
+		'planar': planar,
+		'reports': len(reports),
+		'inputs': inputs,
+		'wall_time': total,  # Remaining after loading
+		'peak_memory_mb': memory,
+		'outlier': bool(outlier_reasons),
+		'outlier_reasons': outlier_reasons,
+		'recommended_path': "tile-parallel" if outlier_reasons else "single",
+		'stages': estimates
+		}, file, indent=2, ensure_ascii=False)
+	file.close()
+
+	message ("Saved estimate to '%s'\n" % filename)
+
+
+
 # Calculate coordinate area of polygon in square meters
 # Simple conversion to planar projection, works for small areas
 # < 0: Clockwise
@@ -470,7 +918,14 @@ def timeformat (sec):
 
 def polygon_area (polygon):
 
-	if polygon[0] == polygon[-1]:
+	if polygon[0] == polygon[-1] and planar:
+		area = 0.0
+		for i in range(len(polygon) - 1):
+			area += (polygon[i+1][1] - polygon[i][1]) * (polygon[i+1][0] + polygon[i][0])  # (x2-x1)(y2+y1)
+
+		return int(area / 2.0)
+
+	elif polygon[0] == polygon[-1]:
 		lat_dist = math.pi * 6371009.0 / 180.0
 
 		coord = []
@@ -493,7 +948,7 @@ def polygon_area (polygon):
 
 def multipolygon_area (multipolygon):
 
-	if type(multipolygon) is list and len(multipolygon) > 0 and type(multipolygon[0]) is list and \
+	if isinstance(multipolygon, list) and len(multipolygon) > 0 and isinstance(multipolygon[0], list) and \
 			multipolygon[0][0] == multipolygon[0][-1]:
 
 		area = polygon_area(multipolygon[0])
@@ -566,7 +1021,7 @@ def inside_polygon (point, polygon):
 
 def inside_multipolygon (point, multipolygon):
 
-	if type(multipolygon) is list and len(multipolygon) > 0 and type(multipolygon[0]) is list and \
+	if isinstance(multipolygon, list) and len(multipolygon) > 0 and isinstance(multipolygon[0], list) and \
 			multipolygon[0][0] == multipolygon[0][-1]:
 
 		inside = inside_polygon(point, multipolygon[0])
@@ -584,10 +1039,13 @@ def inside_multipolygon (point, multipolygon):
 
 
 # Compute approximation of distance between two coordinates, (lon,lat), in meters.
-# Works for short distances.
+# Works for short distances. Exact if planar coordinates.
 
 def point_distance (point1, point2):
 
+	if planar:
+		return math.hypot(point2[0] - point1[0], point2[1] - point1[1])
+
 	lon1, lat1, lon2, lat2 = map(math.radians, [point1[0], point1[1], point2[0], point2[1]])
 	x = (lon2 - lon1) * math.cos( 0.5*(lat2+lat1) )
 	y = lat2 - lat1
@@ -596,16 +1054,20 @@ def point_distance (point1, point2):
 
 
 # Compute closest distance from point p3 to line segment [s1, s2].
-# Works for short distances.
+# Works for short distances. Exact if planar coordinates.
 
 def line_distance (s1, s2, p3, get_point=False):
 
-	x1, y1, x2, y2, x3, y3 = map(math.radians, [s1[0], s1[1], s2[0], s2[1], p3[0], p3[1]])  # Note: (x,y)
+	if planar:
+		x1, y1, x2, y2, x3, y3 = s1[0], s1[1], s2[0], s2[1], p3[0], p3[1]
+
+	else:
+		x1, y1, x2, y2, x3, y3 = map(math.radians, [s1[0], s1[1], s2[0], s2[1], p3[0], p3[1]])  # Note: (x,y)
 
-	# Simplified reprojection of latitude
-	x1 = x1 * math.cos( y1 )
-	x2 = x2 * math.cos( y2 )
-	x3 = x3 * math.cos( y3 )
+		# Simplified reprojection of latitude
+		x1 = x1 * math.cos( y1 )
+		x2 = x2 * math.cos( y2 )
+		x3 = x3 * math.cos( y3 )
 
 	A = x3 - x1
 	B = y3 - y1
@@ -634,6 +1096,14 @@ def line_distance (s1, s2, p3, get_point=False):
 
 	x = x4 - x3
 	y = y4 - y3
+
+	if planar:
+		distance = math.sqrt( x*x + y*y )
+		if get_point:
+			return (distance, (x4, y4))
+		else:
+			return distance
+
 	distance = 6371000 * math.sqrt( x*x + y*y )  # In meters
 
 	if get_point:
@@ -654,6 +1124,9 @@ def line_distance (s1, s2, p3, get_point=False):
 
 def shortest_distance(p, line):
 
+	if count_operations:
+		add_count("distance evaluations", len(line) - 1)
+
 	d_min = 999999.9  # Dummy
 	position = None
 	for i in range(len(line) - 1):
@@ -671,6 +1144,9 @@ def shortest_distance(p, line):
 
 def coordinate_offset (node, distance):
 
+	if planar:
+		return (node[0] + distance, node[1] + distance)
+
 	m = (math.pi / 180.0) * 6378137.0  # Meters per degree, ca 111 km
 
 	latitude = node[1] + distance / m
@@ -783,7 +1259,14 @@ def get_bbox(coordinates, perimeter = 0):
 		patch = coordinates
 	else:
 		patch = coordinates[0]
-		
+
+	if isinstance(patch, Coordinates) and patch:  # Cached bbox
+		min_node, max_node = patch.bbox
+		if perimeter > 0:
+			return [ coordinate_offset(min_node, - perimeter), coordinate_offset(max_node, + perimeter) ]
+		else:
+			return patch.bbox
+
 	min_node = list(patch[0])
 	max_node = copy.deepcopy(min_node)
 
@@ -806,7 +1289,7 @@ def get_total_bbox():
 
 	all_bbox = []
 	for feature in features:
-		all_bbox.extend([ get_bbox(feature['coordinates']) ])  # Build artificial coordinates of min/max
+		all_bbox.extend([ get_bbox(feature.coordinates) ])  # Build artificial coordinates of min/max
 
 	return get_bbox(all_bbox)
 
@@ -824,139 +1307,513 @@ def bbox_overlap(bbox1, bbox2):
 
 
 
-# Create feature with one point
-
-def create_point (node, tags, uuid = None, object_type = "Debug"):
+# Undirected connection between two node ids, as ordered pair
 
-	entry = {
-		'object': object_type,
-		'type': 'Point',
-		'uuid': uuid,
-		'coordinates': node,
-		'members': [],
-		'tags': {},
-		'extras': {'objekttyp': object_type}
-	}
+def get_edge (node1, node2):
 
-	if isinstance(tags, str):
-		entry['extras']['note'] = tags
-	elif object_type == "Debug":
-		entry['extras'].update(tags)
+	if node1 < node2:
+		return (node1, node2)
 	else:
-		entry['tags'].update(tags)
+		return (node2, node1)
 
-	if debug or object_type != "Debug":
-		features.append(entry)
 
 
+# List of coordinates for a line or polygon patch, with cache of derived geometry (bbox, node set, node ids and edges).
+# The cache is computed when first used and is cleared whenever the list is modified.
 
+class Coordinates(list):
 
-# Identify municipality name, unless more than one hit.
-# Returns municipality number.
+	__slots__ = ('cache',)
 
-def get_municipality (parameter):
+	def __init__ (self, nodes=()):
 
-	# Load all municipalities
+		super().__init__(nodes)
+		self.cache = {}
 
-	url = "https://catalog.skl.se/rowstore/dataset/4c544014-8e8f-4832-ab8e-6e787d383752/json?_limit=400"
-	try:
-		file = urllib.request.urlopen(url)
-	except urllib.error.HTTPError as e:
-		sys.exit("\t*** Failed to load municiaplity names, HTTP error %i: %s\n\n" % (e.code, e.reason))
-	data = json.load(file)
-	file.close()
+	def __reduce__ (self):
+		return (Coordinates, (list(self),))  # Copies do not include cache
 
-	municipalities = {}
-	for municipality in data['results']:
-		ref = municipality['kommunkod']
-		if len(ref) < 4:
-			ref = "0" + ref
-		municipalities[ ref ] = municipality['kommun']
+	def __setitem__ (self, index, value):
+		self.cache.clear()
+		super().__setitem__(index, value)
 
-	# Identify chosen municipality
+	def __delitem__ (self, index):
+		self.cache.clear()
+		super().__delitem__(index)
 
-	if parameter.isdigit() and parameter in municipalities:
-		return parameter, municipalities[ parameter ]
-	else:
-		found_ids = []
-		for mun_id, mun_name in iter(municipalities.items()):
-			if parameter.lower() == mun_name.lower():
-				return mun_id, municipalities[ mun_id ]
-			elif parameter.lower() in mun_name.lower():
-				found_ids.append(mun_id)
+	def __iadd__ (self, nodes):
+		self.cache.clear()
+		return super().__iadd__(nodes)
 
-		if len(found_ids) == 1:
-			return found_ids[0], municipalities[ found_ids[0] ]
-		elif not found_ids:
-			sys.exit("*** Municipality '%s' not found\n\n" % parameter)
-		else:
-			mun_list = [ "%s %s" % (mun_id, municipalities[ mun_id ]) for mun_id in found_ids ]
-			sys.exit("*** Multiple municipalities found for '%s' - please use full name:\n%s\n\n" % (parameter, ", ".join(mun_list)))
+	def append (self, node):
+		self.cache.clear()
+		super().append(node)
 
+	def extend (self, nodes):
+		self.cache.clear()
+		super().extend(nodes)
 
+	def insert (self, index, node):
+		self.cache.clear()
+		super().insert(index, node)
 
-# Load municipality borders for filtering or clipping national data
+	def pop (self, index=-1):
+		self.cache.clear()
+		return super().pop(index)
 
-def load_municipality_boundary(municipality_id):
+	def remove (self, node):
+		self.cache.clear()
+		super().remove(node)
 
-	global municipality_boundary
+	def clear (self):
+		self.cache.clear()
+		super().clear()
 
-	# Load boundary from LM
+	def reverse (self):
+		self.cache.clear()  # Keep iteration order of node set equal to a new set
+		super().reverse()
 
-	header = { 'Authorization': 'Basic ' +  token }
-	endpoint = "https://api-ver.lantmateriet.se/ogc-features/v1/administrativ-indelning/collections/kommuner/items"
-	url = endpoint + "?crs=http://www.opengis.net/def/crs/EPSG/0/3006&f=json&&kommunkod=" + municipality_id
+	def sort (self, *args, **kwargs):
+		self.cache.clear()
+		super().sort(*args, **kwargs)
 
-	request = urllib.request.Request(url, headers=header)
-	try:
-		file = urllib.request.urlopen(request)
-	except urllib.error.HTTPError as err:
-		message ("\t*** HTTP error %i: %s\n" % (err.code, err.reason))
-		if err.code == 401:  # Unauthorized
-			message ("\t*** Wrong username (email) or password, or you need approval for 'Kommun, län och rike, Direkt' at Geotorget\n\n")
-			os.remove(token_filename)  # Enable reentry of username/password
-			sys.exit()
-		elif err.code == 403:  # Blocked
-			sys.exit()
-		else:
-			sys.exit()
+	# Bounds of coordinates as lower left and upper right corners. Must not be modified.
 
+	@property
+	def bbox (self):
+		bbox = self.cache.get('bbox')
+		if bbox is None:
+			if self:
+				x, y = zip(*self)
+				bbox = [ (min(x), min(y)), (max(x), max(y)) ]
+			else:
+				bbox = get_bbox(self)
+			self.cache['bbox'] = bbox
+		return bbox
 
-	data = json.load(file)
-	file.close()
+	# Set of nodes
 
-	# Keep only outer perimeter, disregarding inner rings
+	@property
+	def node_set (self):
+		node_set = self.cache.get('node_set')
+		if node_set is None:
+			node_set = frozenset(self)
+			self.cache['node_set'] = node_set
+		return node_set
 
-	multipolygon = data['features'][0]['geometry']['coordinates']
-	if data['features'][0]['geometry'] == "Polygon":
-		multipolygon = [ multipolygon ]
+	# Array of node table ids of nodes
 
-	new_multipolygon = []
-	for polygon in multipolygon:
-		new_polygon = [[ [ node[1], node[0] ] for node in polygon[0] ]]   # Keep outer ring only; swap x,y
-		outside = True
-		for outer_polygon in new_multipolygon:
-			if inside_polygon(new_polygon[0][0], outer_polygon[0]):  # Exclude outer polygons which are inside inner polygons
-				outside = False
-				break
-		if outside:
-			new_multipolygon.append(new_polygon)
+	@property
+	def node_ids (self):
+		node_ids = self.cache.get('node_ids')
+		if node_ids is None:
+			node_ids = node_table.get_ids(self)
+			self.cache['node_ids'] = node_ids
+		return node_ids
 
-	data['features'][0]['geometry'] = {
-		'type': 'MultiPolygon',
-		'coordinates': new_multipolygon
-	}
+	# Set of undirected connections between consecutive nodes.
+	# Each connection is stored once as an ordered pair of node ids.
 
-	municipality_boundary = gpd.GeoDataFrame.from_features(data['features'], crs="EPSG:3006")  # One feature only
+	@property
+	def edges (self):
+		edges = self.cache.get('edges')
+		if edges is None:
+			node_ids = self.node_ids
+			edges = frozenset(map(get_edge, node_ids, node_ids[1:]))
+			self.cache['edges'] = edges
+		return edges
 
-	# Alternative loading from local file
 
-#	filename = os.path.expanduser(topo_folder + "kommun-lan-rike_aktuell.gpkg")
-#	if not os.path.isfile(filename):
-#		sys.exit("\t*** File '%s' with municipality boundary not found\n\n" % filename)
 
-#	borders = gpd.read_file(filename, layer="kommun")
-#	municipality_boundary = borders[ borders["kommunkod"] == municipality_id ]
+# Compact record types for features and segments
+
+class TopoObject:
+
+	__slots__ = ('object', 'type', 'uuid', '_coordinates', 'members', 'tags', 'extras')
+
+	def __init__ (self, object_type, geometry_type, coordinates, members=None, tags=None, extras=None, uuid=None):
+
+		self.object = sys.intern(object_type)
+		self.type = geometry_type
+		self.uuid = uuid
+		self.coordinates = coordinates
+		self.members = members if members is not None else []
+		self.tags = tags if tags is not None else {}
+		self.extras = extras if extras is not None else {}
+
+	# Lines and polygon patches are stored as Coordinates lists
+
+	@property
+	def coordinates (self):
+		return self._coordinates
+
+	@coordinates.setter
+	def coordinates (self, coordinates):
+		if isinstance(coordinates, list) and not isinstance(coordinates, Coordinates):
+			if coordinates and isinstance(coordinates[0], list):
+				coordinates = [ patch if isinstance(patch, Coordinates) else Coordinates(patch) for patch in coordinates ]
+			else:
+				coordinates = Coordinates(coordinates)
+		self._coordinates = coordinates
+
+
+class Feature(TopoObject):
+
+	__slots__ = ('area', 'places', 'bbox')
+
+
+class Segment(TopoObject):
+
+	__slots__ = ('used', 'parents', 'osm_id', 'etree')
+
+	def __init__ (self, object_type, coordinates, tags=None, extras=None, uuid=None, used=0):
+
+		super().__init__(object_type, "LineString", coordinates, tags=tags, extras=extras, uuid=uuid)
+		self.used = used
+
+	# Bbox of segment is always derived from the current coordinates
+
+	@property
+	def bbox (self):
+		try:
+			return self._coordinates.cache['bbox']
+		except (AttributeError, KeyError):
+			return get_bbox(self._coordinates)
+
+
+
+# List with logical deletion of items.
+# Removed items are only marked as deleted in O(1) time and are skipped when iterating,
+# while indexes of all items stay valid until compact() is called at the end of a stage.
+# Indexing, slicing and len() use these positions, including removed items, so that e.g. len() - 1 is the index
+# of the last appended item. Use enumerate() for positions and count_remaining() for the number of remaining items.
+# Membership, index(), count(), copy(), reversed() and truth value only consider remaining items.
+# Methods which would move or replace items, such as insert(), pop(), sort() and item assignment, raise TypeError.
+# Iterating is not done over a copy, so items appended during a loop are included in the same loop.
+# Segment indexes are used by relation members, so segments must not be compacted after relations are created.
+
+class TopoList(list):
+
+	__slots__ = ('removed', 'ids')
+
+	def __init__ (self, items=()):
+
+		super().__init__(items)
+		self.removed = set()  # id() of removed items
+		self.ids = None       # id() of all items, built at first removal for checking membership
+
+	def __iter__ (self):
+		if self.removed:
+			removed = self.removed
+			return (item for item in list.__iter__(self) if id(item) not in removed)
+		else:
+			return list.__iter__(self)
+
+	def __reversed__ (self):
+		removed = self.removed
+		return (item for item in list.__reversed__(self) if id(item) not in removed)
+
+	def __bool__ (self):
+		return self.count_remaining() > 0
+
+	def __contains__ (self, item):
+		return any(element is item or element == item for element in self)
+
+	def index (self, item, start=0, stop=sys.maxsize):
+		for i, element in self.enumerate():
+			if start <= i < stop and (element is item or element == item):
+				return i
+		raise ValueError("TopoList.index(x): x not in list")
+
+	def count (self, item):
+		return sum(1 for element in self if element is item or element == item)
+
+	def copy (self):
+		return self.__class__(self)
+
+	def append (self, item):
+		list.append(self, item)
+		if self.ids is not None:
+			self.ids.add(id(item))
+
+	def extend (self, items):
+		items = list(items)
+		list.extend(self, items)
+		if self.ids is not None:
+			self.ids.update(map(id, items))
+
+	def __iadd__ (self, items):
+		self.extend(items)
+		return self
+
+	# Not supported, since positions of other items would change or removed items would be replaced
+
+	def insert (self, index, item):
+		raise TypeError("TopoList.insert() is not supported, use append()")
+
+	def pop (self, index=-1):
+		raise TypeError("TopoList.pop() is not supported, use remove()")
+
+	def sort (self, key=None, reverse=False):
+		raise TypeError("TopoList.sort() is not supported, use sorted()")
+
+	def reverse (self):
+		raise TypeError("TopoList.reverse() is not supported, use reversed()")
+
+	def clear (self):
+		raise TypeError("TopoList.clear() is not supported, create a new TopoList")
+
+	def __setitem__ (self, index, item):
+		raise TypeError("TopoList item assignment is not supported")
+
+	def __delitem__ (self, index):
+		raise TypeError("TopoList item deletion is not supported, use remove()")
+
+	def __imul__ (self, count):
+		raise TypeError("TopoList.__imul__() is not supported")
+
+	# Index and remaining item for each item not removed
+
+	def enumerate (self):
+		if self.removed:
+			removed = self.removed
+			return ((i, item) for i, item in enumerate(list.__iter__(self)) if id(item) not in removed)
+		else:
+			return enumerate(list.__iter__(self))
+
+	# Number of remaining items
+
+	def count_remaining (self):
+		return list.__len__(self) - len(self.removed)
+
+	def remove (self, item):
+		if self.ids is None:
+			self.ids = set(map(id, list.__iter__(self)))
+		if id(item) not in self.ids or id(item) in self.removed:
+			raise ValueError("TopoList.remove(x): x not in list")
+		self.removed.add(id(item))
+		if count_operations:
+			add_count("list removals")
+
+	# Pickle removed items by position, since id() changes when loaded
+
+	def __reduce__ (self):
+		removed = [ i for i, item in enumerate(list.__iter__(self)) if id(item) in self.removed ]
+		return (self.__class__, (list(list.__iter__(self)),), removed)
+
+	def __setstate__ (self, removed):
+		self.removed = { id(list.__getitem__(self, i)) for i in removed }
+		self.ids = None
+
+	# Physically remove items marked as deleted
+
+	def compact (self):
+		if self.removed:
+			remaining = list(self)
+			self.removed = set()
+			self.ids = None
+			list.__setitem__(self, slice(None), remaining)
+
+
+
+# Decimals of node coordinates during processing
+
+def node_precision():
+
+	if planar:
+		return planar_precision
+	else:
+		return precision
+
+
+
+# Project list of (x, y) nodes between coordinate systems in one operation.
+# Optionally round to given decimals.
+
+def project_nodes (node_list, from_crs, to_crs, decimals=None):
+
+	if not node_list:
+		return []
+
+	coordinates = np.array(node_list, dtype=float)
+	points = gpd.GeoSeries.from_xy(coordinates[:, 0], coordinates[:, 1], crs=from_crs).to_crs(to_crs)
+	coordinates = shapely.get_coordinates(points.array)
+	if decimals is not None:
+		coordinates = np.round(coordinates, decimals)
+
+	return list(zip(coordinates[:, 0].tolist(), coordinates[:, 1].tolist()))
+
+
+
+# Table of unique nodes.
+# Each rounded (lon, lat) node is stored once and given an integer id, so that equal nodes share one tuple
+# and topology operations may compare small integers instead of coordinate tuples.
+
+class NodeTable:
+
+	def __init__ (self):
+
+		self.ids = {}    # Integer id for each node
+		self.nodes = []  # Node for each integer id
+
+	def __len__ (self):
+		return len(self.nodes)
+
+	def get_id (self, node):
+		node_id = self.ids.get(node)
+		if node_id is None:
+			node_id = len(self.nodes)
+			self.ids[ node ] = node_id
+			self.nodes.append(node)
+		return node_id
+
+	# Return array of node ids for list of coordinates
+
+	def get_ids (self, coordinates):
+		try:
+			ids = self.ids
+			return array.array("i", [ ids[ node ] for node in coordinates ])
+		except KeyError:
+			return array.array("i", map(self.get_id, coordinates))
+
+	# Return shared node equal to given node
+
+	def intern (self, node):
+		return self.nodes[ self.get_id(node) ]
+
+	# Return list of shared nodes for list of coordinates
+
+	def intern_list (self, coordinates):
+		nodes = self.nodes
+		return [ nodes[ node_id ] for node_id in self.get_ids(coordinates) ]
+
+
+
+# Create feature with one point
+
+def create_point (node, tags, uuid = None, object_type = "Debug"):
+
+	entry = Feature(object_type, "Point", node, extras={'objekttyp': object_type}, uuid=uuid)
+
+	if isinstance(tags, str):
+		entry.extras['note'] = tags
+	elif object_type == "Debug":
+		entry.extras.update(tags)
+	else:
+		entry.tags.update(tags)
+
+	if debug or object_type != "Debug":
+		features.append(entry)
+
+
+
+
+# Identify municipality name, unless more than one hit.
+# Returns municipality number.
+
+def get_municipality (parameter):
+
+	# Load all municipalities
+
+	url = "https://catalog.skl.se/rowstore/dataset/4c544014-8e8f-4832-ab8e-6e787d383752/json?_limit=400"
+	try:
+		file = urllib.request.urlopen(url)
+	except urllib.error.HTTPError as e:
+		sys.exit("\t*** Failed to load municiaplity names, HTTP error %i: %s\n\n" % (e.code, e.reason))
+	data = json.load(file)
+	file.close()
+
+	municipalities = {}
+	for municipality in data['results']:
+		ref = municipality['kommunkod']
+		if len(ref) < 4:
+			ref = "0" + ref
+		municipalities[ ref ] = municipality['kommun']
+
+	# Identify chosen municipality
+
+	if parameter.isdigit() and parameter in municipalities:
+		return parameter, municipalities[ parameter ]
+	else:
+		found_ids = []
+		for mun_id, mun_name in iter(municipalities.items()):
+			if parameter.lower() == mun_name.lower():
+				return mun_id, municipalities[ mun_id ]
+			elif parameter.lower() in mun_name.lower():
+				found_ids.append(mun_id)
+
+		if len(found_ids) == 1:
+			return found_ids[0], municipalities[ found_ids[0] ]
+		elif not found_ids:
+			sys.exit("*** Municipality '%s' not found\n\n" % parameter)
+		else:
+			mun_list = [ "%s %s" % (mun_id, municipalities[ mun_id ]) for mun_id in found_ids ]
+			sys.exit("*** Multiple municipalities found for '%s' - please use full name:\n%s\n\n" % (parameter, ", ".join(mun_list)))
+
+
+
+# Load municipality borders for filtering or clipping national data
+
+def load_municipality_boundary(municipality_id):
+
+	global municipality_boundary
+
+	# Load boundary from LM
+
+	header = { 'Authorization': 'Basic ' +  token }
+	endpoint = "https://api-ver.lantmateriet.se/ogc-features/v1/administrativ-indelning/collections/kommuner/items"
+	url = endpoint + "?crs=http://www.opengis.net/def/crs/EPSG/0/3006&f=json&&kommunkod=" + municipality_id
+
+	request = urllib.request.Request(url, headers=header)
+	try:
+		file = urllib.request.urlopen(request)
+	except urllib.error.HTTPError as err:
+		message ("\t*** HTTP error %i: %s\n" % (err.code, err.reason))
+		if err.code == 401:  # Unauthorized
+			message ("\t*** Wrong username (email) or password, or you need approval for 'Kommun, län och rike, Direkt' at Geotorget\n\n")
+			os.remove(token_filename)  # Enable reentry of username/password
+			sys.exit()
+		elif err.code == 403:  # Blocked
+			sys.exit()
+		else:
+			sys.exit()
+
+
+	data = json.load(file)
+	file.close()
+
+	# Keep only outer perimeter, disregarding inner rings
+
+	multipolygon = data['features'][0]['geometry']['coordinates']
+	if data['features'][0]['geometry'] == "Polygon":
+		multipolygon = [ multipolygon ]
+
+	new_multipolygon = []
+	for polygon in multipolygon:
+		new_polygon = [[ [ node[1], node[0] ] for node in polygon[0] ]]   # Keep outer ring only; swap x,y
+		outside = True
+		for outer_polygon in new_multipolygon:
+			if inside_polygon(new_polygon[0][0], outer_polygon[0]):  # Exclude outer polygons which are inside inner polygons
+				outside = False
+				break
+		if outside:
+			new_multipolygon.append(new_polygon)
+
+	data['features'][0]['geometry'] = {
+		'type': 'MultiPolygon',
+		'coordinates': new_multipolygon
+	}
+
+	municipality_boundary = gpd.GeoDataFrame.from_features(data['features'], crs="EPSG:3006")  # One feature only
+
+	# Alternative loading from local file
+
+#	filename = os.path.expanduser(topo_folder + "kommun-lan-rike_aktuell.gpkg")
+#	if not os.path.isfile(filename):
+#		sys.exit("\t*** File '%s' with municipality boundary not found\n\n" % filename)
+
+#	borders = gpd.read_file(filename, layer="kommun")
+#	municipality_boundary = borders[ borders["kommunkod"] == municipality_id ]
 
 
 
@@ -1004,10 +1861,12 @@ def split_patch (coordinates):
 		return length
 
 
-	# Start of main function
+	# Start of main function.
+	# Split at first node which is repeated, found with dict of first position of each node.
 
-	for i in range(1, len(coordinates) - 1):
-		first = coordinates.index(coordinates[i])
+	first_position = {}
+	for i, node in enumerate(coordinates[ : -1 ]):
+		first = first_position.setdefault(node, i)
 		if first < i:
 			result1 = split_patch( coordinates[ : first ] + coordinates[ i: ] )
 			result2 = split_patch( coordinates[ first : i + 1 ])
@@ -1024,69 +1883,82 @@ def split_patch (coordinates):
 
 
 
-def parse(coordinates):
+# Parse coordinates of an array of geometries.
+# Coordinates are fetched and rounded for all geometries in one operation, and consecutive duplicate nodes
+# after rounding are removed. Only first polygon of a multipolygon is supported.
+# Returns list of (geometry_type, coordinates) in same order as input geometries.
 
-	if isinstance(coordinates[0], float):
-		return ( round(coordinates[0], precision), round(coordinates[1], precision) )
-	else:
-		patch = [ parse(patch) for patch in coordinates ]
-
-		# Remove duplicate nodes after rounding
-		if isinstance(patch[0], tuple):
-			segment = []
-			for node in patch:
-				if not (segment and node == segment[-1]):
-					segment.append(node)
-			if len(segment) == 1 and len(patch) > 1:
-				return []
-			else:
-				return segment
-		else:
-			return [ segment for segment in patch if segment ]  # Avoid empty segments
+def get_coordinates(geometries):
 
+	geometries = np.array(geometries, dtype=object)
+	type_id = shapely.get_type_id(geometries)
+	type_id[ shapely.is_empty(geometries) ] = -1
 
+	multipolygons = np.flatnonzero(type_id == 6)
+	geometries[ multipolygons ] = shapely.get_geometry(geometries[ multipolygons ], 0)
+	type_id[ multipolygons ] = 3
 
-# Parse coordinates
+	# Build one array of parts (points, lines and polygon rings) with index to owner geometry
 
-def get_coordinates(feature):
+	point_index = np.flatnonzero(type_id == 0)
+	line_index = np.flatnonzero(type_id == 1)
+	polygon_index = np.flatnonzero(type_id == 3)
+	rings, ring_owner = shapely.get_rings(geometries[ polygon_index ], return_index=True)
 
-	if isinstance(feature['geometry']['coordinates'][0], float):  # Point
-		coordinates = parse(feature['geometry']['coordinates'])
-		geometry_type = "Point"
+	parts = np.concatenate([ geometries[ point_index ], geometries[ line_index ], rings ])
+	owners = np.concatenate([ point_index, line_index, polygon_index[ ring_owner ] ])
 
-	elif isinstance(feature['geometry']['coordinates'][0][0], float):  # LineString
-		coordinates = parse(feature['geometry']['coordinates'])
-		geometry_type = "LineString"
+	coordinates, part_index = shapely.get_coordinates(parts, return_index=True)
+	coordinates = np.round(coordinates, node_precision())
 
-	elif isinstance(feature['geometry']['coordinates'][0][0][0], float):  # Polygon
-		parse_coordinates = parse(feature['geometry']['coordinates'])
-		coordinates = []
-		for patch in parse_coordinates:
-			coordinates.extend(split_patch(patch))  # Check for self-intersecting rings
-		geometry_type = "Polygon"
+	# Remove consecutive duplicate nodes within each part
 
-	elif isinstance(feature['geometry']['coordinates'][0][0][0][0], float):  # Multipolygon (first polygon supported)
-		parse_coordinates = parse(feature['geometry']['coordinates'][0])
-		coordinates = []
-		for polygon in parse_coordinates:
-			polygon_coordinates = []
-			for patch in polygon:
-				polygon_coordinates.extend(split_patch(patch))  # Check for self-intersecting rings
-			coordinates.append(polygon_coordinates)
-		geometry_type == "Polygon"
+	keep = np.ones(len(coordinates), dtype=bool)
+	keep[1:] = (coordinates[1:] != coordinates[:-1]).any(axis=1) | (part_index[1:] != part_index[:-1])
+	node_count = np.bincount(part_index, minlength=len(parts))
+	keep_count = np.bincount(part_index[ keep ], minlength=len(parts))
+	coordinates = coordinates[ keep ]
 
-	else:
-		coordinates = []
-		geometry_type = ""
+	# Materialise shared node tuples and split into parts
+
+	all_nodes = node_table.intern_list(list(zip(coordinates[:, 0].tolist(), coordinates[:, 1].tolist())))
+	ends = np.cumsum(keep_count).tolist()
+	starts = [0] + ends[:-1]
+
+	result = [ ("", []) ] * len(geometries)
+	point_count = len(point_index)
+	line_count = point_count + len(line_index)
 
-	return geometry_type, coordinates
+	for i, owner in enumerate(owners.tolist()):
+		if keep_count[ i ] == 1 and node_count[ i ] > 1:
+			part = []  # Collapsed after rounding
+		else:
+			part = all_nodes[ starts[ i ] : ends[ i ] ]
+
+		if i < point_count:
+			if part:
+				result[ owner ] = ("Point", part[0])
+		elif i < line_count:
+			result[ owner ] = ("LineString", part)
+		else:
+			if not result[ owner ][0]:
+				result[ owner ] = ("Polygon", [])
+			if part:
+				result[ owner ][1].extend(split_patch(part))  # Check for self-intersecting rings
 
+	return result
 
 
-# Determine whether one of the grid nodes is at grid crossing 
+
+# Determine whether one of the grid nodes is at grid crossing.
+# The test only matches EPSG:3006 coordinates, so it never matches the default WGS84 coordinates.
+# It is skipped if planar, to give the same output as the default.
 
 def on_grid_cross(grid):
 
+	if planar:
+		return False
+
 	for node in grid:
 		if (abs(node[0] - round(node[0] / grid_size) * grid_size) < 0.0001
 				and abs(node[1] - round(node[1] / grid_size) * grid_size) < 0.0001):
@@ -1120,10 +1992,21 @@ def identify_grid_lines(topo_data):
 		return False
 
 
+	# Inner function to save grid line unless it already exists in any direction
+
+	def add_grid(grid):
+
+		key = tuple(grid)
+		if key not in grid_keys and key[::-1] not in grid_keys:
+			grid_keys.add(key)
+			grids.append(grid)
+
+
 	# Start of main function.
 	# Note: Geojson structure.
 
 	grids = []
+	grid_keys = set()  # Tuple of nodes for each grid line in grids
 	for feature in topo_data.iterfeatures(na="drop", drop_id=True):
 		if feature['properties']['objekttyp'] in object_sorting_order and feature['geometry']['type'] == "Polygon":
 
@@ -1148,14 +2031,14 @@ def identify_grid_lines(topo_data):
 					if on_grid(grid + [ node ]):
 						grid.append(node)
 					else:
-						if len(grid) > 1 and grid not in grids and list(reversed(grid)) not in grids:
-							grids.append(grid)
+						if len(grid) > 1:
+							add_grid(grid)
 						grid = []
 						if on_grid([ node ]):
 							grid = [ node ]
 
-			if len(grid) > 1 and grid not in grids and list(reversed(grid)) not in grids:
-				grids.append(grid)
+			if len(grid) > 1:
+				add_grid(grid)
 
 	# Sort grids, longest first, to avoid problem with overlapping lines
 	grids.sort(key=lambda line: abs(line[0][0] - line[-1][0]) + abs(line[0][1] - line[-1][1]), reverse=True)
@@ -1191,37 +2074,50 @@ def remove_overlapping_grid_lines():
 	# Inner function for sorting grid lines according to length
 
 	def segment_length(segment):
-		return point_distance(segment['coordinates'][0], segment['coordinates'][-1])
+		return point_distance(segment.coordinates[0], segment.coordinates[-1])
 
 
 	# Inner function to remove duplicates
 
 	def remove_grid_duplicates():
 
-		grids = []
-		for segment in segments[:]:
-			if segment['object'] == "Gridline" and len(segment['coordinates']) == 2:
-				if segment['coordinates'] in grids or list(reversed(segment['coordinates'])) in grids:
+		grids = set()
+		for segment in segments:
+			if segment.object == "Gridline" and len(segment.coordinates) == 2:
+				key = tuple(segment.coordinates)
+				if key in grids or key[::-1] in grids:
 					segments.remove(segment)
 				else:
-					grids.append(segment['coordinates'])
+					grids.add(key)
 
 
 	# Start of main function
 
 	remove_grid_duplicates()
 
-	grid_segments = [ segment for segment in segments if segment['object'] == "Gridline" and len(segment['coordinates']) > 2 ]
+	grid_segments = [ segment for segment in segments if segment.object == "Gridline" and len(segment.coordinates) > 2 ]
+
+	# Index of grid segments for each node, to find grid segments touching each polygon
+
+	grid_index = {}
+	for i, segment in enumerate(grid_segments):
+		for node in segment.coordinates:
+			grid_index.setdefault(node, []).append(i)
 
 	for feature in features:
-		if feature['object'] in object_sorting_order and feature['type'] == "Polygon":
-			set_feature = set(feature['coordinates'][0])
-			for segment in grid_segments:
-				if set(segment['coordinates']) <= set_feature:
-					set_segment = set(segment['coordinates'])
+		if feature.object in object_sorting_order and feature.type == "Polygon":
+			set_feature = feature.coordinates[0].node_set
+			touching = set()
+			for node in set_feature:
+				if node in grid_index:
+					touching.update(grid_index[ node ])
+
+			for segment in [ grid_segments[ i ] for i in sorted(touching) ]:
+				if segment.coordinates.node_set <= set_feature:
+					set_segment = segment.coordinates.node_set
 
 					# First, roll feature coordinates until first node is not on segment
-					coordinates = feature['coordinates'][0][:-1]
+					coordinates = feature.coordinates[0][:-1]
 					for node in coordinates[:]:
 						if node in set_segment:
 							coordinates.append(coordinates.pop(0))
@@ -1239,21 +2135,28 @@ def remove_overlapping_grid_lines():
 							else:
 								test_segment = []
 
-					# If match, remove middle nodes from feature
+					# If match, remove middle nodes from feature (first occurrence of each node)
 					if set(test_segment) == set_segment:
-						for node in segment['coordinates'][1:-1]:
-							feature['coordinates'][0].remove(node)
-							create_point(segment['coordinates'][1], "Removed grid point")  # Debug
-						if feature['coordinates'][0][-1] in segment['coordinates'][1:-1]:
-							feature['coordinates'][0][-1] = feature['coordinates'][0][0]  # Ensure circle
+						middle_nodes = set(segment.coordinates[1:-1])
+						patch = []
+						for node in feature.coordinates[0]:
+							if node in middle_nodes:
+								middle_nodes.remove(node)
+								create_point(segment.coordinates[1], "Removed grid point")  # Debug
+							else:
+								patch.append(node)
+						feature.coordinates[0][:] = patch
+						if feature.coordinates[0][-1] in segment.coordinates[1:-1]:
+							feature.coordinates[0][-1] = feature.coordinates[0][0]  # Ensure circle
 
 	# Remove middle nodes from grid segments
 	for segment in grid_segments:
-		segment['coordinates'] = [ segment['coordinates'][0], segment['coordinates'][-1] ]
+		segment.coordinates = [ segment.coordinates[0], segment.coordinates[-1] ]
 
 	remove_grid_duplicates()
+	segments.compact()
 
-	count = sum(1 for segment in segments if segment['object'] == "Gridline")
+	count = sum(1 for segment in segments if segment.object == "Gridline")
 	message ("\tCreated %i gridlines\n" % count)
 
 
@@ -1328,18 +2231,58 @@ def load_topo_layers(data_category, topo_data):
 
 
 
-# Load Topo10 data from Lantmäteriet
+# Summary of source features in each grid tile, for the -incremental option.
+# Returns dict with number of features, latest version date and hash of identities, versions and geometry for each tile.
+# Tiles are identified by the south-west corner in EPSG:3006.
+
+def get_source_tiles (topo_data):
+
+	bounds = topo_data.geometry.bounds.fillna(0)
+	tiles_x = (bounds['minx'] // grid_size * grid_size).astype(int).tolist()
+	tiles_y = (bounds['miny'] // grid_size * grid_size).astype(int).tolist()
+
+	columns = []
+	for column in ["objektidentitet", "versiongiltigfran"]:
+		if column in topo_data:
+			columns.append(topo_data[ column ].fillna("").astype(str).tolist())
+		else:
+			columns.append([ "" ] * len(topo_data))
+	geometries = [ geometry or b"" for geometry in topo_data.geometry.to_wkb().tolist() ]
+
+	tile_features = {}
+	for x, y, identity, version, geometry in zip(tiles_x, tiles_y, columns[0], columns[1], geometries):
+		tile_features.setdefault("%i_%i" % (x, y), []).append(( identity, version, geometry ))
+
+	tiles = {}
+	for tile, entries in tile_features.items():
+		entries.sort()  # Independent of order in source file
+		digest = hashlib.sha1()
+		for identity, version, geometry in entries:
+			digest.update(("%s|%s|" % (identity, version)).encode("utf-8"))
+			digest.update(geometry)
+		tiles[ tile ] = {
+			'features': len(entries),
+			'version': max(version for identity, version, geometry in entries),
+			'hash': digest.hexdigest()
+		}
+
+	return tiles
+
+
 
-def load_topo_data (municipality_id, municipality_name, data_category):
+# Load Topo10 data from Lantmäteriet.
+# For the -incremental option, the function unchanged() is called after loading the source layers, before features are built.
+# Returns False if loading stopped because the source data is unchanged, else True.
 
-	global uuid, municipality_bbox
+def load_topo_data (municipality_id, municipality_name, data_category, unchanged=None):
+
+	global municipality_bbox, source_tiles
 
 	lap = time.time()
 
 	message ("Load topo data from Lantmäteriet...\n")
 
 	source_date = {}
-	object_count = {}
 	missing_tags = set()
 	topo_data = gpd.GeoDataFrame()
 
@@ -1352,111 +2295,132 @@ def load_topo_data (municipality_id, municipality_name, data_category):
 	else:
 		topo_data = load_topo_layers(data_category, topo_data)
 
+	if incremental:
+		source_tiles = get_source_tiles(topo_data)
+		if unchanged and unchanged():
+			return False
+
 	if data_category in ["topo", "mark"]:  # and not save_geojson:
-		topo_data = identify_grid_lines(topo_data)
+		with profile_stage("grid lines"):
+			topo_data = identify_grid_lines(topo_data)
 
-	topo_data = topo_data.to_crs("EPSG:4326")
+	if not planar:
+		topo_data = topo_data.to_crs("EPSG:4326")
 
-	# Loop features, parse and load into data structure and tag
+	# Object type for text layers
 
-	for feature in topo_data.iterfeatures(na="drop", drop_id=True):
+	topo_data = topo_data.reset_index(drop=True)  # Position index after concatenating layers
+	if "objekttyp" not in topo_data:
+		topo_data['objekttyp'] = None
+	for column, object_type in [("karttext", "Höjdkurvstext"), ("regtext", "Text")]:
+		if column in topo_data:
+			topo_data.loc[ topo_data['objekttyp'].isna() & topo_data[ column ].notna(), 'objekttyp' ] = object_type
 
-		properties = feature['properties']
+	if topo_data['objekttyp'].isna().any():
+		row = topo_data[ topo_data['objekttyp'].isna() ].iloc[0]
+		sys.exit("*** NO OBJECT TYPE: %s\n" % str(row.dropna().to_dict()))
 
-		if "objekttyp" not in properties:
-			if "karttext" in properties:
-				properties['objekttyp'] = "Höjdkurvstext"
-			elif "regtext" in properties:
-				properties['objekttyp'] ="Text"
-			else:
-				sys.exit("*** NO OBJECT TYPE: %s\n" % str(feature))
+	object_count = topo_data['objekttyp'].value_counts().to_dict()
 
-		feature_type = properties['objekttyp']
+	# Parse coordinates, then build and tag features per object type.
+	# Entries are collected by position to keep the source order of features and segments.
 
-		if "objektidentitet" in properties:
-			uuid = properties['objektidentitet']
-		else:
-			uuid = "Text"
+	geometries = get_coordinates(topo_data.geometry.array)
+	columns = [ column for column in topo_data.columns if column != topo_data.geometry.name ]
+	entries = [ None ] * len(topo_data)
 
-		if feature_type not in object_count:
-			object_count[ feature_type ] = 0
-		object_count[ feature_type ] += 1
+	for feature_type, group in topo_data.groupby("objekttyp", sort=False):
 
 		# Dismiss certain objects
 
 		if feature_type in avoid_objects and not json_output:
 			continue
 
-		geometry_type, coordinates = get_coordinates(feature)
-		if not coordinates:
-			continue
+		# Get properties for each feature, omitting empty values
 
-		# Ensure clockwise orientation of clipped polygons from LM
+		group_notna = group[ columns ].notna()
+		group_columns = [ column for column in columns if group_notna[ column ].any() ]
+		group_notna = group_notna[ group_columns ].to_numpy().tolist()
+		group_values = zip(*[ group[ column ].tolist() for column in group_columns ])
+		group_strings = zip(*[ group[ column ].astype(str).tolist() for column in group_columns ])
 
-		if load_landcover and topo_product == "Topo10" and feature_type in object_sorting_order and polygon_area(coordinates[0]) > 0:
-			for patch in coordinates:
-				patch.reverse()
+		for position, values, strings, notna in zip(group.index.tolist(), group_values, group_strings, group_notna):
 
-		# Convert waterfall to point
+			geometry_type, coordinates = geometries[ position ]
+			if not coordinates:
+				continue
 
-		if feature_type == "Vattenfall":
-			coordinates = parse(( 0.5 * (coordinates[0][0] + coordinates[-1][0]), 0.5 * (coordinates[0][1] + coordinates[-1][1]) ))
-			geometry_type = "Point"
+			properties = { key: value for key, value, valid in zip(group_columns, values, notna) if valid }
 
-		entry = {
-			'object': feature_type,
-			'type': geometry_type,
-			'uuid': uuid,
-			'coordinates': coordinates,
-			'members': [],
-			'tags': {},
-			'extras': {}
-		}
+			if "objektidentitet" in properties:
+				uuid = properties['objektidentitet']
+			else:
+				uuid = "Text"
 
-		# Store tags
+			# Ensure clockwise orientation of clipped polygons from LM
 
-		tags, new_missing_tags = tag_object(feature_type, geometry_type, properties, entry)
-		entry['tags'].update(tags)
-		for key, value in iter(properties.items()):
-			entry['extras'][ key ] = str(value)
-		missing_tags.update(new_missing_tags)
+			if load_landcover and topo_product == "Topo10" and feature_type in object_sorting_order and polygon_area(coordinates[0]) > 0:
+				for patch in coordinates:
+					patch.reverse()
 
-		if topo_tags and not debug:
-			for key, value in iter(properties.items()):
-				if key not in avoid_tags:
-					entry['tags'][ "TOPO_" + key ] = value
+			# Convert waterfall to point
 
-		# Add to relevant list
+			if feature_type == "Vattenfall":
+				coordinates = node_table.intern(( round(0.5 * (coordinates[0][0] + coordinates[-1][0]), node_precision()),
+								round(0.5 * (coordinates[0][1] + coordinates[-1][1]), node_precision()) ))
+				geometry_type = "Point"
 
-		if not (geometry_type == "LineString" and len(entry['coordinates']) <= 1):
+			extras = { key: string for key, string, valid in zip(group_columns, strings, notna) if valid }
 			if feature_type in auxiliary_objects:
-				entry['used'] = 0
+				entry = Segment(feature_type, coordinates, extras=extras, uuid=uuid, used=0)
+				entry.type = geometry_type
+			else:
+				entry = Feature(feature_type, geometry_type, coordinates, extras=extras, uuid=uuid)
+
+			# Store tags
+
+			tags, new_missing_tags = tag_object(feature_type, geometry_type, properties, entry)
+			entry.tags.update(tags)
+			missing_tags.update(new_missing_tags)
+
+			if topo_tags and not debug:
+				for key, value in iter(properties.items()):
+					if key not in avoid_tags:
+						entry.tags[ "TOPO_" + key ] = value
+
+			entries[ position ] = entry
+
+	# Add to relevant list in source order
+
+	for entry in entries:
+		if entry and not (entry.type == "LineString" and len(entry.coordinates) <= 1):
+			if isinstance(entry, Segment):
 				segments.append(entry)
-			elif entry['tags'] or debug or json_output or feature_type == "Hav":
+			elif entry.tags or debug or json_output or entry.object == "Hav":
 				features.append(entry)
-#			else:
-#				message ("\t*** SEGMENT TOO SHORT: %s\n" % uuid)
 
-		# Count source dates for information (10 year intervals)
-
-		year = ""
-		if "versiongiltigfran" in properties:
-			year = properties['versiongiltigfran'][:4]  # [:3] + "0"
-		if year > "1801":
-			if year not in source_date:
-				source_date[ year ] = 0
-			source_date[ year ] += 1
+	# Count source dates for information (10 year intervals)
 
+	if "versiongiltigfran" in topo_data:
+		loaded = [ entry is not None for entry in entries ]
+		years = topo_data.loc[ loaded, 'versiongiltigfran' ].dropna().astype(str).str[:4]  # [:3] + "0"
+		source_date = years[ years > "1801" ].value_counts().to_dict()
 
 	if not features:
 		sys.exit("\nNo data found\n\n")
 
 	if data_category in ["topo", "mark"]: # and not save_geojson:
-		remove_overlapping_grid_lines()
+		with profile_stage("grid lines"):
+			remove_overlapping_grid_lines()
 
 	# Get bbox for municipality
 	if features:
-		municipality_bbox = [ coord for node in get_total_bbox() for coord in node ]  # Flatten 4 coordinates
+		bbox = get_total_bbox()
+		if planar:
+			corners = project_nodes([ (x, y) for x in [ bbox[0][0], bbox[1][0] ] for y in [ bbox[0][1], bbox[1][1] ] ],
+									"EPSG:3006", "EPSG:4326", decimals=precision)
+			bbox = [ [ min(node[i] for node in corners) for i in [0, 1] ], [ max(node[i] for node in corners) for i in [0, 1] ] ]
+		municipality_bbox = [ coord for node in bbox for coord in node ]  # Flatten 4 coordinates
 		message ("\tBounding box: %s\n" % str(municipality_bbox))
 
 	# Summary messages
@@ -1476,9 +2440,11 @@ def load_topo_data (municipality_id, municipality_name, data_category):
 			if round(100 * source_date[ year ] / total) > 0:
 				message ("\t\t%s:\t%2i%%\n" % (year, round(100 * source_date[ year ] / total)))
 
-	message ("\t%i feature objects, %i segments\n" % (len(features), len(segments)))
+	message ("\t%i feature objects, %i segments\n" % (features.count_remaining(), segments.count_remaining()))
 	message ("\tRun time %s\n" % (timeformat(time.time() - lap)))
 
+	return True
+
 
 
 # Combine waterways into longer ways
@@ -1489,7 +2455,7 @@ def combine_rivers():
 
 	topo_rivers = []
 	for river in features:
-		if river['object'] in ["Vattendrag"]:
+		if river.object in ["Vattendrag"]:
 			topo_rivers.append(river)
 
 	# Combine rivers of same type and same network branch until exhausted
@@ -1500,18 +2466,18 @@ def combine_rivers():
 		count_segments = 1
 
 		found = True
-		while found and combination['coordinates'][0] != combination['coordinates'][-1]:
+		while found and combination.coordinates[0] != combination.coordinates[-1]:
 			found = False
 			for river in topo_rivers[:]:
-				if ("vattendragsid" in river['extras'] and river['extras']['vattendragsid'] == combination['extras']['vattendragsid']
-						and river['tags']['waterway'] == river['tags']['waterway']
-						and (("name" in river['tags']) == ("name" in combination['tags']))):  # Xor
+				if ("vattendragsid" in river.extras and river.extras['vattendragsid'] == combination.extras['vattendragsid']
+						and river.tags['waterway'] == river.tags['waterway']
+						and (("name" in river.tags) == ("name" in combination.tags))):  # Xor
 
-					if river['coordinates'][0] == combination['coordinates'][-1]:
-						combination['coordinates'] = combination['coordinates'] + river['coordinates'][1:]
+					if river.coordinates[0] == combination.coordinates[-1]:
+						combination.coordinates = combination.coordinates + river.coordinates[1:]
 						found = True
-					elif river['coordinates'][-1] == combination['coordinates'][0]:
-						combination['coordinates'] = river['coordinates'] + combination['coordinates'][1:]
+					elif river.coordinates[-1] == combination.coordinates[0]:
+						combination.coordinates = river.coordinates + combination.coordinates[1:]
 						found = True
 
 					if found:							
@@ -1523,6 +2489,8 @@ def combine_rivers():
 			if count_segments > 1:
 				count_combine += 1
 
+	features.compact()
+
 	if count_combine > 0:
 		message ("\t%i rivers combined\n" % count_combine)
 
@@ -1540,8 +2508,8 @@ def load_topo_rivers():
 
 		if topo == topo_product:
 			for feature in features:
-				if feature['object'] == "Vattendrag" and "storleksklass" in feature['extras'] and int(feature['extras']['storleksklass']) > 1:
-					rivers.add(feature['extras']['vattendragsid'])
+				if feature.object == "Vattendrag" and "storleksklass" in feature.extras and int(feature.extras['storleksklass']) > 1:
+					rivers.add(feature.extras['vattendragsid'])
 
 		else:
 			filename = topo_folder + "%s/hydrografi_sverige.gpkg" % topo
@@ -1555,7 +2523,6 @@ def load_topo_rivers():
 
 			data = data[ data.geometry.intersects(municipality_boundary.geometry.union_all(method='unary')) ].explode()  # No clipping
 			data['skapad'] = data['skapad'].dt.strftime("%Y-%m-%d")  # Fix type
-			data = data.to_crs("EPSG:4326")
 
 			# Build set of waterway id's which are rivers 
 
@@ -1566,10 +2533,10 @@ def load_topo_rivers():
 	# Tag as rivers
 
 	for feature in features:
-		if feature['object'] == "Vattendrag":
-			if ("vattendragsid" in feature['extras'] and feature['extras']['vattendragsid'] in rivers
-					and "waterway" in feature['tags'] and feature['tags']['waterway'] == "stream"):
-				feature['tags']['waterway'] = "river"
+		if feature.object == "Vattendrag":
+			if ("vattendragsid" in feature.extras and feature.extras['vattendragsid'] in rivers
+					and "waterway" in feature.tags and feature.tags['waterway'] == "stream"):
+				feature.tags['waterway'] = "river"
 
 	if not rivers:
 		get_topo_rivers = False  # Try tagging rivers later based on place names
@@ -1649,6 +2616,7 @@ def load_hydrografi_rivers():
 
 
 # Load lakes from Hydrografi dataset to get lake names.
+# Lakes are matched by id, so no lake geometry is used. The bbox of the alternative method is in WGS84 also if planar.
 
 def load_hydrografi_lakes():
 
@@ -1669,9 +2637,9 @@ def load_hydrografi_lakes():
 
 	if True:
 		for feature in features:
-			if "ref:lantmateriet:vatten" in feature['tags']:
+			if "ref:lantmateriet:vatten" in feature.tags:
 
-				url = endpoint + "f=json&limit=10&offset=0&inspireId=" + feature['tags']['ref:lantmateriet:vatten']
+				url = endpoint + "f=json&limit=10&offset=0&inspireId=" + feature.tags['ref:lantmateriet:vatten']
 				request = urllib.request.Request(url, headers=header)
 				try:
 					file = urllib.request.urlopen(request)
@@ -1748,8 +2716,8 @@ def load_hydrografi_lakes():
 	# Update lake info
 
 	for feature in features:
-		if "ref:lantmateriet:vatten" in feature['tags'] and feature['tags']['ref:lantmateriet:vatten'] in lakes:
-			tags = feature['tags']
+		if "ref:lantmateriet:vatten" in feature.tags and feature.tags['ref:lantmateriet:vatten'] in lakes:
+			tags = feature.tags
 			lake = lakes[ tags['ref:lantmateriet:vatten'] ]
 
 			names = []
@@ -1768,15 +2736,15 @@ def load_hydrografi_lakes():
 			if names and "name" not in tags:
 				tags['name'] = " - ".join(names)
 
-			if "ele" in lake and "ele" not in feature['tags']:
-				feature['tags']['ele'] = str(lake['ele'])  # No decimals
-			if lake['area'] > 1000000 and "water" not in feature['tags']:  # 1 km2
-				feature['tags']['water'] = "lake"
+			if "ele" in lake and "ele" not in feature.tags:
+				feature.tags['ele'] = str(lake['ele'])  # No decimals
+			if lake['area'] > 1000000 and "water" not in feature.tags:  # 1 km2
+				feature.tags['water'] = "lake"
 #			if lake['tidal']:
-#				feature['tags']['tidal'] = "yes"
-			feature['extras']['lm_area'] = str(int(lake['area']))  # Square meters
+#				feature.tags['tidal'] = "yes"
+			feature.extras['lm_area'] = str(int(lake['area']))  # Square meters
 
-		if feature['object'] in ['Sjö', 'Anlagt vatten']:
+		if feature.object in ['Sjö', 'Anlagt vatten']:
 			topo_lake_count += 1
 
 	message ("\r\t%i Topo10 lakes matched against %i Hydrografi lakes\n" % (topo_lake_count, hydro_lake_count))
@@ -1879,7 +2847,14 @@ def load_place_names():
 			}
 			place_names.append(entry)
 
-	message ("\tLoaded %i place names from ortnamn2osm\n" % len(place_names))
+	if planar:
+		all_points = project_nodes([ point for place in place_names for point in place['points'] ], "EPSG:4326", "EPSG:3006")
+		i = 0
+		for place in place_names:
+			place['points'] = all_points[ i : i + len(place['points']) ]
+			i += len(place['points'])
+
+	message ("\tLoaded %i place names from ortnamn2osm\n" % place_names.count_remaining())
 
 
 
@@ -1953,20 +2928,22 @@ def get_place_name (feature, name_categories):
 	# Start of main function.
 	# Find name in stored file
 
-	if feature['type'] == "Point":
-		bbox = get_bbox(feature['coordinates'], perimeter=500)  # 500 meters perimeter to each side
+	if feature.type == "Point":
+		bbox = get_bbox(feature.coordinates, perimeter=500)  # 500 meters perimeter to each side
 	else:
-		bbox = get_bbox(feature['coordinates'], perimeter=3000) 
+		bbox = get_bbox(feature.coordinates, perimeter=3000) 
 
 	found_places = []
 
-	for place in place_names[:]:
+	for place in place_names:
 		if place['tags']['DETALJTYP'] in name_categories:
+			if count_operations:
+				add_count("place name checks")
 			for point in place['points']:
 				if (bbox_overlap(bbox, point)
-						and (feature['type'] in ["Point", "LineString"] or inside_multipolygon(point, feature['coordinates']))):
+						and (feature.type in ["Point", "LineString"] or inside_multipolygon(point, feature.coordinates))):
 
-					if feature['object'] == "Hav":
+					if feature.object == "Hav":
 						if not add_sea_names or place['tags']['name'] in avoid_sea_names:
 							place_names.remove(place)  # Remove sea names
 					else:
@@ -1978,7 +2955,7 @@ def get_place_name (feature, name_categories):
 
 	# Create name node for bays/straits (inland)
 
-#	if name_categories == ["Del av vatten"] and add_bay_names or feature['object'] == "Hav" and add_sea_names:
+#	if name_categories == ["Del av vatten"] and add_bay_names or feature.object == "Hav" and add_sea_names:
 #		for place in found_places:
 #			create_place_name_point(place)
 #			unused_count += 1
@@ -1999,7 +2976,7 @@ def get_place_name (feature, name_categories):
 
 	names = set()
 	for place in found_places[:]:
-		if (("place" in feature['tags'] and feature['tags']['place'] in ["island", "islet"] or "Sankmark" in feature['object'])
+		if (("place" in feature.tags and feature.tags['place'] in ["island", "islet"] or "Sankmark" in feature.object)
 				and source and (place['source'] != source or int(place['tags'][ source ]) < source_rank)):
 			found_places.remove(place)
 		elif place['tags']['name'] in names:  # Avoid duplicate names (Bottenviken, Vänern etc)
@@ -2026,20 +3003,20 @@ def get_place_name (feature, name_categories):
 
 	# Inform about extra name if place name already is established
 
-	if "ref:lantmateriet:ortnamn" in feature['tags'] and "name" in feature['tags']:
+	if "ref:lantmateriet:ortnamn" in feature.tags and "name" in feature.tags:
 		found = False
 		for place in found_places:
-			if (place['tags']['ref:lantmateriet:ortnamn'] != feature['tags']['ref:lantmateriet:ortnamn']
-					and place['tags']['name'] != feature['tags']['name']
-					and ("alt_name" not in feature['tags'] or place['tags']['name'] not in feature['tags']['alt_name'].split(";"))):
+			if (place['tags']['ref:lantmateriet:ortnamn'] != feature.tags['ref:lantmateriet:ortnamn']
+					and place['tags']['name'] != feature.tags['name']
+					and ("alt_name" not in feature.tags or place['tags']['name'] not in feature.tags['alt_name'].split(";"))):
 				create_place_name_point(place)
 				found = True
 
 		if found:
-			feature['tags']['FIXME'] = "Consider extra name: " + ", ".join(alt_names)
-			if feature['tags']['name'] in alt_names_short:
-				alt_names_short.remove(feature['tags']['name'])
-			feature['tags']['ALT_NAME'] = ";".join(alt_names_short)
+			feature.tags['FIXME'] = "Consider extra name: " + ", ".join(alt_names)
+			if feature.tags['name'] in alt_names_short:
+				alt_names_short.remove(feature.tags['name'])
+			feature.tags['ALT_NAME'] = ";".join(alt_names_short)
 
 	# Add name with aproproate FIXME tag if more than one found
 
@@ -2063,7 +3040,7 @@ def get_place_name (feature, name_categories):
 #					place['tags']['natural'] = "bay"
 				create_place_name_point(place)
 
-		feature['tags'].update(new_tags)	
+		feature.tags.update(new_tags)	
 		name_count += 1
 
 
@@ -2078,15 +3055,18 @@ def get_category_place_names(topo_categories, place_categories):
 
 	category_features = []
 	for feature in features:
-		if (feature['object'] in topo_categories
-				or "Ö" in topo_categories and "place" in feature['tags'] and feature['tags']['place'] in ["island", "islet"]):
-			feature['area'] = abs(polygon_area(feature['coordinates'][0]))
+		if (feature.object in topo_categories
+				or "Ö" in topo_categories and "place" in feature.tags and feature.tags['place'] in ["island", "islet"]):
+			feature.area = abs(polygon_area(feature.coordinates[0]))
 			category_features.append(feature)
 
-	category_features.sort(key=lambda feature: feature['area'], reverse=True)  # Priority to largest
+	category_features.sort(key=lambda feature: feature.area, reverse=True)  # Priority to largest
 
+	progress = Progress(len(category_features), topo_categories[0] + " polygons")
 	for feature in category_features:
 		get_place_name(feature, place_categories)
+		progress.update()
+	progress.finish()
 
 	if topo_categories == ["Hav"]:  # Run only used for excluding sea names
 		return
@@ -2095,18 +3075,20 @@ def get_category_place_names(topo_categories, place_categories):
 
 	remaining_features = []
 	for feature in category_features:
-		if "name" not in feature['tags']:
-			feature['bbox'] = get_bbox(feature['coordinates'][0], perimeter=50)
+		if "name" not in feature.tags:
+			feature.bbox = get_bbox(feature.coordinates[0], perimeter=50)
 			remaining_features.append(feature)
 
-	for place in place_names[:]:
+	progress = Progress(place_names.count_remaining(), "place names")
+	for place in place_names:
+		progress.update()
 		if place['tags']['DETALJTYP'] in place_categories:  # Note: Only works if same category name across features/place names
 			best_distance = 50
 
 			for feature in remaining_features:
 				for point in place['points']:
-					if bbox_overlap(feature['bbox'], point):
-						dist, i = shortest_distance(point, feature['coordinates'][0] )
+					if bbox_overlap(feature.bbox, point):
+						dist, i = shortest_distance(point, feature.coordinates[0] )
 						if dist < best_distance:
 							best_feature = feature
 							best_distance = dist
@@ -2121,12 +3103,14 @@ def get_category_place_names(topo_categories, place_categories):
 
 				# Else add name to feature
 				else:	
-					best_feature['tags'].update(place['tags'])
-					del best_feature['tags']['DETALJTYP']
+					best_feature.tags.update(place['tags'])
+					del best_feature.tags['DETALJTYP']
 					remaining_features.remove(best_feature)
 					place_names.remove(place)
 					name_count += 1	
 
+	progress.finish()
+
 
 
 # Match place names with rivers
@@ -2137,98 +3121,102 @@ def get_river_names():
 
 	rivers = []
 	for feature in features:
-		if feature['object'] in ["Vattendragsyta", "Vattendrag", "Akvedukt", "Fors", "Vattentub/vattenränna", "Vattenfall", "Dammbyggnad"]:
-			feature['bbox'] = get_bbox(feature['coordinates'], perimeter = 100)
+		if feature.object in ["Vattendragsyta", "Vattendrag", "Akvedukt", "Fors", "Vattentub/vattenränna", "Vattenfall", "Dammbyggnad"]:
+			feature.bbox = get_bbox(feature.coordinates, perimeter = 100)
 			rivers.append(feature)
 
 	# Loop each place name to determine closest fit with river.
 	# Include Vattendragsyta to avoid mismatches with smaller rivers/streams.
 	# No remaining Vattendrag place names after iteration.
 
+	progress = Progress(place_names.count_remaining(), "river names")
 	for place in place_names:
+		progress.update()
 		if place['tags']['DETALJTYP'] in ["Vattendrag", "Vattenfall", "Fors"]:
 			min_distance = 100
 			for feature in rivers:
 				for point in place['points']:
-					if (bbox_overlap(feature['bbox'], point)
-								and not (feature['object'] in ['Vattenfall', 'Fors'] and feature['object'] != place['tags']['DETALJTYP'])):
-						if feature['type'] == "LineString":
-							distance, index = shortest_distance(point, feature['coordinates'])
-						elif feature['type'] == "Polygon":
-							distance, index = shortest_distance(point, feature['coordinates'][0])  # For Vattendragsyta
+					if (bbox_overlap(feature.bbox, point)
+								and not (feature.object in ['Vattenfall', 'Fors'] and feature.object != place['tags']['DETALJTYP'])):
+						if feature.type == "LineString":
+							distance, index = shortest_distance(point, feature.coordinates)
+						elif feature.type == "Polygon":
+							distance, index = shortest_distance(point, feature.coordinates[0])  # For Vattendragsyta
 						else:
-							distance = point_distance(point, feature['coordinates'])  # For Vattenfall
+							distance = point_distance(point, feature.coordinates)  # For Vattenfall
 						if distance < min_distance:
 							min_distance = distance
 							found_feature = feature
 
-			if min_distance < 100 and found_feature['object'] != "Vattendragsyta":
-				if "places" not in found_feature:
-					found_feature['places'] = []
-				found_feature['places'].append(place)  # Build list of all matched place names for feature
+			if min_distance < 100 and found_feature.object != "Vattendragsyta":
+				if not hasattr(found_feature, "places"):
+					found_feature.places = []
+				found_feature.places.append(place)  # Build list of all matched place names for feature
 
 			elif not (topo_product == "Topo250" and place['tags']['DETALJTYP'] == "Vattendrag"):
 				# Create name node if no match
 				create_place_name_point(place)
 				unused_count += 1
 
+	progress.finish()
+
 	# Assign matched river name to feature
 
 	topo_rivers = set()  # Rivers with place name from T250/T100
 
 	for feature in rivers:
-		if "places" in feature:
+		if hasattr(feature, "places"):
 			name_count += 1
 
 			# Match with one place name
-			if len(set(place['tags']['name'] for place in feature['places'])) == 1:
-				for key, value in iter(feature['places'][0]['tags'].items()):
+			if len(set(place['tags']['name'] for place in feature.places)) == 1:
+				for key, value in iter(feature.places[0]['tags'].items()):
 					if "name" in key or key in ["ref:lantmateriet:ortnamn", "TYPE"]:
-						feature['tags'][ key ] = value
+						feature.tags[ key ] = value
 
 			# Match with several place names
 			else:
-				feature['places'].sort(key=sort_place, reverse=True)  # Priority to T250, T100 etc.
-				feature['tags']['FIXME'] = "Split waterway for names: " + ", ".join(place['tags']['name'] for place in feature['places'])
+				feature.places.sort(key=sort_place, reverse=True)  # Priority to T250, T100 etc.
+				feature.tags['FIXME'] = "Split waterway for names: " + ", ".join(place['tags']['name'] for place in feature.places)
 
-				for place in feature['places']:
+				for place in feature.places:
 					create_place_name_point(place)
 
 			# Store waterway id if high priority place name
-			for place in feature['places']:
+			for place in feature.places:
 				if place['source'] in ["T250", "T100"]:
-					if "vattendragsid" in feature['extras']:
-						topo_rivers.add(feature['extras']['vattendragsid'])
+					if "vattendragsid" in feature.extras:
+						topo_rivers.add(feature.extras['vattendragsid'])
 
 	# Set waterway=river for this vattendragsid if matching place name had highway priority
 
 	if not get_topo_rivers:
 		for feature in rivers:
-			if ("vattendragsid" in feature['extras']
-					and feature['extras']['vattendragsid'] in topo_rivers
-					and "waterway" in feature['tags']
-					and feature['tags']['waterway'] == "stream"):
-				feature['tags']['waterway'] = "river"
+			if ("vattendragsid" in feature.extras
+					and feature.extras['vattendragsid'] in topo_rivers
+					and "waterway" in feature.tags
+					and feature.tags['waterway'] == "stream"):
+				feature.tags['waterway'] = "river"
 
 	# Propagate name to several segments (not used due to naming conflicts)
 
 	'''
 	river_names = {}
 	for feature in rivers:
-		if "vattendragsid" in feature['extras']:
-			ref = feature['extras']['vattendragsid']
+		if "vattendragsid" in feature.extras:
+			ref = feature.extras['vattendragsid']
 			if ref not in river_names:
 				river_names[ ref ] = set()
-			if "FIXME" in feature['tags'] and "Split" in feature['tags']['FIXME']:
+			if "FIXME" in feature.tags and "Split" in feature.tags['FIXME']:
 				river_names[ ref ].add("FIXME")
-			elif "name" in feature['tags']:
-				river_names[ ref ].add(feature['tags']['name'])
+			elif "name" in feature.tags:
+				river_names[ ref ].add(feature.tags['name'])
 
 	for feature in rivers:
-		if "vattendragsid" in feature['extras'] and "name" not in feature['tags']:
-			ref = feature['extras']['vattendragsid']
+		if "vattendragsid" in feature.extras and "name" not in feature.tags:
+			ref = feature.extras['vattendragsid']
 			if len(river_names[ ref ]) == 1 and list(river_names[ ref ])[0] != "FIXME":
-				feature['tags']['name'] = list(river_names[ ref ])[0]
+				feature.tags['name'] = list(river_names[ ref ])[0]
 	'''
 
 
@@ -2266,6 +3254,7 @@ def get_place_names():
 		# To-do: Test skären, skäret, ön, holmen, ören, grundet, grynnan, revet, hällan, örarna, klippan, klubben, bådan, grönnan, grunden, harun
 
 	get_river_names()
+	place_names.compact()
 
 	# Pass 2: Add all remaining names for sea, bay/strait and glacier (sea names may have been removed earlier)
 
@@ -2281,15 +3270,15 @@ def get_place_names():
 		for element in elements:
 			first = True
 			for tag in ["T250", "T100", "T50", "T10"]:
-				if tag in element['tags']:
+				if tag in element.tags:
 					if not first:
-						del element['tags'][ tag ]
+						del element.tags[ tag ]
 					first = False
-				if tag + "_DISTANCE" in element['tags']:
-					del element['tags'][ tag + "_DISTANCE" ]
+				if tag + "_DISTANCE" in element.tags:
+					del element.tags[ tag + "_DISTANCE" ]
 			for tag in ["KOMMUN", "DETALJTYP"]:
-				if tag in element['tags']:
-					del element['tags'][ tag ]
+				if tag in element.tags:
+					del element.tags[ tag ]
 
 	message ("\t%i place names found\n" % name_count)
 	message ("\t%i place names not matched but added as nodes\n" % unused_count)
@@ -2297,7 +3286,7 @@ def get_place_names():
 
 
 
-# Get set of connections within segment between rach pair of two nodes
+# Get set of connections within segment between rach pair of two nodes.
 
 def get_connections (coordinates):
 
@@ -2316,21 +3305,31 @@ def get_connections (coordinates):
 
 def create_segment(coordinates, segment_type="Completion", used=1):
 
-	entry = {
-		'object': segment_type,
-		'type': 'LineString',
-		'uuid': None,
-		'coordinates': coordinates.copy(),
-		'members': [],
-		'tags': {},
-		'extras': {
-			'objekttyp': segment_type
-		},
-		'used': used
-	}
-	entry['bbox'] = get_bbox(entry['coordinates'])
+	entry = Segment(segment_type, coordinates.copy(), extras={'objekttyp': segment_type}, used=used)
+	entry.parents = set()
 	segments.append(entry)
-	return len(segments) - 1
+	if count_operations:
+		add_count("segments created")
+	return len(segments) - 1  # Position including removed segments
+
+
+
+# Update index of parents of segments.
+# Each segment has a set of (feature, patch index) for the relations where it is a member.
+# Must be updated whenever the members of a feature are changed.
+
+def add_parents(feature):
+
+	for j, patch in enumerate(feature.members):
+		for member in patch:
+			segments[ member ].parents.add(( feature, j ))
+
+
+def remove_parents(feature):
+
+	for j, patch in enumerate(feature.members):
+		for member in patch:
+			segments[ member ].parents.discard(( feature, j ))
 
 
 
@@ -2342,8 +3341,8 @@ def split_overlapping_wetlands():
 
 	wetland_features = []
 	for feature in features:
-		if "Sankmark" in feature['object']:
-			feature['bbox'] = get_bbox(feature['coordinates'])
+		if "Sankmark" in feature.object:
+			feature.bbox = get_bbox(feature.coordinates)
 			wetland_features.append(feature)
 
 	count = 0
@@ -2353,11 +3352,11 @@ def split_overlapping_wetlands():
 	for i1, feature1 in enumerate(wetland_features):
 		for i2, feature2 in enumerate(wetland_features):
 			if (i2 > i1
-					and feature1['object'] != feature2['object']
-					and bbox_overlap(feature1['bbox'], feature2['bbox'])):
+					and feature1.object != feature2.object
+					and bbox_overlap(feature1.bbox, feature2.bbox)):
 
-				for patch1 in feature1['coordinates']:
-					for patch2 in feature2['coordinates']:
+				for patch1 in feature1.coordinates:
+					for patch2 in feature2.coordinates:
 						overlap = set(patch1) & set(patch2)
 
 						# Iterate patch1 and create new segments when overlapping patch2
@@ -2400,8 +3399,7 @@ def split_wetland_segments():
 	def split_segment(coordinates, old_segment):
 
 		new_segment = copy.deepcopy(old_segment)
-		new_segment['coordinates'] = coordinates
-		new_segment['bbox'] = get_bbox(new_segment['coordinates'])
+		new_segment.coordinates = coordinates
 		segments.append(new_segment)
 
 		return new_segment
@@ -2412,47 +3410,44 @@ def split_wetland_segments():
 
 	shore_segments = []
 	for segment in segments:
-		if ("Strandlinje" in segment['object']
-				or segment['object'] == "Sankmark gräns"
-				or (merge_wetland or topo_product == "Topo250") and "gräns" in segment['object']):
-			segment['bbox'] = get_bbox(segment['coordinates'])
+		if ("Strandlinje" in segment.object
+				or segment.object == "Sankmark gräns"
+				or (merge_wetland or topo_product == "Topo250") and "gräns" in segment.object):
 			shore_segments.append(segment)
 
 	wetland_features = []
 	for feature in features:
-		if "Sankmark" in feature['object']:
-			feature['bbox'] = get_bbox(feature['coordinates'])
+		if "Sankmark" in feature.object:
+			feature.bbox = get_bbox(feature.coordinates)
 			wetland_features.append(feature)
 
 
 	# 1. Check for segments to be split
 
-	count = len(wetland_features)
 	count_split = 0
+	progress = Progress(len(wetland_features), "wetland polygons")
 
 	for feature in wetland_features:
 
-			if count % 100 == 0:
-				message ("\r\t%i " % count)
-			count -= 1
+			progress.update()
 
-			for patch in feature['coordinates']:
+			for patch in feature.coordinates:
 
 				patch_bbox = get_bbox(patch)
-				patch_set = set(patch)
+				patch_set = patch.node_set
 				
 				for segment in shore_segments:
 
-					if bbox_overlap(patch_bbox, segment['bbox']):
+					if bbox_overlap(patch_bbox, segment.bbox):
 
-						segment_set = set(segment['coordinates'])
-						segment_endpoints_set = set([ segment['coordinates'][0], segment['coordinates'][-1] ])
+						segment_set = segment.coordinates.node_set
+						segment_endpoints_set = set([ segment.coordinates[0], segment.coordinates[-1] ])
 						overlap = segment_set & patch_set
 
 						if overlap and not segment_set <= patch_set and not overlap <= segment_endpoints_set:
 
 							count_new = 0
-							remaining_coordinates = segment['coordinates'].copy()
+							remaining_coordinates = segment.coordinates.copy()
 							new_coordinates = []
 
 							while remaining_coordinates:
@@ -2485,73 +3480,72 @@ def split_wetland_segments():
 								count_split += 1
 								break
 
+	segments.compact()
+	progress.finish()
 	message ("\r\tSplit %i wetland segments\n" % count_split)
 
 
 	# 2. Check for missing node in wetland polygon
 
-	count = len(shore_segments)
 	count_insert = 0
+	progress = Progress(len(shore_segments), "shore segments")
 
 	for segment in shore_segments:
 
-		if count % 100 == 0:
-			message ("\r\t%i " % count)
-		count -= 1
+		progress.update()
 
-		segment_set = set(segment['coordinates'])
+		segment_set = segment.coordinates.node_set
 
 		for feature in wetland_features:
-			if bbox_overlap(segment['bbox'], feature['bbox']):
-				for i, patch in enumerate(feature['coordinates']):
+			if bbox_overlap(segment.bbox, feature.bbox):
+				for i, patch in enumerate(feature.coordinates):
 
-					overlap = segment_set & set(patch)
+					overlap = segment_set & patch.node_set
 					leftover = segment_set - overlap
 
 					if len(leftover) <= 0.5 * len(segment_set):  # Max every second node missing
 						for node in leftover:
-							new_patch = feature['coordinates'][ i ]  # Will be modified for each hit
+							new_patch = feature.coordinates[ i ]  # Will be modified for each hit
 							dist, j = shortest_distance(node, new_patch)
 							step_distance = point_distance(new_patch[ j ], new_patch[ j + 1 ])
 							if (dist < 0.2
 									and point_distance(node, new_patch[ j ]) < step_distance
 									and point_distance(node, new_patch[ j + 1 ]) < step_distance):
 
-								feature['coordinates'][ i ].insert(j + 1, node)  # Insert node in patch
+								feature.coordinates[ i ].insert(j + 1, node)  # Insert node in patch
 								create_point(node, "Missing wetland node")  # Debug
 								count_insert += 1
 
+	progress.finish()
 	message ("\r\tInserted %i missing nodes in wetland polygons\n" % count_insert)
 
 
 	# 3. Check for oposite: Surplus node in polygon (on straight line)
 
-	count = len(shore_segments)
 	count_remove = 0
+	progress = Progress(len(shore_segments), "shore segments")
 
 	for segment in shore_segments:
 
-		if count % 100 == 0:
-			message ("\r\t%i " % count)
-		count -= 1
+		progress.update()
 
-		segment_set = set(segment['coordinates'])
+		segment_set = segment.coordinates.node_set
 
 		for feature in wetland_features:
-			if bbox_overlap(segment['bbox'], feature['bbox']):
-				for i, patch in enumerate(feature['coordinates']):
-					patch_set = set(patch)
+			if bbox_overlap(segment.bbox, feature.bbox):
+				for i, patch in enumerate(feature.coordinates):
+					patch_set = patch.node_set
 
 					if segment_set <= patch_set:
 
 						# Determine direction
-						start = patch.index(segment['coordinates'][0])
-						second = patch.index(segment['coordinates'][1])
-						if second > start or start == len(segment['coordinates']) - 2 and second < 2:  # Could wrap around
-							end = patch.index(segment['coordinates'][-1])
+						start = patch.index(segment.coordinates[0])
+						second = patch.index(segment.coordinates[1])
+						if second > start or start == len(segment.coordinates) - 2 and second < 2:  # Could wrap around
+							end = patch.index(segment.coordinates[-1])
 						else:
 							end = start
-							start = patch.index(segment['coordinates'][-1])
+							start = patch.index(segment.coordinates[-1])
 
 						# Determine which intermediate nodes in patch are not found in segment
 						remove_node = []
@@ -2562,7 +3556,7 @@ def split_wetland_segments():
 								j = 0
 
 							if patch[ j ] not in segment_set and j != end:
-								dist, index = shortest_distance(patch[j], segment['coordinates'])
+								dist, index = shortest_distance(patch[j], segment.coordinates)
 								if dist < 0.2:
 									remove_node.append(j)
 
@@ -2570,11 +3564,12 @@ def split_wetland_segments():
 						remove_node.sort(reverse=True)
 						for j in remove_node:
 							create_point(patch[ j ], "Surplus wetland node")  # Debug
-							del feature['coordinates'][ i ][ j ]
+							del feature.coordinates[ i ][ j ]
 							if j == 0:
-								feature['coordinates'][ i ][-1] = feature['coordinates'][ i ][0]  # Ensure circle
+								feature.coordinates[ i ][-1] = feature.coordinates[ i ][0]  # Ensure circle
 							count_remove += 1
 
+	progress.finish()
 	message ("\r\tRemoved %i surplus nodes in wetland polygons\n" % count_remove)
 
 
@@ -2585,29 +3580,28 @@ def split_long_segments():
 
 	count_split = 0
 
-	for i, segment in enumerate(segments[:]):
-		if segment['used'] > 0 and len(segment['coordinates']) >= 2000:
-			steps = len(segment['coordinates']) // 1000
-			step_length = (len(segment['coordinates']) // steps) + 1
-			new_segments = []
-			for j in range(steps):
-				new_segment = copy.deepcopy(segment)
-				new_segment['coordinates'] = segment['coordinates'][ j * step_length : (j + 1) * step_length + 1 ]
-				new_segments.append(new_segment)				
-
-			segment['coordinates'] = new_segments[0]['coordinates']
+	for i, segment in list(segments.enumerate()):
+		if segment.used > 0 and len(segment.coordinates) >= 2000:
+			steps = len(segment.coordinates) // 1000
+			step_length = (len(segment.coordinates) // steps) + 1
 			new_members = [i]
-			for new_segment in new_segments[1:]:
+			for j in range(1, steps):
+				new_segment = Segment(segment.object, segment.coordinates[ j * step_length : (j + 1) * step_length + 1 ],
+										tags=copy.deepcopy(segment.tags), extras=copy.deepcopy(segment.extras),
+										uuid=segment.uuid, used=segment.used)
+				new_segment.parents = set(segment.parents)
 				segments.append(new_segment)
 				new_members.append(len(segments) - 1)
 
-			for feature in features:
-				if feature['type'] == "Polygon":
-					for j, member_patch in enumerate(feature['members']):
-						if i in member_patch:
-							for k, member in enumerate(member_patch):
-								if member == i:
-									feature['members'][ j ] = member_patch[ : k ] + new_members + member_patch[ k + 1 : ]  # Todo: Check order
+			segment.coordinates = segment.coordinates[ : step_length + 1 ]
+
+			# Update only the relations where segment is a member
+
+			for feature, j in segment.parents:
+				member_patch = feature.members[ j ]
+				for k, member in enumerate(member_patch):
+					if member == i:
+						feature.members[ j ] = member_patch[ : k ] + new_members + member_patch[ k + 1 : ]  # Todo: Check order
 
 			count_split += 1
 
@@ -2623,39 +3617,62 @@ def check_coastline():
 
 	def check_match(segment):
 
-		nonlocal sea_features
-
-		segment_bbox = get_bbox([ segment['coordinates'][0], segment['coordinates'][-1] ])
-		segment_set = set(segment['coordinates'])
-		for feature in sea_features:
-			if bbox_overlap(segment_bbox, feature['bbox']):
-				for patch in feature['coordinates']:
-					if segment['coordinates'][0] in patch or segment['coordinates'][-1] in patch:
-
-						missing = segment_set - set(patch)
-						if len(missing) == 0:
-							return False
-						elif len(missing) == 1:
-							missing_node = list(missing)[0]
-							for i, node in enumerate(patch):
-								if node not in segment_set:
-									if point_distance(node, missing_node) < 0.01:
-										patch[ i ] = missing_node
-										return True
+		segment_bbox = get_bbox([ segment.coordinates[0], segment.coordinates[-1] ])
+		segment_set = segment.coordinates.node_set
+
+		# Check Hav patches containing one of the end nodes of the segment, in order of features and patches
+
+		end_patches = set()
+		for node in [ segment.coordinates[0], segment.coordinates[-1] ]:
+			end_patches.update((f, p) for f, p, position in sea_index.get(node, []))
+
+		for f, p in sorted(end_patches):
+			feature = sea_features[ f ]
+			if bbox_overlap(segment_bbox, feature.bbox):
+				patch = feature.coordinates[ p ]
+
+				missing = segment_set - patch.node_set
+				if len(missing) == 0:
+					return False
+				elif len(missing) == 1:
+
+					# The node to be replaced is next to a neighbour of the missing node in the patch
+					missing_node = list(missing)[0]
+					k = segment.coordinates.index(missing_node)
+					positions = set()
+					for node in segment.coordinates[ max(k - 1, 0) : k + 2 ]:
+						for f2, p2, position in sea_index.get(node, []):
+							if f2 == f and p2 == p:
+								positions.update([ position - 1, position + 1 ])
+					if len(patch) - 1 in positions and patch[0] == patch[-1]:
+						positions.add(0)  # First occurrence of closing node
+
+					for i in sorted(positions):
+						if 0 <= i < len(patch) and patch[ i ] not in segment_set:
+							if point_distance(patch[ i ], missing_node) < 0.01:
+								sea_index[ patch[ i ] ].remove(( f, p, i ))
+								sea_index.setdefault(missing_node, []).append(( f, p, i ))
+								patch[ i ] = missing_node
+								return True
 		return False
 
 
-	# Start of main function
+	# Start of main function.
+	# Index of (feature, patch, position) in Hav features for each node.
 
 	sea_features = []
+	sea_index = {}
 	for feature in features:
-		if feature['object'] == "Hav":
-			feature['bbox'] = get_bbox(feature['coordinates'][0])
+		if feature.object == "Hav":
+			feature.bbox = get_bbox(feature.coordinates[0])
+			for p, patch in enumerate(feature.coordinates):
+				for i, node in enumerate(patch):
+					sea_index.setdefault(node, []).append(( len(sea_features), p, i ))
 			sea_features.append(feature)
 
 	count_repair = 0
 	for segment in segments:
-		if segment['object'] in ["Strandlinje, hav", "Stängning mot hav"]:
+		if segment.object in ["Strandlinje, hav", "Stängning mot hav"]:
 			if check_match(segment):
 				count_repair += 1
 
@@ -2665,49 +3682,50 @@ def check_coastline():
 
 # Create missing segments to get complete polygons
 
-def create_missing_segments (patch, members):
+def create_missing_segments (patch_ids, members):
 
-	# First create list of existing conncetions between coordinates i and i+1 of patch
+	# First create set of existing connections between node ids i and i+1 of patch (ordered pairs of node ids)
 
 	connections = set()
 	for member in members:
-		connections.update(get_connections(segments[ member ]['coordinates']))
+		connections.update(segments[ member ].coordinates.edges)
 
 	# Then create new segments for the parts of patch which have no segments
 
 	count_new = 0
-	remaining_coordinates = patch.copy()
-	last_node = remaining_coordinates.pop(0)
+	remaining_ids = patch_ids.tolist()
+	remaining_ids.reverse()  # Pop from end
+	last_node = remaining_ids.pop()
 
-	while remaining_coordinates:
+	while remaining_ids:
 
 		# Pass segment which is already part of a member
 
-		while remaining_coordinates and (last_node, remaining_coordinates[0]) in connections:
-			last_node = remaining_coordinates.pop(0)
+		while remaining_ids and get_edge(last_node, remaining_ids[-1]) in connections:
+			last_node = remaining_ids.pop()
 
 		# Build segment which is missing
 
-		new_coordinates = [ last_node ]
+		new_ids = [ last_node ]
 
-		while remaining_coordinates and (new_coordinates[-1], remaining_coordinates[0]) not in connections:
-			new_coordinates.append(remaining_coordinates.pop(0))
+		while remaining_ids and get_edge(new_ids[-1], remaining_ids[-1]) not in connections:
+			new_ids.append(remaining_ids.pop())
 
-		if len(new_coordinates) > 1:
-			member_id = create_segment(new_coordinates, used=1)
+		if len(new_ids) > 1:
+			member_id = create_segment([ node_table.nodes[ node_id ] for node_id in new_ids ], used=1)
 			members.append( member_id )
 			count_new += 1
-			connections.update(get_connections(new_coordinates))
+			connections.update(segments[ member_id ].coordinates.edges)
 
-		last_node = new_coordinates[-1]
+		last_node = new_ids[-1]
 
 
 
 # Function for getting priority of feature objects.
 
 def feature_order(feature):
-	if feature['object'] in object_sorting_order:
-		return object_sorting_order.index(feature['object'])
+	if feature.object in object_sorting_order:
+		return object_sorting_order.index(feature.object)
 	else:
 		return 100
 
@@ -2726,15 +3744,15 @@ def create_relations_structure():
 	# Function for sorting member segments of polygon relation
 	# Index 1 used to avoid equal 0/-1 positions
 
-	def segment_position(segment_index, patch):
-		coordinates = segments[ segment_index ]['coordinates']
-		if len(coordinates) == 2:
-			if coordinates == patch[-2:] or coordinates == patch[-1:-3:-1]:  # Last two nodes
-				return len(patch)
+	def segment_position(segment_index, patch_ids, patch_position):
+		node_ids = segments[ segment_index ].coordinates.node_ids
+		if len(node_ids) == 2:
+			if node_ids == patch_ids[-2:] or node_ids == patch_ids[-1:-3:-1]:  # Last two nodes
+				return len(patch_ids)
 			else:
-				return max(patch.index(coordinates[0]), patch.index(coordinates[1]))
+				return max(patch_position[ node_ids[0] ], patch_position[ node_ids[1] ])
 		else:
-			return patch.index(coordinates[1])
+			return patch_position[ node_ids[1] ]
 
 
 	if data_category in ["topo", "mark"]:
@@ -2747,270 +3765,338 @@ def create_relations_structure():
 
 	message ("Create topo relations ...\n")
 
-	# Create bbox for segments and line features
+	# Note: Segment indexes are fixed from here, since they are used by relation members.
+
+	segments.compact()
 
 	for segment in segments:
-		segment['bbox'] = get_bbox(segment['coordinates'])
+		segment.parents = set()
 
 	# Loop all polygons and patches
 
 	lap = time.time()
 	split_count = 0
-	count = sum([feature['type'] == "Polygon" for feature in features])
+	progress = Progress(sum([feature.type == "Polygon" for feature in features]), "polygons")
+	segment_bboxes = []  # Bbox of each segment for scanning below. Extended when new segments are created.
 
-	ordered_features = copy.copy(features)  # Shallow copy of list
-	ordered_features.sort(key=feature_order)  # Sort first coastline, lakes, rivers etc.
+	ordered_features = sorted(features, key=feature_order)  # Sort first coastline, lakes, rivers etc.
 
 	for feature in ordered_features:
 
-		if feature['type'] != "Polygon":
+		if feature.type != "Polygon":
 			continue
 
-		if count % 100 == 0:
-			message ("\r\t%i " % count)
-		count -= 1
+		progress.update()
 		matching_polygon = []
 
-		for patch in feature['coordinates']:
+		for patch in feature.coordinates:
 			matching_segments = []
 			matched_nodes = 0
-			patch_set = set(patch)
+			patch_ids = node_table.get_ids(patch)
+			patch_set = set(patch_ids)
+			patch_position = dict(zip(reversed(patch_ids), range(len(patch_ids) - 1, -1, -1)))  # First position of each node
+			patch_closed = patch_ids[0] == patch_ids[-1]
 			patch_connections = set()
 
 			# Try matching with segments within the polygon's bbox
 
 			patch_bbox = get_bbox(patch)
+			segment_bboxes.extend(segments[ i ].bbox for i in range(len(segment_bboxes), len(segments)))
+			tested = segments.count_remaining()
+			bbox_hits = 0
 
-			for i, segment in enumerate(segments):
-
-				if bbox_overlap(patch_bbox, segment['bbox']) and set(segment['coordinates']) <= patch_set:
+			for i, segment in segments.enumerate():
 
-					segment_connections = get_connections(segment['coordinates'])
-					if segment_connections & patch_connections:
-						continue
+				if not bbox_overlap(patch_bbox, segment_bboxes[ i ]):
+					continue
+				bbox_hits += 1
+				if not patch_set.issuperset(segment.coordinates.node_ids):
+					continue
 
-					# Note: If patch is a closed way, segment may wrap start/end of patch
+				node_ids = segment.coordinates.node_ids
+				segment_connections = segment.coordinates.edges
+				if not patch_connections.isdisjoint(segment_connections):
+					continue
 
-					if len(segment['coordinates']) >= 2:
-						node1 = patch.index(segment['coordinates'][0])
-						node2 = patch.index(segment['coordinates'][-1])
-						if (not(abs(node1 - node2) == len(segment['coordinates']) - 1
-									or patch[0] == patch[-1] and abs(node1 - node2) == len(patch) - len(segment['coordinates']))):
-							continue
+				# Note: If patch is a closed way, segment may wrap start/end of patch
 
-					# Only exact match permitted for wetland if Topo50, 100, 250
-					if "Sankmark" in feature['object'] and topo_product in ["Topo50", "Topo100"] and set(segment['coordinates']) != patch_set:
+				if len(node_ids) >= 2:
+					node1 = patch_position[ node_ids[0] ]
+					node2 = patch_position[ node_ids[-1] ]
+					if (not(abs(node1 - node2) == len(node_ids) - 1
+								or patch_closed and abs(node1 - node2) == len(patch_ids) - len(node_ids))):
 						continue
 
-					# Avoid special case of Stängning segment used in sea
-					if feature['object'] == "Hav" and segment['object'] == "Stängning":
-						continue
+				# Only exact match permitted for wetland if Topo50, 100, 250
+				if "Sankmark" in feature.object and topo_product in ["Topo50", "Topo100"] and set(node_ids) != patch_set:
+					continue
+
+				# Avoid special case of Stängning segment used in sea
+				if feature.object == "Hav" and segment.object == "Stängning":
+					continue
+
+				matching_segments.append( i )
+				matched_nodes += len(node_ids) - 1
+				patch_connections.update(segment_connections)
 
-					matching_segments.append( i )
-					matched_nodes += len(segment['coordinates']) - 1
-					patch_connections.update(segment_connections)
+				# Correct direction of segments. Note sorting order of features in outer loop.
 
-					# Correct direction of segments. Note sorting order of features in outer loop.
+				if (feature.object in ['Hav', 'Sjö', 'Anlagt vatten', 'Vattendragsyta']
+						and "Strandlinje" in segment.object or "Stängning" in segment.object):
 
-					if (feature['object'] in ['Hav', 'Sjö', 'Anlagt vatten', 'Vattendragsyta']
-							and "Strandlinje" in segment['object'] or "Stängning" in segment['object']):
+					# Check if feature polygon and segment line have same direction
+					node1 = patch_position[ node_ids[0] ]
+					node2 = patch_position[ node_ids[1] ]
+					same_direction = node1 + 1 == node2 or patch_closed and node1 == len(patch_ids) - 2 and node2 == 0
 
-						# Check if feature polygon and segment line have same direction
-						node1 = patch.index(segment['coordinates'][0])
-						node2 = patch.index(segment['coordinates'][1])
-						same_direction = node1 + 1 == node2 or patch[0] == patch[-1] and node1 == len(patch) - 2 and node2 == 0
+					if not same_direction and segment.used == 0:
+						segment.coordinates.reverse()
+						segment.extras['reversert'] = "yes"
 
-						if not same_direction and segment['used'] == 0:
-							segment['coordinates'].reverse()
-							segment['extras']['reversert'] = "yes"
+					segment.used += 1
 
-						segment['used'] += 1
+				elif feature.object != "Hav":
+					segment.used += 1
 
-					elif feature['object'] != "Hav":
-						segment['used'] += 1
+				if len(patch_connections) == len(patch_ids) - 1:   # matched_nodes == len(patch) - 1:
+					tested = i + 1
+					break
 
-					if len(patch_connections) == 2 * (len(patch) - 1):   # matched_nodes == len(patch) - 1:
-						break
+			if count_operations:
+				add_count("bbox tests", tested)
+				add_count("bbox hits", bbox_hits)
 
 			if matching_segments:
 				# Use leftover nodes to create missing border segments
-				if len(patch_connections) < 2 * (len(patch) - 1) and feature['object'] != "Hav":   #  matched_nodes < len(patch) - 1 
-					create_missing_segments(patch, matching_segments)
+				if len(patch_connections) < len(patch_ids) - 1 and feature.object != "Hav":   #  matched_nodes < len(patch) - 1 
+					create_missing_segments(patch_ids, matching_segments)
 
 				# Sort relation members for better presentation
-				matching_segments.sort(key=lambda segment_index: segment_position(segment_index, patch))
+				matching_segments.sort(key=lambda segment_index: segment_position(segment_index, patch_ids, patch_position))
 				matching_polygon.append(matching_segments)
 				split_count += len(matching_segments) - 1
 			else:
-#				message ("\t*** NO MATCH: %s\n" % (feature['uuid']))
-#				feature['extras']['segmentering'] = "no"
+#				message ("\t*** NO MATCH: %s\n" % (feature.uuid))
+#				feature.extras['segmentering'] = "no"
 				member = create_segment(patch, used=1)
 				matching_polygon.append([ member ])
 
 		if matching_polygon:
-			feature['members'] = matching_polygon
+			feature.members = matching_polygon
+			add_parents(feature)
 		else:
 			# Backup output
-			feature['type'] = "LineString"
-			feature['coordinates'] = feature['coordinates'][0]
-			feature['tags']['FIXME'] = "Repair polygon"
+			feature.type = "LineString"
+			feature.coordinates = feature.coordinates[0]
+			feature.tags['FIXME'] = "Repair polygon"
 
+	progress.finish()
 	message ("\r\tSplit polygons into %i segments\n" % split_count)
 
 	# Simplify and combine geometry
 
 	if simplify:
-		if merge_grid:
-			combine_features()
-		combine_segments()
-		split_long_segments()
+		with profile_stage("combine"):
+			if merge_grid:
+				combine_features()
+			combine_segments()
+			split_long_segments()
 
-	# Note: After this point, feature['coordinates'] may not exactly match member segments.
+	# Note: After this point, feature.coordinates may not exactly match member segments.
 
 	message ("\tRun time %s\n" % (timeformat(time.time() - lap)))
 
 
 
-# Reorder outer members of feature.
-# Used after combining two touching features.
+# Assemble chains of member segments by matching end nodes, e.g. to build rings of a relation.
+# End nodes are indexed once, and each chain is extended with the first remaining member (in given order) at its end node.
+# If directed, members are only used in their own direction, and a chain stops when closed.
+# If not directed, members may be reversed, a chain continues as long as possible, and assembly stops after the first open chain.
+# Returns list of chains as (members, coordinates), and list of members not used.
 
-def fix_member_order(feature):
+def assemble_rings(members, directed=False):
 
-	# Identify each ring and build list of rings (patches)
+	# Index positions of members at each end node
 
-	remaining_members = copy.deepcopy(feature['members'][0])
-	polygon_patches = []
-	found = True
-
-	while remaining_members and found:
-		coordinates = copy.copy(segments[ remaining_members[0] ]['coordinates'])
-		patch = [ remaining_members[0] ]
-		start_member = patch[0]
-		remaining_members.pop(0)
-		patch_direction = 1
-		found = True
+	endpoints = {}
+	for k, member in enumerate(members):
+		coordinates = segments[ member ].coordinates
+		endpoints.setdefault(coordinates[0], []).append(k)
+		if not directed:
+			endpoints.setdefault(coordinates[-1], []).append(k)
 
-		# Keep adding members as long as they match end-to-end
+	# Build chains, starting with first remaining member
 
-		while found:
-			found = False
-			for member in remaining_members:
-				member_coordinates = segments[ member ]['coordinates']
-				if coordinates[-1] == member_coordinates[0]:
-					coordinates.extend(member_coordinates[1:])
-					patch.append(member)
-					direction = 1
-				elif coordinates[-1] == member_coordinates[-1]:
-					coordinates.extend(list(reversed(member_coordinates))[1:])
-					patch.append(member)
-					direction = -1
-				else:
-					continue
+	used = [ False ] * len(members)
+	chains = []
 
-				patch_direction += direction
-				remaining_members.remove(member)
-				found = True
+	for start in range(len(members)):
+		if used[ start ]:
+			continue
+
+		used[ start ] = True
+		chain = [ members[ start ] ]
+		coordinates = segments[ members[ start ] ].coordinates.copy()
+
+		while not (directed and coordinates[0] == coordinates[-1]):
+			candidates = [ k for k in endpoints.get(coordinates[-1], []) if not used[ k ] ]
+			if not candidates:
 				break
 
+			k = min(candidates)
+			member_coordinates = segments[ members[ k ] ].coordinates
+			if member_coordinates[0] == coordinates[-1]:
+				coordinates.extend(itertools.islice(member_coordinates, 1, None))
+			else:
+				coordinates.extend(itertools.islice(reversed(member_coordinates), 1, None))  # Reversed, excluding last node
+			chain.append(members[ k ])
+			used[ k ] = True
+
+		chains.append((chain, coordinates))
+
+		if not directed and coordinates[0] != coordinates[-1]:
+			break
+
+	remaining = [ member for k, member in enumerate(members) if not used[ k ] ]
+
+	return (chains, remaining)
+
+
+
+# Reorder outer members of feature.
+# Used after combining two touching features.
+
+def fix_member_order(feature):
+
+	# Identify each ring and build list of rings (patches)
+
+	chains, remaining_members = assemble_rings(feature.members[0])
+
+	polygon_patches = []
+	for members, coordinates in chains:
 		if coordinates[0] == coordinates[-1]:
 			polygon_patch = {
-				'members': patch,
-				'coordinates': coordinates
+				'members': members,
+				'coordinates': coordinates,
+				'area': polygon_area(coordinates)
 			}
 			polygon_patches.append(polygon_patch)
-			found = True
 
 	if not remaining_members and polygon_patches:
-		for patch in polygon_patches:
-			patch['area'] = polygon_area(patch['coordinates'])
-
 		polygon_patches.sort(key=lambda patch: abs(patch['area']), reverse=True)  # Largest/outer polygon first
-		feature['coordinates'] = [ patch['coordinates'] for patch in polygon_patches ] + feature['coordinates'][1:]
-		feature['members'] = [ patch['members'] for patch in polygon_patches ] + feature['members'][1:]
+		feature.coordinates = [ patch['coordinates'] for patch in polygon_patches ] + feature.coordinates[1:]
+		feature.members = [ patch['members'] for patch in polygon_patches ] + feature.members[1:]
 	else:
-		message ("\t*** UNORDERED MEMBERS: %s\n" % feature['uuid'])
+		message ("\t*** UNORDERED MEMBERS: %s\n" % feature.uuid)
 
 
 
-# Combine features across Gridline
+# Combine features across Gridline.
+# Components of features to be combined are first identified with union-find, then each component is combined once.
 
 def combine_features():
 
-	# Get list of parents (features) for each segment.
+	# Internal function for finding root feature of component in union-find structure
+
+	def find(feature):
+
+		root = feature
+		while leader[ root ] is not root:
+			root = leader[ root ]
+
+		while leader[ feature ] is not root:  # Path compression
+			leader[ feature ], feature = root, leader[ feature ]
+
+		return root
+
+
+	# Start of main function
+
+	position = { feature: i for i, feature in features.enumerate() }  # For keeping order of parents
+	leader = {}  # Parent of each feature in union-find structure
+	outer_members = {}  # Outer members of each component, excluding common members of combined features
+	component = {}  # Features of each component, in order of combination
+
+	for feature in features:
+		if feature.type == "Polygon" and feature.members:
+			leader[ feature ] = feature
+			outer_members[ feature ] = set(feature.members[0])
+			component[ feature ] = [ feature ]
+
+	# Loop segment and join components of asociated features if Gridline is found
 
 	for segment in segments:
-		segment['parents'] = []
-
-	for i, feature in enumerate(features):
-		if feature['type'] == "Polygon":
-			for member in feature['members'][0]:
-				segments[ member ]['parents'].append(i)
-
-	# Loop segment and combine asociated features if Gridline is found
-
-	remove_features = []  # Will contain all features to be removed after combination
-
-	for i, segment in enumerate(segments):
-		if (segment['object'] == "Gridline"
-				and segment['used'] > 0
-				and len(segment['parents']) == 2
-				and features[ segment['parents'][0] ]['object'] == features[ segment['parents'][1] ]['object']
-				and segment['parents'][0] != segment['parents'][1]
-				and	not (features[ segment['parents'][0] ]['object'] in ["Barr- och blandskog", "Skog"]  # 'Lövskog'
-						and (len(features[ segment['parents'][0] ]['members'][0]) > max_combine_members
-								and len(features[ segment['parents'][1] ]['members'][0]) > max_combine_members
-							or on_grid_cross(segment['coordinates'])))):  
-
-			feature1 = features[ segment['parents'][0] ]  # To keep
-			feature2 = features[ segment['parents'][1] ]  # To include in feature1
-			feature1_index = segment['parents'][0]
-			feature2_index = segment['parents'][1]
-			if len(feature2['members'][0]) > max_combine_members or len(feature2['members'][0]) > len(feature1['members'][0]):
+		if segment.object != "Gridline" or segment.used <= 0:
+			continue
+
+		parents = sorted([ find(feature) for feature, j in segment.parents if j == 0 ], key=position.get)  # Outer patch only
+
+		if (len(parents) == 2
+				and parents[0] is not parents[1]
+				and parents[0].object == parents[1].object
+				and	not (parents[0].object in ["Barr- och blandskog", "Skog"]  # 'Lövskog'
+						and (len(outer_members[ parents[0] ]) > max_combine_members
+								and len(outer_members[ parents[1] ]) > max_combine_members
+							or on_grid_cross(segment.coordinates)))):  
+
+			feature1, feature2 = parents  # Keep feature1, include feature2 in feature1
+			if (len(outer_members[ feature2 ]) > max_combine_members
+					or len(outer_members[ feature2 ]) > len(outer_members[ feature1 ])):
 				feature1, feature2 = feature2, feature1
-				feature1_index, feature2_index = feature2_index, feature1_index
 
 			# Exclude features with KantUtsnitt
-#			if (feature2['object'] in ['Lövskog', 'Barr- och blandskog']
-#					and	any([segments[ member ]['object'] == "KantUtsnitt" for member in feature2['members'][0]])):
+#			if (feature2.object in ['Lövskog', 'Barr- och blandskog']
+#					and	any([segments[ member ].object == "KantUtsnitt" for member in feature2.members[0]])):
 #				continue
 
-			# Inner roles not supported
-			if i not in feature1['members'][0] or i not in feature2['members'][0]:
-				continue
-
-			# Update list of combined members
+			# Update set of combined members. Common members are removed. Smallest set is merged into largest set.
 
-			removed_members = []
+			members1 = outer_members[ feature1 ]
+			members2 = outer_members.pop(feature2)
+			if len(members2) > len(members1):
+				members1, members2 = members2, members1
 
-			for member1 in feature1['members'][0][:]:
-				if member1 in feature2['members'][0]:
-					feature1['members'][0].remove(member1)  # Remove all common members
-					removed_members.append(member1)
-					segments[ member1 ]['used'] -= 2
+			for member in members2:
+				if member in members1:
+					members1.remove(member)  # Remove all common members
+					segments[ member ].used -= 2
+				else:
+					members1.add(member)
 
-			for member2 in feature2['members'][0]:
-				if member2 not in removed_members:
-					feature1['members'][0].append(member2)  # Merge into relation1
-					segments[ member2 ]['parents'].append(feature1_index)
-					segments[ member2 ]['parents'].remove(feature2_index)
+			outer_members[ feature1 ] = members1
+			leader[ feature2 ] = feature1
+			component[ feature1 ].extend(component.pop(feature2))
 
-			for patch in feature2['members'][1:]:
-				feature1['members'].append(patch)
+	# Combine members of each component into the first feature and build rings once
 
-			for patch in feature2['coordinates'][1:]:
-				feature1['coordinates'].append(patch)
+	count = 0
 
-			fix_member_order(feature1)
+	for feature1, combined_features in component.items():
+		if len(combined_features) == 1:
+			continue
 
-			remove_features.append(feature2_index)
+		members = outer_members[ feature1 ]
+		new_outer = []
+		for feature in combined_features:
+			remove_parents(feature)
+			for member in feature.members[0]:
+				if member in members:
+					new_outer.append(member)  # Merge into relation1
+					members.discard(member)
+
+		feature1.members[0] = new_outer
+		for feature in combined_features[1:]:
+			feature1.members.extend(feature.members[1:])
+			feature1.coordinates.extend(feature.coordinates[1:])
+			features.remove(feature)
+			count += 1
 
-	# Remove features, starting at end of feature list
+		fix_member_order(feature1)
+		add_parents(feature1)
 
-	remove_features.sort(reverse=True)
-	for i in remove_features:
-		del features[ i ]
+	features.compact()
 
-	message ("\tCombined %i features\n" % len(remove_features))
+	message ("\tCombined %i features\n" % count)
 
 
 
@@ -3029,69 +4115,56 @@ def combine_segments():
 
 			# Get correct order for combined string of coordinates
 
-			if segments[ combine[0] ]['coordinates'][-1] in segments[ combine[1] ]['coordinates']:
-				coordinates = [ segments[ combine[0] ]['coordinates'][0] ]
+			if segments[ combine[0] ].coordinates[-1] in segments[ combine[1] ].coordinates:
+				coordinates = [ segments[ combine[0] ].coordinates[0] ]
 			else:
-				coordinates = [ segments[ combine[0] ]['coordinates'][-1] ]
+				coordinates = [ segments[ combine[0] ].coordinates[-1] ]
 
 			for segment_id in combine:
 				segment = segments[ segment_id ]
-				if segment['coordinates'][0] == coordinates[-1]:
-					coordinates.extend(segment['coordinates'][1:])
-				elif segment['coordinates'][-1] == coordinates[-1]:
-					coordinates.extend(list(reversed(segment['coordinates']))[1:])
-				elif segment['coordinates'][1] == coordinates[-1]:
-					coordinates.extend(segment['coordinates'][2:])
-				elif segment['coordinates'][-2] == coordinates[-1]:
-					coordinates.extend(list(reversed(segment['coordinates']))[2:])
+				if segment.coordinates[0] == coordinates[-1]:
+					coordinates.extend(segment.coordinates[1:])
+				elif segment.coordinates[-1] == coordinates[-1]:
+					coordinates.extend(list(reversed(segment.coordinates))[1:])
+				elif segment.coordinates[1] == coordinates[-1]:
+					coordinates.extend(segment.coordinates[2:])
+				elif segment.coordinates[-2] == coordinates[-1]:
+					coordinates.extend(list(reversed(segment.coordinates))[2:])
 				else:
-#					message ("*** SEGMENTS DISCONNECTED: %s\n" % str(segment['coordinates'][1]))
-					coordinates.extend(segment['coordinates'])
+#					message ("*** SEGMENTS DISCONNECTED: %s\n" % str(segment.coordinates[1]))
+					coordinates.extend(segment.coordinates)
 
 			# Keep the first segment in the sequence
-			segments[ combine[0] ]['coordinates'] = coordinates
-			segments[ combine[0] ]['extras']['combine'] = str(len(combine))
+			segments[ combine[0] ].coordinates = coordinates
+			segments[ combine[0] ].extras['combine'] = str(len(combine))
 
 			for segment_id in combine[1:]:
-				segments[ segment_id ]['used'] = 0  # Mark as not in use/not for output
+				segments[ segment_id ].used = 0  # Mark as not in use/not for output
 				remove.add(segment_id)
 
-		# Update features with combinations
+		# Update only features with combinations, found from parents of removed segments
 
-		for feature in features:
-			if feature['type'] == "Polygon":
-				new_members = []
-				for patch in feature['members']:
-					new_patch = []
-					for member in patch:
-						if member not in remove:
-							new_patch.append(member)
-					new_members.append(new_patch)
-				if new_members != feature['members']:
-					feature['members'] = new_members
+		update_features = set()
+		for segment_id in remove:
+			update_features.update(feature for feature, j in segments[ segment_id ].parents)
+			segments[ segment_id ].parents = set()
 
+		for feature in update_features:
+			feature.members = [ [ member for member in patch if member not in remove ] for patch in feature.members ]
 
-	# Start of main function.
-	# Part 1: Get list of parents (features) for each segment.
-
-	for segment in segments:
-		segment['parents'] = set()
 
-	for i, feature in enumerate(features):
-		if feature['type'] == "Polygon":
-			for j, patch in enumerate(feature['members']):
-				for member in patch:
-					segments[ member ]['parents'].add(( i, j ))  # tuple
+	# Start of main function.
+	# Part 1: Parents (feature, patch) of each segment are maintained by add_parents/remove_parents.
 
 	# Part 2: Combine segments within each feature polygon (not across features/polygons)
 
-	ordered_features = copy.copy(features)  # Shallow copy of list
-	ordered_features.sort(key=feature_order)  # Sort first coastline, lakes, rivers etc.
+	ordered_features = sorted(features, key=feature_order)  # Sort first coastline, lakes, rivers etc.
 
 	combinations = []  # Will contain all sequences to combine
+	combination_sets = set()  # Each sequence as a set, to avoid duplicates
 	for feature in ordered_features:
-		if feature['type'] == "Polygon":
-			for patch in feature['members']:
+		if feature.type == "Polygon":
+			for patch in feature.members:
 				first = True
 				remaining = patch[:]
 
@@ -3100,17 +4173,18 @@ def combine_segments():
 
 					# Build sequence of segments until different
 					while (remaining
-							and segments[ combine[0] ]['parents'] == segments[ remaining[0] ]['parents']
-							and segments[ combine[0] ]['object'] == segments[ remaining[0] ]['object']
-							and segments[ combine[0] ]['tags'] == segments[ remaining[0] ]['tags']
-							and set([ segments[ combine[-1] ]['coordinates'][0], segments[ combine[-1] ]['coordinates'][-1] ])
-									& set([ segments[ remaining[0] ]['coordinates'][0], segments[ remaining[0] ]['coordinates'][-1] ])):
+							and segments[ combine[0] ].parents == segments[ remaining[0] ].parents
+							and segments[ combine[0] ].object == segments[ remaining[0] ].object
+							and segments[ combine[0] ].tags == segments[ remaining[0] ].tags
+							and set([ segments[ combine[-1] ].coordinates[0], segments[ combine[-1] ].coordinates[-1] ])
+									& set([ segments[ remaining[0] ].coordinates[0], segments[ remaining[0] ].coordinates[-1] ])):
 						combine.append(remaining.pop(0))
 
 					if first and len(combine) < len(patch):
 						remaining.extend(combine)  # Wrap around end to check longer sequence
-					elif len(combine) > 1 and not any([set(combine) == set(c) for c in combinations]):
+					elif len(combine) > 1 and frozenset(combine) not in combination_sets:
 						combinations.append(combine)
+						combination_sets.add(frozenset(combine))
 					first = False
 
 	update_segments_and_features(combinations)
@@ -3123,40 +4197,53 @@ def combine_segments():
 	# Get relevant coastline segments, i.e. which are next to Gridline segments
 
 	coastlines = []
-	for j, feature in enumerate(features):
-		if feature['object'] == "Hav" and len(feature['members']) > 0:
-			patch = feature['members'][0]
+	coast_parents = {}  # Parents of coastline segments, excluding Hav outer patch
+	for feature in features:
+		if feature.object == "Hav" and len(feature.members) > 0:
+			patch = feature.members[0]
 			n = len(patch)
 			for i, member in enumerate(patch):  # Only outer patch
 				segment = segments[ member ]
-				if (segment['object'] in ["Strandlinje, hav", "Stängning mot hav"]
-						and (segments[ patch[ (i-1) % n ] ]['object'] == "Gridline"
-							or segments[ patch[ (i+1) % n ] ]['object'] == "Gridline")):
+				if (segment.object in ["Strandlinje, hav", "Stängning mot hav"]
+						and (segments[ patch[ (i-1) % n ] ].object == "Gridline"
+							or segments[ patch[ (i+1) % n ] ].object == "Gridline")):
 					coastlines.append(member)
-					segment['parents'].remove((j,0))  # Outer patch 0
+					coast_parents.setdefault(member, set(segment.parents)).discard((feature, 0))  # Outer patch 0
+
+	# Index coastline segments by start node, in order
+
+	start_nodes = {}
+	remaining = {}  # Number of times each segment is not yet combined
+	for segment_id in coastlines:
+		start_nodes.setdefault(segments[ segment_id ].coordinates[0], []).append(segment_id)
+		remaining[ segment_id ] = remaining.get(segment_id, 0) + 1
 
 	# Merge coastline segments until exhausted
 
 	combinations = []
-	while coastlines: 
-		segment1 = segments[ coastlines[0] ]
-		combine = [ coastlines.pop(0) ]
-		first_node = segment1['coordinates'][0]
-		last_node = segment1['coordinates'][-1]
+	for start_id in coastlines:
+		if remaining[ start_id ] == 0:
+			continue
+		remaining[ start_id ] -= 1
+		segment1 = segments[ start_id ]
+		parents1 = coast_parents[ start_id ]
+		combine = [ start_id ]
+		first_node = segment1.coordinates[0]
+		last_node = segment1.coordinates[-1]
 
 		# Build sequence of coastline segments until closed way or differnt
 
 		found = True
 		while found and first_node != last_node:
 			found = False
-			for segment_id in coastlines[:]:
+			for segment_id in start_nodes.get(last_node, []):
 				segment2 = segments[ segment_id ]
-				if (segment2['coordinates'][0] == last_node
-						and segment2['parents'] == segment1['parents']
-						and segment2['tags'] == segment1['tags']):
-					last_node = segment2['coordinates'][-1]
+				if (remaining[ segment_id ] > 0
+						and coast_parents[ segment_id ] == parents1
+						and segment2.tags == segment1.tags):
+					last_node = segment2.coordinates[-1]
 					combine.append(segment_id)
-					coastlines.remove(segment_id)
+					remaining[ segment_id ] -= 1
 					found = True
 					break
 
@@ -3184,12 +4271,12 @@ def identify_islands():
 
 	candidates = []
 	for feature in features:
-		if (len(feature['members']) == 1
-#				and len(feature['members'][0]) > 1
-				and feature['object'] not in ['Sjö', 'Anlagt vatten', 'Vattendragsyta', 'Hav']):
+		if (len(feature.members) == 1
+#				and len(feature.members[0]) > 1
+				and feature.object not in ['Sjö', 'Anlagt vatten', 'Vattendragsyta', 'Hav']):
 			found = True
-			for member in feature['members'][0]:
-				if segments[ member ]['object'] not in ['Strandlinje, sjö', 'Strandlinje, anlagt vatten', 'Strandlinje, vattendragsyta',
+			for member in feature.members[0]:
+				if segments[ member ].object not in ['Strandlinje, sjö', 'Strandlinje, anlagt vatten', 'Strandlinje, vattendragsyta',
 														'Strandlinje, hav', 'Stängning', 'Stängning mot hav']:
 					found = False
 					break
@@ -3199,12 +4286,12 @@ def identify_islands():
 	# Loop all inner objects of multipolygon lakes and sea
 
 	for feature in features:
-		if feature['object'] in ['Sjö', 'Anlagt vatten', 'Vattendragsyta', 'Hav']:
-			for i in range(1, len(feature['members'])):
+		if feature.object in ['Sjö', 'Anlagt vatten', 'Vattendragsyta', 'Hav']:
+			for i in range(1, len(feature.members)):
 
 				# Determine island type based on area
 
-				area = polygon_area(feature['coordinates'][i])
+				area = polygon_area(feature.coordinates[i])
 
 				if abs(area) > island_size:
 					island_type = "island"
@@ -3216,11 +4303,11 @@ def identify_islands():
 				found = False
 				'''
 				# Omit this section, create new island feature instead
-				if len(feature['members'][i]) == 1:
-					segment = segments[ feature['members'][i][0] ]
-					if segment['tags']:  #"natural" in segment['tags'] and segment['tags']['natural'] == "coastline":  # and "intermittent" not in segment['tags']:
-						segment['tags']['place'] = island_type
-						segment['extras']['area'] = str(int(abs(area)))
+				if len(feature.members[i]) == 1:
+					segment = segments[ feature.members[i][0] ]
+					if segment.tags:  #"natural" in segment.tags and segment.tags['natural'] == "coastline":  # and "intermittent" not in segment.tags:
+						segment.tags['place'] = island_type
+						segment.extras['area'] = str(int(abs(area)))
 						island_count += 1						
 						found = True
 				'''
@@ -3229,11 +4316,11 @@ def identify_islands():
 
 				if not found:
 					for feature2 in candidates:
-						if set(feature['members'][i]) == set(feature2['members'][0]):
+						if set(feature.members[i]) == set(feature2.members[0]):
 							# Avoid water type islands
-							if not ("natural" in feature2['tags'] and feature2['tags']['natural'] == "wetland" and len(feature2['members']) == 1):
-								feature2['tags']['place'] = island_type
-								feature2['extras']['area'] = str(int(abs(area)))
+							if not ("natural" in feature2.tags and feature2.tags['natural'] == "wetland" and len(feature2.members) == 1):
+								feature2.tags['place'] = island_type
+								feature2.extras['area'] = str(int(abs(area)))
 								island_count += 1
 							found = True
 							break
@@ -3241,14 +4328,10 @@ def identify_islands():
 				# Else create new polygon
 
 				if not found:
-					entry = {
-						'object': "Ö",
-						'type': 'Polygon',
-						'coordinates': [ copy.deepcopy(feature['coordinates'][i]) ],
-						'members': [ copy.deepcopy(feature['members'][i]) ],
-						'tags': { 'place': island_type },
-						'extras': { 'area': str(int(abs(area))) }
-					}
+					entry = Feature("Ö", "Polygon", [ copy.deepcopy(feature.coordinates[i]) ],
+									members=[ copy.deepcopy(feature.members[i]) ],
+									tags={ 'place': island_type },
+									extras={ 'area': str(int(abs(area))) })
 
 					features.append(entry)
 					island_count += 1
@@ -3259,7 +4342,7 @@ def identify_islands():
 	# Part 2: Identify remaining islands
 	# First check islands in sea, then check islands which are combinations of rivers, lekes and/or sea (in river deltas)
 
-	used_segments = []
+	used_segments = set()
 
 	for part in ["coastline", "coastline/river/water"]:
 		coastlines = []
@@ -3271,66 +4354,43 @@ def identify_islands():
 			# Example: Senja (which also has rivers)
 
 			for feature in features:
-				if feature['object'] == "Hav" and len(feature['members']) > 0:
-					for member in feature['members'][0]:  # Only outer patch
-						segment = segments[ member ]
-						if segment['object'] in ['Strandlinje, hav', 'Stängning mot hav']:
-							coastlines.append(segment)
+				if feature.object == "Hav" and len(feature.members) > 0:
+					for member in feature.members[0]:  # Only outer patch
+						if segments[ member ].object in ['Strandlinje, hav', 'Stängning mot hav']:
+							coastlines.append(member)
 
 		else:
 			# Pass 2b: Then check combinations of lakes, rivers and coastline
 			# Examples: Kråkerøy (Fredrikstad), Holmen (Drammen), Øyna (Iveland)
 
 			for feature in features:
-				if (feature['object'] in ['Sjö', 'Anlagt vatten', 'Vattendragsyta', 'Hav']
-						and len(feature['members']) > 0
-						and any(segments[ member ]['object'] in ['Strandlinje, sjö', 'Strandlinje, anlagt vatten', 'Strandlinje, vattendragsyta',
+				if (feature.object in ['Sjö', 'Anlagt vatten', 'Vattendragsyta', 'Hav']
+						and len(feature.members) > 0
+						and any(segments[ member ].object in ['Strandlinje, sjö', 'Strandlinje, anlagt vatten', 'Strandlinje, vattendragsyta',
 																'Strandlinje, hav', 'Stängning', 'Stängning mot hav', 'Gridline']
-								for member in feature['members'][0])):  # Only features which are connected
+								for member in feature.members[0])):  # Only features which are connected
 
-					for member in feature['members'][0]:  # Only outer patch
+					for member in feature.members[0]:  # Only outer patch
 						segment = segments[ member ]
-						if (segment['object'] in ['Strandlinje, sjö', 'Strandlinje, anlagt vatten', 'Strandlinje, vattendragsyta', 'Strandlinje, hav']
+						if (segment.object in ['Strandlinje, sjö', 'Strandlinje, anlagt vatten', 'Strandlinje, vattendragsyta', 'Strandlinje, hav']
 								and member not in used_segments):  # Exclude any islands already identified
-							coastlines.append(segment)
+							coastlines.append(member)
 
-		# Merge coastline segments until exhausted
+		# Merge coastline segments forward until closed chain of ways
 
-		while coastlines: 
-			segment = coastlines[0]
-			island = [ coastlines[0] ]
-			coastlines.pop(0)
-			first_node = segment['coordinates'][0]
-			last_node = segment['coordinates'][-1]
+		chains, remaining = assemble_rings(coastlines, directed=True)
 
-			# Build coastline/island forward
-
-			found = True
-			while found and first_node != last_node:
-				found = False
-				for segment in coastlines[:]:
-					if segment['coordinates'][0] == last_node:
-						last_node = segment['coordinates'][-1]
-						island.append(segment)
-						coastlines.remove(segment)
-						found = True
-						break
+		for members, coordinates in chains:
 
 			# Add island to features list if closed chain of ways
 
-			if first_node == last_node:
-
-				members = []
-				coordinates = [ first_node ]
-				for segment in island:
-					members.append(segments.index(segment))
-					coordinates += segment['coordinates'][1:]
+			if coordinates[0] == coordinates[-1]:
 
 				area = polygon_area(coordinates)
 				if area < 0:
 					continue  # Avoid lakes
 
-				used_segments.extend(members)  # Exclude in next pass
+				used_segments.update(members)  # Exclude in next pass
 
 				if abs(area) > island_size:
 					island_type = "island"
@@ -3341,9 +4401,9 @@ def identify_islands():
 
 				found = False
 				for feature in candidates:
-					if set(members) == set(feature['members'][0]):
-						feature['tags']['place'] = island_type
-						feature['extras']['area'] = str(int(abs(area)))
+					if set(members) == set(feature.members[0]):
+						feature.tags['place'] = island_type
+						feature.extras['area'] = str(int(abs(area)))
 						island_count += 1
 						found = True
 						break
@@ -3351,18 +4411,14 @@ def identify_islands():
 				# Else create new relation for island
 
 				if not found:
-					entry = {
-						'object': "Ö",
-						'type': 'Polygon',
-						'coordinates': [ coordinates ],
-						'members': [ members ],
-						'tags': copy.deepcopy(island[0]['tags']),
-						'extras': copy.deepcopy(island[0]['extras'])
-					}
+					entry = Feature("Ö", "Polygon", [ coordinates ],
+									members=[ members ],
+									tags=copy.deepcopy(segments[ members[0] ].tags),
+									extras=copy.deepcopy(segments[ members[0] ].extras))
 
-					entry['tags']['place'] = island_type
-					entry['tags'].pop("natural", None)  # Remove natural=coastline (already on segments)
-					entry['extras']['area'] = str(int(abs(area)))
+					entry.tags['place'] = island_type
+					entry.tags.pop("natural", None)  # Remove natural=coastline (already on segments)
+					entry.extras['area'] = str(int(abs(area)))
 
 					features.append(entry)
 					island_count += 1
@@ -3386,66 +4442,59 @@ def identify_intersections():
 
 	# Make sure all Hav are removed
 
-	for feature in features[:]:
-		if feature['object'] == "Hav":
+	for feature in features:
+		if feature.object == "Hav":
 			features.remove(feature)
+	features.compact()
 
 	# Create set of common nodes for segment intersections
 
 	for segment in segments:
-		if segment['used'] > 0:
-			nodes.add(segment['coordinates'][0])
-			nodes.add(segment['coordinates'][-1])
+		if segment.used > 0:
+			nodes.add(segment.coordinates[0])
+			nodes.add(segment.coordinates[-1])
 
 	for feature in features:
-		if feature['type'] == "LineString":
-			nodes.add(feature['coordinates'][0])
-			nodes.add(feature['coordinates'][-1])
+		if feature.type == "LineString":
+			nodes.add(feature.coordinates[0])
+			nodes.add(feature.coordinates[-1])
 
 	if merge_node:
 
-		# Create bbox for segments and line features + create temporary list of LineString features
-
-		for segment in segments:
-			if segment['used'] > 0:
-				segment['bbox'] = get_bbox(segment['coordinates'])
-		
 		# Loop streams to identify intersections with segments
 
-		count = sum([feature['type'] == "LineString" and feature['object'] == "Vattendrag" for feature in features])
+		progress = Progress(sum([feature.type == "LineString" and feature.object == "Vattendrag" for feature in features]), "streams")
 
 		for feature in features:
-			if feature['type'] == "LineString" and feature['object'] == "Vattendrag":
-				feature['bbox'] = get_bbox(feature['coordinates'])
-				if count % 100 == 0:
-					message ("\r\t%i " % count)
-				count -= 1
+			if feature.type == "LineString" and feature.object == "Vattendrag":
+				feature.bbox = get_bbox(feature.coordinates)
+				progress.update()
 
 				for segment in segments:
-					if (segment['used'] > 0 or debug) and bbox_overlap(feature['bbox'], segment['bbox']):
+					if (segment.used > 0 or debug) and bbox_overlap(feature.bbox, segment.bbox):
 
-						intersections = set(feature['coordinates']).intersection(set(segment['coordinates']))
+						intersections = feature.coordinates.node_set & segment.coordinates.node_set
 
 						# Insert new node in segment if on line but no hit on existing node
 
 						if len(intersections) == 0:
-							if feature['object'] == "Vattendrag" and ("Strandlinje" in segment['object'] or "Stängning" in segment['object']):
+							if feature.object == "Vattendrag" and ("Strandlinje" in segment.object or "Stängning" in segment.object):
 								for end in [0, -1]:
-									river_point = feature['coordinates'][ end ]
-									dist, i = shortest_distance(river_point, segment['coordinates'])
+									river_point = feature.coordinates[ end ]
+									dist, i = shortest_distance(river_point, segment.coordinates)
 									if dist < 0.1:
-										dist, lake_point = line_distance(segment['coordinates'][i], segment['coordinates'][i+1],
+										dist, lake_point = line_distance(segment.coordinates[i], segment.coordinates[i+1],
 																	river_point, get_point = True)
-										if point_distance(lake_point, segment['coordinates'][ i ]) < 0.1:
-											feature['coordinates'][ end ] = segment['coordinates'][ i ]
-										elif point_distance(lake_point, segment['coordinates'][ i+1 ]) < 0.1:
-											feature['coordinates'][ end ] = segment['coordinates'][ i+1 ]
+										if point_distance(lake_point, segment.coordinates[ i ]) < 0.1:
+											feature.coordinates[ end ] = segment.coordinates[ i ]
+										elif point_distance(lake_point, segment.coordinates[ i+1 ]) < 0.1:
+											feature.coordinates[ end ] = segment.coordinates[ i+1 ]
 										else:
-											lake_point = ( round(lake_point[0], precision), round(lake_point[1], precision) )
-											feature['coordinates'][ end ] = lake_point
-											segment['coordinates'].insert(i+1, lake_point)
+											lake_point = node_table.intern(( round(lake_point[0], node_precision()), round(lake_point[1], node_precision()) ))
+											feature.coordinates[ end ] = lake_point
+											segment.coordinates.insert(i+1, lake_point)
 										nodes.discard(river_point)
-										nodes.add(feature['coordinates'][ end ])
+										nodes.add(feature.coordinates[ end ])
 										river_count += 1
 										break
 							continue
@@ -3453,33 +4502,35 @@ def identify_intersections():
 						# Relocate node to avoid connection
 
 						for node in intersections:
-							index1 = feature['coordinates'].index(node)
-							index2 = segment['coordinates'].index(node)
+							index1 = feature.coordinates.index(node)
+							index2 = segment.coordinates.index(node)
 
 							# First check if stream node may be removed or slightly relocated
 
-							if "Strandlinje" in segment['object'] or "Stängning" in segment['object']:
+							if "Strandlinje" in segment.object or "Stängning" in segment.object:
 								nodes.add( node )
 
-							elif index1 not in [0, len(feature['coordinates']) - 1] and node not in nodes:
-								if (feature['coordinates'][ index1 - 1] not in intersections
-										and feature['coordinates'][ index1 + 1] not in intersections):
-									feature['coordinates'].pop(index1)
+							elif index1 not in [0, len(feature.coordinates) - 1] and node not in nodes:
+								if (feature.coordinates[ index1 - 1] not in intersections
+										and feature.coordinates[ index1 + 1] not in intersections):
+									feature.coordinates.pop(index1)
 									delete_count += 1
 								else:
 									lon, lat = node
-									offset = 10 ** (- precision + 1)  # Last lat/lon decimal digit
-									feature['coordinates'][index1] = ( lon + 4 * offset, lat + 2 * offset )
+									offset = 10 ** (- node_precision() + 1)  # Last decimal digit
+									feature.coordinates[index1] = node_table.intern(( lon + 4 * offset, lat + 2 * offset ))
 									# Note: New node used in next test here
 
 								# Then check if segment node may also be removed
 
-								if index2 not in [0, len(segment['coordinates']) - 1]:
-									if (segment['coordinates'][ index2 - 1] not in intersections
-											and segment['coordinates'][ index2 + 1] not in intersections
-											and line_distance(segment['coordinates'][ index2 - 1], segment['coordinates'][ index2 + 1],
-																segment['coordinates'][ index2 ]) < simplify_factor):
-										segment['coordinates'].pop(index2)		
+								if index2 not in [0, len(segment.coordinates) - 1]:
+									if (segment.coordinates[ index2 - 1] not in intersections
+											and segment.coordinates[ index2 + 1] not in intersections
+											and line_distance(segment.coordinates[ index2 - 1], segment.coordinates[ index2 + 1],
+																segment.coordinates[ index2 ]) < simplify_factor):
+										segment.coordinates.pop(index2)		
+
+		progress.finish()
 
 	message ("\r\tConnected %i streams to lakes\n" % river_count)
 	message ("\t%i common nodes, %i nodes removed from streams and auxiliary lines\n" % (len(nodes) - node_count, delete_count))
@@ -3520,18 +4571,18 @@ def simplify_geometry():
 	old_count = 0
 
 	for segment in segments:
-		if (segment['used'] > 0
-				and not (segment['coordinates'][0] == segment['coordinates'][-1]
-						and len(segment['coordinates']) <= 4)):
-			old_count += len(segment['coordinates'])
-			segment['coordinates'] = partition_and_simplify(segment['coordinates'])
-			new_count += len(segment['coordinates'])
+		if (segment.used > 0
+				and not (segment.coordinates[0] == segment.coordinates[-1]
+						and len(segment.coordinates) <= 4)):
+			old_count += len(segment.coordinates)
+			segment.coordinates = partition_and_simplify(segment.coordinates)
+			new_count += len(segment.coordinates)
 
 	for feature in features:
-		if feature['type'] == "LineString":
-			old_count += len(feature['coordinates'])
-			feature['coordinates'] = partition_and_simplify(feature['coordinates'])
-			new_count += len(feature['coordinates'])		
+		if feature.type == "LineString":
+			old_count += len(feature.coordinates)
+			feature.coordinates = partition_and_simplify(feature.coordinates)
+			new_count += len(feature.coordinates)		
 
 	if old_count > 0:
 		removed = 100.0 * (old_count - new_count) / old_count
@@ -3541,19 +4592,19 @@ def simplify_geometry():
 	# Check polygons which may have collapsed
 
 	feature_count = 0
-	for feature in features[:]:
-		if feature['type'] == "Polygon":
-			for i, patch in enumerate(feature['members'][:]):
-				if len(patch) == 2 and len(set(segments[ patch[0] ]['coordinates'] + segments[ patch[1] ]['coordinates'])) == 2:
+	for feature in features:
+		if feature.type == "Polygon":
+			for i, patch in enumerate(feature.members[:]):
+				if len(patch) == 2 and len(set(segments[ patch[0] ].coordinates + segments[ patch[1] ].coordinates)) == 2:
 					for j in [0,1]:
-						segments[ patch[j] ]['used'] -= 1
-						if ("FIXME" in segments[ patch[j] ]['tags']
-								and segments[ patch[j] ]['tags']['FIXME'] == "Merge"):
-							del segments[ patch[j] ]['tags']['FIXME']
-					del feature['members'][i]
-					del feature['coordinates'][i]
+						segments[ patch[j] ].used -= 1
+						if ("FIXME" in segments[ patch[j] ].tags
+								and segments[ patch[j] ].tags['FIXME'] == "Merge"):
+							del segments[ patch[j] ].tags['FIXME']
+					del feature.members[i]
+					del feature.coordinates[i]
 					feature_count += 1
-			if not feature['members']:
+			if not feature.members:
 				features.remove(feature)
 
 	message ("%i nodes removed (%i%%)" % (old_count - new_count, removed))
@@ -3563,6 +4614,69 @@ def simplify_geometry():
 
 
 
+# Project all features, segments and common nodes from EPSG:3006 to WGS84.
+# All nodes are projected in one operation through the node table.
+# Consecutive duplicate nodes after rounding are removed.
+
+def reproject_to_wgs84():
+
+	global node_table, nodes
+
+	# Internal function for projecting one line
+
+	def reproject_line(line):
+		if not line:
+			return line
+		new_line = [ wgs_nodes[ node_id ] for node_id in node_table.get_ids(line) ]
+		deduplicated = [ new_line[0] ]
+		for node in new_line[1:]:
+			if node != deduplicated[-1]:
+				deduplicated.append(node)
+		if len(deduplicated) > 1:
+			return deduplicated
+		else:
+			return new_line
+
+	# Start of main function
+
+	lap = time.time()
+
+	# Include nodes created after loading
+
+	for entry_list in [features, segments]:
+		for entry in entry_list:
+			if isinstance(entry.coordinates, tuple):
+				node_table.get_id(entry.coordinates)
+			elif entry.coordinates and isinstance(entry.coordinates[0], tuple):
+				node_table.get_ids(entry.coordinates)
+			else:
+				for patch in entry.coordinates:
+					node_table.get_ids(patch)
+
+	for node in nodes:
+		node_table.get_id(node)
+
+	# Project nodes and update coordinates
+
+	wgs_table = NodeTable()
+	wgs_nodes = wgs_table.intern_list(project_nodes(node_table.nodes, "EPSG:3006", "EPSG:4326", decimals=precision))
+
+	for entry_list in [features, segments]:
+		for entry in entry_list:
+			if isinstance(entry.coordinates, tuple):
+				entry.coordinates = wgs_nodes[ node_table.get_id(entry.coordinates) ]
+			elif entry.coordinates and isinstance(entry.coordinates[0], tuple):
+				entry.coordinates = reproject_line(entry.coordinates)
+			else:
+				entry.coordinates = [ reproject_line(patch) for patch in entry.coordinates ]
+
+	nodes = set(wgs_nodes[ node_table.get_id(node) ] for node in nodes)
+	node_table = wgs_table
+
+	message ("\tProjected %i nodes to WGS84 in %s\n" % (len(wgs_table), timeformat(time.time() - lap)))
+
+
+
 # Save geojson file for reviewing raw input data from GML file
 
 def save_geojson(filename):
@@ -3574,21 +4688,23 @@ def save_geojson(filename):
 		'features': []
 	}
 
-	for i, segment in enumerate(segments):
-		segment['tags']['segment'] = str(i)
+	for i, segment in segments.enumerate():
+		segment.tags['segment'] = str(i)
 
+	if planar:
+		reproject_to_wgs84()
 
 	for feature_list in [features, segments]:
 		for feature in feature_list:
 			entry = {
 				'type': 'Feature',
 				'geometry': {
-					'type': feature['type'],
-					'coordinates': feature['coordinates']
+					'type': feature.type,
+					'coordinates': feature.coordinates
 				},
-				'properties': dict(list(feature['extras'].items())
-									+ list(feature['tags'].items())
-									+ list({ 'geometri': feature['type'] }.items()))
+				'properties': dict(list(feature.extras.items())
+									+ list(feature.tags.items())
+									+ list({ 'geometri': feature.type }.items()))
 			}
 
 			json_features['features'].append(entry)
@@ -3597,7 +4713,7 @@ def save_geojson(filename):
 	json.dump(json_features, file, indent=1, ensure_ascii=False)
 	file.close()
 
-	message ("\t%i features saved\n" % len(features))
+	message ("\t%i features saved\n" % features.count_remaining())
 
 
 
@@ -3626,55 +4742,61 @@ def save_osm(filename):
 
 	message ("Save to '%s' file...\n" % filename)
 
-	for i, segment in enumerate(segments):
-		if segment['used'] > 0:
-			nodes.add(segment['coordinates'][0])
-			nodes.add(segment['coordinates'][-1])
+	for i, segment in segments.enumerate():
+		if segment.used > 0:
+			nodes.add(segment.coordinates[0])
+			nodes.add(segment.coordinates[-1])
 			if debug:
-				segment['extras']['SEGMENT'] = str(i)
+				segment.extras['SEGMENT'] = str(i)
 
 	for feature in features:
-		if feature['type'] == "LineString":
-			nodes.add(feature['coordinates'][0])
-			nodes.add(feature['coordinates'][-1])
+		if feature.type == "LineString":
+			nodes.add(feature.coordinates[0])
+			nodes.add(feature.coordinates[-1])
 
 	if simplify:
-		simplify_geometry()
+		with profile_stage("simplify"):
+			simplify_geometry()
 
-	osm_node_ids = {}  # Will contain osm_id of each common node
+	if planar:
+		reproject_to_wgs84()
+
+	osm_nodes = {}  # Will contain osm element of each common node
+	node_ids = node_table.ids
 	relation_count = 0
 	way_count = 0
 	node_count = 0
 
 	osm_root = ET.Element("osm", version="0.6", generator="topo2osm v"+version, upload="false")
-	osm_id = -1000
 
-	# Common nodes
+	# Common nodes. Osm id is given by node table id.
 
-	for node in nodes:
-		osm_id -= 1
-		osm_node = ET.Element("node", id=str(osm_id), action="modify", lat=str(node[1]), lon=str(node[0]))
+	for node_id in sorted(map(node_table.get_id, nodes)):
+		node = node_table.nodes[ node_id ]
+		osm_node = ET.Element("node", id=str(-1001 - node_id), action="modify", lat=str(node[1]), lon=str(node[0]))
 #		if debug:
-#			osm_node.append(ET.Element("tag", k="OSMID", v=str(osm_id)))
+#			osm_node.append(ET.Element("tag", k="OSMID", v=str(-1001 - node_id)))
 
 		osm_root.append(osm_node)
-		osm_node_ids[ node ] = osm_id
+		osm_nodes[ node ] = osm_node
 		node_count += 1
 
+	osm_id = -1000 - len(node_table)  # Other objects below common node ids
+
 	# Ways used by relations
 
 	for segment in segments:
-		if segment['used'] > 0 or debug:
+		if segment.used > 0 or debug:
 			osm_id -= 1
 			osm_feature = ET.Element("way", id=str(osm_id), action="modify")
 			osm_root.append(osm_feature)
-			segment['osm_id'] = osm_id
-			segment['etree'] = osm_feature
+			segment.osm_id = osm_id
+			segment.etree = osm_feature
 			way_count += 1
 
-			for node in segment['coordinates']:
+			for node in segment.coordinates:
 				if node in nodes:
-					osm_nd = ET.Element("nd", ref=str(osm_node_ids[ node ]))
+					osm_nd = ET.Element("nd", ref=str(-1001 - node_ids[ node ]))
 				else:
 					osm_id -= 1
 					osm_node = ET.Element("node", id=str(osm_id), action="modify", lat=str(node[1]), lon=str(node[0]))
@@ -3683,13 +4805,13 @@ def save_osm(filename):
 					node_count += 1
 				osm_feature.append(osm_nd)
 
-			for key, value in iter(segment['tags'].items()):
+			for key, value in iter(segment.tags.items()):
 				osm_tag = ET.Element("tag", k=key, v=value)
 				osm_feature.append(osm_tag)
 
 			if debug:
 				osm_feature.append(ET.Element("tag", k="OSMID", v=osm_feature.attrib['id']))
-				for key, value in iter(segment['extras'].items()):
+				for key, value in iter(segment.extras.items()):
 					osm_tag = ET.Element("tag", k=key.upper(), v=value)
 					osm_feature.append(osm_tag)
 
@@ -3697,27 +4819,27 @@ def save_osm(filename):
 
 	for feature in features:
 
-		if feature['object'] == "Hav":
+		if feature.object == "Hav":
 			continue
 
-		if feature['type'] == "Point":
-			if feature['coordinates'] in nodes:
-				osm_feature = osm_root.find("node[@id='%i']" % osm_node_ids[ feature['coordinates'] ] )  # Point already created
+		if feature.type == "Point":
+			if feature.coordinates in nodes:
+				osm_feature = osm_nodes[ feature.coordinates ]  # Point already created
 			else:
 				osm_id -= 1
-				osm_feature = ET.Element("node", id=str(osm_id), action="modify", lat=str(feature['coordinates'][1]), lon=str(feature['coordinates'][0]))
+				osm_feature = ET.Element("node", id=str(osm_id), action="modify", lat=str(feature.coordinates[1]), lon=str(feature.coordinates[0]))
 				osm_root.append(osm_feature)
 				node_count += 1
 
-		elif feature['type'] in "LineString":
+		elif feature.type in "LineString":
 			osm_id -= 1
 			osm_feature = ET.Element("way", id=str(osm_id), action="modify")
 			osm_root.append(osm_feature)
 			way_count += 1
 
-			for node in feature['coordinates']:
+			for node in feature.coordinates:
 				if node in nodes:
-					osm_nd = ET.Element("nd", ref=str(osm_node_ids [ node ]))
+					osm_nd = ET.Element("nd", ref=str(-1001 - node_ids[ node ]))
 				else:
 					osm_id -= 1
 					osm_node = ET.Element("node", id=str(osm_id), action="modify", lat=str(node[1]), lon=str(node[0]))
@@ -3726,18 +4848,18 @@ def save_osm(filename):
 					node_count += 1
 				osm_feature.append(osm_nd)
 
-		elif feature['type'] == "Polygon":
+		elif feature.type == "Polygon":
 
 			# Output way if possible to avoid relation
-			if (len(feature['members']) == 1
-					and len(feature['members'][0]) == 1
-					and not ("natural" in feature['tags'] and "natural" in segments[ feature['members'][0][0] ]['tags'])):
+			if (len(feature.members) == 1
+					and len(feature.members[0]) == 1
+					and not ("natural" in feature.tags and "natural" in segments[ feature.members[0][0] ].tags)):
 
-				segments[ feature['members'][0][0] ]['tags'].update(feature['tags'])  # Avoid confict if another overlapping feature
-				osm_feature = segments[ feature['members'][0][0] ]['etree']
+				segments[ feature.members[0][0] ].tags.update(feature.tags)  # Avoid confict if another overlapping feature
+				osm_feature = segments[ feature.members[0][0] ].etree
 
 				# Add area=yes for piste:type=downhill when closed ways (not needed for relations)
-				if "piste:type" in feature['tags']:
+				if "piste:type" in feature.tags:
 					osm_tag = ET.Element("tag", k="area", v="yes")
 					osm_feature.append(osm_tag)
 
@@ -3748,33 +4870,37 @@ def save_osm(filename):
 				relation_count += 1
 				role = "outer"
 
-				for patch in feature['members']:
+				for patch in feature.members:
 					for member in patch:
-						if "osm_id" in segments[ member ]:
-							osm_member = ET.Element("member", type="way", ref=str(segments[ member ]['osm_id']), role=role)
+						if hasattr(segments[ member ], "osm_id"):
+							osm_member = ET.Element("member", type="way", ref=str(segments[ member ].osm_id), role=role)
 							osm_feature.append(osm_member)
 						else:
-							message ("\t*** NO OSM_ID: %s\n" % segments[ member ]['uuid'])
+							message ("\t*** NO OSM_ID: %s\n" % segments[ member ].uuid)
 					role = "inner"
 
 				osm_tag = ET.Element("tag", k="type", v="multipolygon")
 				osm_feature.append(osm_tag)
 
 		else:
-			message ("\t*** UNKNOWN GEOMETRY: %s\n" % feature['type'])
+			message ("\t*** UNKNOWN GEOMETRY: %s\n" % feature.type)
 
-		for key, value in iter(feature['tags'].items()):
+		for key, value in iter(feature.tags.items()):
 			osm_tag = ET.Element("tag", k=key, v=value)
 			osm_feature.append(osm_tag)
 
 		if debug:
 			osm_feature.append(ET.Element("tag", k="OSMID", v=osm_feature.attrib['id']))
-			for key, value in iter(feature['extras'].items()):
+			for key, value in iter(feature.extras.items()):
 				osm_tag = ET.Element("tag", k=key.upper(), v=value)
 				osm_feature.append(osm_tag)
 
 
 	osm_root.set("upload", "false")
+
+	if change_output:
+		save_osm_change(osm_root, filename, filename[ : -4 ] + ".osc")  # Before previous output is replaced
+
 	indent_tree(osm_root)
 	osm_tree = ET.ElementTree(osm_root)
 	osm_tree.write(filename, encoding='utf-8', method='xml', xml_declaration=True)
@@ -3782,6 +4908,496 @@ def save_osm(filename):
 	message ("\t%i relations, %i ways, %i nodes saved\n" % (relation_count, way_count, node_count))
 
 
+
+# Get content and tags of osm elements, for the -change option.
+# Content is coordinates of nodes, node ids of ways and (type, id, role) of relation members.
+# Returns dict of element type with content and tags for each element id.
+
+def get_osm_elements (elements):
+
+	osm_elements = { 'node': {}, 'way': {}, 'relation': {} }
+
+	for element in elements:
+		if element.tag in osm_elements:
+			tags = { tag.get('k'): tag.get('v') for tag in element.iter("tag") }
+			if element.tag == "node":
+				content = (element.get('lat'), element.get('lon'))
+			elif element.tag == "way":
+				content = tuple(int(nd.get('ref')) for nd in element.iter("nd"))
+			else:
+				content = tuple((member.get('type'), int(member.get('ref')), member.get('role')) for member in element.iter("member"))
+			osm_elements[ element.tag ][ int(element.get('id')) ] = (content, tags)
+
+	return osm_elements
+
+
+
+# Iterate elements of osm file without keeping the whole tree in memory
+
+def parse_osm_file (filename):
+
+	for event, element in ET.iterparse(filename):
+		if element.tag in ["node", "way", "relation"]:
+			yield element
+			element.clear()
+
+
+
+# Hash of geometry of each osm element, independent of ids.
+# Nodes are hashed by coordinates, ways by coordinates of their nodes and relations by roles and geometry of members.
+
+def get_geometry_hashes (osm_elements):
+
+	node_coordinates = { node_id: content for node_id, (content, tags) in osm_elements['node'].items() }
+	hashes = { 'node': { node_id: hash(content) for node_id, content in node_coordinates.items() } }
+	hashes['way'] = { way_id: hash(tuple(node_coordinates.get(ref) for ref in content))
+						for way_id, (content, tags) in osm_elements['way'].items() }
+	hashes['relation'] = { relation_id: hash(tuple(sorted((role, member_type, hashes.get(member_type, {}).get(ref, 0))
+															for member_type, ref, role in content)))
+							for relation_id, (content, tags) in osm_elements['relation'].items() }
+
+	return hashes
+
+
+
+# Compare output with previous output file and save osmChange file with created, modified and deleted elements.
+# Elements are matched by geometry hash, and remaining ways and relations with the same tags
+# and a common node or member are matched as modified. Matched elements keep the id from the previous file.
+
+def save_osm_change (osm_root, previous_filename, filename):
+
+	message ("\tCompare with previous output ...\n")
+
+	if not os.path.isfile(previous_filename):
+		message ("\t*** No previous output '%s' found, change file not saved\n" % previous_filename)
+		return
+
+	current = get_osm_elements(osm_root)
+	previous = get_osm_elements(parse_osm_file(previous_filename))
+	current_hashes = get_geometry_hashes(current)
+	previous_hashes = get_geometry_hashes(previous)
+
+	id_map = { 'node': {}, 'way': {}, 'relation': {} }  # Previous id for each matched element id
+	matched = { 'node': set(), 'way': set(), 'relation': set() }  # Matched previous ids
+
+	# Inner function for checking that a current and a previous element have the same geometry.
+	# Members of relations must already be matched.
+
+	def same_content(element_type, element_id, previous_id):
+		content = current[ element_type ][ element_id ][0]
+		previous_content = previous[ element_type ][ previous_id ][0]
+		if element_type == "node":
+			return content == previous_content
+		elif element_type == "way":
+			return (len(content) == len(previous_content)
+					and all(current['node'][ ref ][0] == previous['node'][ previous_ref ][0]
+							for ref, previous_ref in zip(content, previous_content)))
+		else:
+			return (sorted((member_type, id_map[ member_type ].get(ref, 0), role) for member_type, ref, role in content)
+					== sorted(previous_content))
+
+	# Inner function for matching elements by geometry hash
+
+	def match_hashes(element_type):
+		previous_ids = {}
+		for element_id in sorted(previous[ element_type ], reverse=True):
+			if element_id not in matched[ element_type ]:
+				previous_ids.setdefault(previous_hashes[ element_type ][ element_id ], []).append(element_id)
+
+		for element_id in sorted(current[ element_type ], reverse=True):
+			if element_id not in id_map[ element_type ]:
+				matches = previous_ids.get(current_hashes[ element_type ][ element_id ], [])
+				for i in range(len(matches) - 1, -1, -1):
+					if same_content(element_type, element_id, matches[i]):  # Hash values may collide
+						id_map[ element_type ][ element_id ] = matches.pop(i)
+						matched[ element_type ].add(id_map[ element_type ][ element_id ])
+						break
+
+	# Inner function for matching remaining ways or relations with same tags and a common node or member
+
+	def match_neighbours(element_type):
+		candidates = {}  # Unmatched previous elements for each node or member
+		for element_id, (content, tags) in previous[ element_type ].items():
+			if element_id not in matched[ element_type ]:
+				for member in content:
+					candidates.setdefault(member if element_type == "way" else member[:2], []).append(element_id)
+
+		for element_id in sorted(current[ element_type ], reverse=True):
+			if element_id in id_map[ element_type ]:
+				continue
+			content, tags = current[ element_type ][ element_id ]
+			for member in content:
+				if element_type == "way":
+					key = id_map['node'].get(member)
+				else:
+					key = (member[0], id_map[ member[0] ].get(member[1]))
+				for previous_id in candidates.get(key, []):
+					if previous_id not in matched[ element_type ] and previous[ element_type ][ previous_id ][1] == tags:
+						id_map[ element_type ][ element_id ] = previous_id
+						matched[ element_type ].add(previous_id)
+						break
+				if element_id in id_map[ element_type ]:
+					break
+
+
+	# Ways first, then nodes of matched ways by position, since several nodes may have the same coordinates
+
+	match_hashes("way")
+
+	for element_id, previous_id in id_map['way'].items():
+		for node_id, previous_node_id in zip(current['way'][ element_id ][0], previous['way'][ previous_id ][0]):
+			if node_id not in id_map['node'] and previous_node_id not in matched['node']:
+				id_map['node'][ node_id ] = previous_node_id
+				matched['node'].add(previous_node_id)
+
+	match_hashes("node")
+	match_neighbours("way")
+	match_hashes("relation")
+	match_neighbours("relation")
+
+	# New ids below previous ids for created elements
+
+	new_id = min([ -1000 ] + [ element_id for elements in previous.values() for element_id in elements ])
+	created = { 'node': [], 'way': [], 'relation': [] }
+	for element_type in ["node", "way", "relation"]:
+		for element_id in sorted(current[ element_type ], reverse=True):
+			if element_id not in id_map[ element_type ]:
+				new_id -= 1
+				id_map[ element_type ][ element_id ] = new_id
+				created[ element_type ].append(element_id)
+
+	# Build osmChange
+
+	change_root = ET.Element("osmChange", version="0.6", generator="topo2osm v" + version)
+	create_root = ET.SubElement(change_root, "create")
+	modify_root = ET.SubElement(change_root, "modify")
+	delete_root = ET.SubElement(change_root, "delete")
+	count = { 'create': 0, 'modify': 0, 'delete': 0 }
+
+	for element_type in ["node", "way", "relation"]:
+		for element_id in sorted(current[ element_type ], reverse=True):
+			content, tags = current[ element_type ][ element_id ]
+			osm_id = id_map[ element_type ][ element_id ]
+
+			if element_type == "node":
+				osm_element = ET.Element("node", id=str(osm_id), lat=content[0], lon=content[1])
+				new_content = content
+			elif element_type == "way":
+				osm_element = ET.Element("way", id=str(osm_id))
+				new_content = tuple(id_map['node'][ ref ] for ref in content)
+				for ref in new_content:
+					osm_element.append(ET.Element("nd", ref=str(ref)))
+			else:
+				osm_element = ET.Element("relation", id=str(osm_id))
+				new_content = tuple((member_type, id_map[ member_type ][ ref ], role) for member_type, ref, role in content)
+				for member_type, ref, role in new_content:
+					osm_element.append(ET.Element("member", type=member_type, ref=str(ref), role=role))
+
+			for key, value in tags.items():
+				osm_element.append(ET.Element("tag", k=key, v=value))
+
+			if osm_id not in previous[ element_type ]:
+				create_root.append(osm_element)
+				count['create'] += 1
+			elif previous[ element_type ][ osm_id ] != (new_content, tags):
+				modify_root.append(osm_element)
+				count['modify'] += 1
+
+	for element_type in ["relation", "way", "node"]:
+		for element_id in sorted(previous[ element_type ], reverse=True):
+			if element_id not in matched[ element_type ]:
+				delete_root.append(ET.Element(element_type, id=str(element_id)))
+				count['delete'] += 1
+
+	indent_tree(change_root)
+	change_tree = ET.ElementTree(change_root)
+	change_tree.write(filename, encoding='utf-8', method='xml', xml_declaration=True)
+
+	message ("\t%i created, %i modified and %i deleted elements saved to '%s'\n"
+				% (count['create'], count['modify'], count['delete'], filename))
+
+	# Use the same ids in the output file, so that previous output with changes applied equals the new output
+
+	for osm_element in osm_root:
+		if osm_element.tag in id_map:
+			osm_element.set("id", str(id_map[ osm_element.tag ][ int(osm_element.get("id")) ]))
+			for nd in osm_element.iter("nd"):
+				nd.set("ref", str(id_map['node'][ int(nd.get("ref")) ]))
+			for member in osm_element.iter("member"):
+				member.set("ref", str(id_map[ member.get("type") ][ int(member.get("ref")) ]))
+
+
+
+# Save state after completed stages to checkpoint file, for the -checkpoint option.
+# The file is written to a temporary file first, so that the previous checkpoint is kept if saving is interrupted.
+
+def save_checkpoint (filename, completed_stages):
+
+	message ("Save checkpoint ...\n")
+	lap = time.time()
+
+	state = {
+		'version': version,
+		'municipality_id': municipality_id,
+		'topo_product': topo_product,
+		'data_category': data_category,
+		'planar': planar,
+		'completed_stages': completed_stages,
+		'municipality_bbox': municipality_bbox,
+		'features': features,
+		'segments': segments,
+		'nodes': nodes,
+		'node_table': node_table,
+		'place_names': place_names,
+		'source_tiles': source_tiles
+	}
+
+	gc.disable()  # Garbage collection is slow for many new objects
+	try:
+		file = open(filename + ".tmp", "wb")
+		pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+		file.close()
+	finally:
+		gc.enable()
+	os.replace(filename + ".tmp", filename)
+
+	message ("\tSaved '%s' after stage '%s' (%i MB)\n" % (filename, completed_stages[-1], os.path.getsize(filename) / 1000000))
+	message ("\tRun time %s\n" % (timeformat(time.time() - lap)))
+
+
+
+# Load state from checkpoint file, for the -resume option.
+# Returns list of completed stages, or empty list if there is no checkpoint file.
+
+def load_checkpoint (filename):
+
+	global features, segments, nodes, node_table, place_names, municipality_bbox, source_tiles
+
+	if not os.path.isfile(filename):
+		message ("No checkpoint '%s' found, starting from the beginning\n" % filename)
+		return []
+
+	message ("Load checkpoint ...\n")
+	lap = time.time()
+
+	gc.disable()
+	try:
+		file = open(filename, "rb")
+		state = pickle.load(file)
+		file.close()
+	finally:
+		gc.enable()
+
+	if ((state['version'], state['municipality_id'], state['topo_product'], state['data_category'], state['planar'])
+			!= (version, municipality_id, topo_product, data_category, planar)):
+		sys.exit("\t*** Checkpoint '%s' was saved with another version, municipality or options. Please run without -resume.\n\n" % filename)
+
+	features = state['features']
+	segments = state['segments']
+	nodes = state['nodes']
+	node_table = state['node_table']
+	place_names = state['place_names']
+	municipality_bbox = state['municipality_bbox']
+	source_tiles = state['source_tiles']
+
+	message ("\tResume after stage '%s'\n" % state['completed_stages'][-1])
+	message ("\tRun time %s\n" % (timeformat(time.time() - lap)))
+
+	return state['completed_stages']
+
+
+
+# Options and version which affect the output, for the -incremental option
+
+def get_output_options ():
+
+	return {
+		'version': version,
+		'municipality_id': municipality_id,
+		'topo_product': topo_product,
+		'data_category': data_category,
+		'planar': planar,
+		'json_output': json_output,
+		'debug': debug,
+		'topo_tags': topo_tags,
+		'get_name': get_name,
+		'get_topo_rivers': get_topo_rivers,
+		'merge_wetland': merge_wetland,
+		'simplify': simplify,
+		'add_sea_names': add_sea_names,
+		'add_bay_names': add_bay_names
+	}
+
+
+
+# Size and modification time of other input files which affect the output, for the -incremental option.
+# Includes the Topo50/Topo100 river files and the place name file. Missing files are included as None.
+
+def get_source_files ():
+
+	filenames = []
+	if get_topo_rivers and topo_product != "Topo250":
+		for topo in ["Topo100", "Topo50"]:
+			if topo != topo_product:
+				filenames.append(topo_folder + "%s/hydrografi_sverige.gpkg" % topo)
+	if get_name:
+		filenames.append(os.path.expanduser(place_name_folder + "ortnamn_Sverige_multipoint.geojson"))
+
+	files = {}
+	for filename in filenames:
+		if os.path.isfile(filename):
+			files[ filename ] = {
+				'size': os.path.getsize(filename),
+				'modified': time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(os.path.getmtime(filename)))
+			}
+		else:
+			files[ filename ] = None
+
+	return files
+
+
+
+# Compare source tiles and other input files with previous run, for the -incremental option.
+# Returns True if source data and options are unchanged and the output file of the previous run exists.
+# Otherwise changed tiles are reported. The whole municipality is processed again after any change.
+
+def unchanged_source (state_filename, output_file):
+
+	message ("Check changes since previous run ...\n")
+
+	if not os.path.isfile(state_filename) or not os.path.isfile(output_file):
+		message ("\tNo previous run found\n")
+		return False
+
+	file = open(state_filename)
+	previous = json.load(file)
+	file.close()
+
+	if previous['options'] != get_output_options():
+		message ("\tVersion or options changed since previous run\n")
+		return False
+
+	if previous.get('files') != get_source_files():
+		message ("\tRiver or place name files changed since previous run\n")
+		return False
+
+	previous_tiles = previous['tiles']
+	changed_tiles = [ tile for tile in set(previous_tiles) | set(source_tiles) if previous_tiles.get(tile) != source_tiles.get(tile) ]
+
+	if not changed_tiles:
+		message ("\tNo changes in %i tiles since previous run, keeping '%s'\n" % (len(source_tiles), output_file))
+		return True
+
+	latest = max(tile['version'] for tile in source_tiles.values())
+	message ("\t%i of %i tiles changed since previous run, latest version %s\n" % (len(changed_tiles), len(source_tiles), latest))
+	message ("\tChanged tiles: %s\n" % ", ".join(sorted(changed_tiles)))
+
+	return False
+
+
+
+# Save source tiles and options of this run, for the -incremental option
+
+def save_source_tiles (state_filename):
+
+	file = open(state_filename, "w")
+	json.dump({
+		'options': get_output_options(),
+		'files': get_source_files(),
+		'tiles': source_tiles
+		}, file, indent=1, ensure_ascii=False)
+	file.close()
+
+	message ("Saved source versions to '%s'\n" % state_filename)
+
+
+
+# Run all stages for municipality and save to output file (without extension).
+# Each stage is timed if -profile or -counters is used.
+
+def process_data(output_filename):
+
+	checkpoint_filename = output_filename + "_checkpoint.pickle"
+	completed_stages = []
+	if resume:
+		completed_stages = load_checkpoint(checkpoint_filename)
+
+	# Inner function for marking stage as completed and saving checkpoint
+
+	def stage_completed(stage):
+		completed_stages.append(stage)
+		if checkpoint:
+			with profile_stage("checkpoint"):
+				save_checkpoint(checkpoint_filename, completed_stages)
+
+	# Inner function for comparing source tiles with previous run before features are built, for the -incremental option
+
+	def unchanged():
+		return unchanged_source(state_filename, output_file)
+
+
+	state_filename = output_filename + "_sources.json"
+	if json_output:
+		output_file = output_filename + ".geojson"
+	else:
+		output_file = output_filename + ".osm"
+
+	if "load" not in completed_stages:
+		with profile_stage("load"):
+			loaded = load_topo_data(municipality_id, municipality_name, data_category, unchanged)
+
+		if not loaded:
+			return
+
+		if profile:
+			stage_profile.inputs = get_input_counts()
+
+		if estimate_only:
+			estimate_resources(output_filename + "_estimate.json")
+			return
+
+		stage_completed("load")
+
+	if json_output:
+		with profile_stage("write"):
+			save_geojson(output_file)
+	else:
+		if data_category in ["topo", "hydro", "hydrografi"] and "rivers" not in completed_stages:
+			with profile_stage("rivers"):
+				if get_topo_rivers and topo_product != "Topo250":
+					load_topo_rivers()
+				combine_rivers()
+			stage_completed("rivers")
+
+		if "relations" not in completed_stages:
+			with profile_stage("relations"):
+				create_relations_structure()
+			stage_completed("relations")
+		# Note: After this point, segments index should be fixed and feature.coordinates may not exactly match member segments.
+
+		if data_category == "topo":
+			if "islands" not in completed_stages:
+				with profile_stage("islands"):
+					identify_islands()
+				stage_completed("islands")
+			if get_name and "place names" not in completed_stages:
+				with profile_stage("place names"):
+					get_place_names()
+				stage_completed("place names")
+
+		if "intersections" not in completed_stages:
+			with profile_stage("intersections"):
+				identify_intersections()
+			stage_completed("intersections")
+
+		with profile_stage("write"):
+			save_osm(output_file)
+
+	if incremental and source_tiles:
+		save_source_tiles(state_filename)
+
+
+
 # Main program
 
 if __name__ == '__main__':
@@ -3789,10 +5405,13 @@ if __name__ == '__main__':
 	start_time = time.time()
 	message ("\n-- topo2osm v%s --\n" % version)
 
-	features = []        	# All geometry and tags
-	segments = []        	# Line segments which are shared by one or more polygons
+	features = TopoList()	# All geometry and tags
+	segments = TopoList()	# Line segments which are shared by one or more polygons
 	nodes = set()        	# Common nodes at intersections, including start/end nodes of segments [lon,lat]
-	place_names = []		# Place names ("ortnamn") from Lantmäteriet
+	node_table = NodeTable()	# Integer id for each unique node
+	place_names = TopoList()	# Place names ("ortnamn") from Lantmäteriet
+	source_tiles = {}			# Number of features, latest version and hash for each grid tile, for -incremental option
+	operation_counts = {}		# Operation counts of current stage for -counters option
 	building_tags = {}   	# Conversion table from building type to osm tag
 
 
@@ -3801,7 +5420,7 @@ if __name__ == '__main__':
 	if len(sys.argv) < 2:
 		message ("Please provide municipality, and optional data category parameter.\n")
 		message ("Data categories: %s\n" % ", ".join(data_categories))
-		message ("Options: -seanames, -baynames, -wetland, -nosimplify, -geojson\n\n")
+		message ("Options: -seanames, -baynames, -wetland, -nosimplify, -geojson, -planar, -profile, -pstats, -counters, -estimate, -checkpoint, -resume, -incremental, -change\n\n")
 		sys.exit()
 
 	# Get municipality
@@ -3867,6 +5486,26 @@ if __name__ == '__main__':
 		topo_tags = True
 	if "-geojson" in sys.argv or "-json" in sys.argv:
 		json_output = True
+	if "-planar" in sys.argv:
+		planar = True
+	if "-profile" in sys.argv:
+		profile = True
+	if "-pstats" in sys.argv:
+		profile = True
+		profile_stats = True
+	if "-counters" in sys.argv:
+		count_operations = True
+	if "-estimate" in sys.argv:
+		estimate_only = True
+	if "-checkpoint" in sys.argv:
+		checkpoint = True
+	if "-resume" in sys.argv:
+		resume = True
+		checkpoint = True
+	if "-incremental" in sys.argv:
+		incremental = True
+	if "-change" in sys.argv:
+		change_output = True
 
 	output_filename = "topo_%s_%s" % (municipality_id, municipality_name.replace(" ", "_"))
 	if data_category != "topo":
@@ -3876,28 +5515,16 @@ if __name__ == '__main__':
 	if debug:
 		output_filename += "_debug"
 
-	# Process data
-
-	load_topo_data(municipality_id, municipality_name, data_category)
-
-	if json_output:
-		save_geojson(output_filename + ".geojson")
-	else:
-		if data_category in ["topo", "hydro", "hydrografi"]:
-			if get_topo_rivers and topo_product != "Topo250":
-				load_topo_rivers()
-			combine_rivers()
+	if profile or count_operations:
+		stage_profile = StageProfile(output_filename + "_%s.pstats" if profile_stats else None)
 
-		create_relations_structure()
-		# Note: After this point, segments index should be fixed and feature['coordinates'] may not exactly match member segments.
+	# Process data
 
-		if data_category == "topo":
-			identify_islands()
-			if get_name:
-				get_place_names()
+	process_data(output_filename)
 
-		identify_intersections()
-		save_osm(output_filename + ".osm")
+	if profile and not estimate_only:
+		stage_profile.save(output_filename + "_profile.json", municipality_id=municipality_id,
+							municipality_name=municipality_name, topo_product=topo_product, data_category=data_category, planar=planar)
 
 	duration = time.time() - start_time
 	message ("\tTotal run time %s\n\n" % timeformat(duration))